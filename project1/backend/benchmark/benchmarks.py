@@ -0,0 +1,403 @@
+#
+# This file is the benchmark suite for the registry, balloting and detection hot paths. Results are written as json so
+# that runs from different commits can be compared.
+#
+# To run the benchmarks and compare them with an earlier run, run the following from the project1/ directory
+#
+# $ python -m backend.benchmark.benchmarks --sizes 1000,100000 --out after.json --compare before.json
+#
+# To compare the storage backends with each other, run
+#
+# $ python -m backend.benchmark.benchmarks --compare-backends
+#
+# To measure how much memory voter records take in each representation, run
+#
+# $ python -m backend.benchmark.benchmarks --memory-records 10000000
+#
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.detection.pii_detection import redact_free_text
+from backend.main.objects.ballot import Ballot, generate_ballot_number
+from backend.main.objects.ballot_number_pool import BallotNumberPool
+from backend.main.objects.voter import Voter, VoterStatus, encrypt_name, decrypt_name
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.storage import STORAGE_BACKEND_ENV, STORAGE_BACKENDS, configured_backend
+from backend.main.store.election_generator import ElectionConfig, COMMENT_WORDS, generate_election, load_election, \
+    synthetic_national_id
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_ITERATIONS = 200
+AGGREGATE_ITERATIONS = 5
+REGRESSION_THRESHOLD = 1.2
+
+# Agreed upper bounds for the median of a benchmark at a given size, in seconds. A run that goes over fails.
+BUDGETS = {
+    ("get_all_fraudulent_voters", 1_000_000): 3.0,
+}
+
+# A benchmark turns a data size and an iteration count into the operation to time and the arguments for each call.
+Setup = Callable[[int, int], Tuple[Callable, List[tuple]]]
+
+BENCHMARKS: Dict[str, Tuple[Setup, bool]] = {}
+
+
+def benchmark(name: str, sized: bool = True):
+    """
+    Registers a benchmark setup. Benchmarks that aren't sized don't depend on the data size, and are only run once.
+    """
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = (setup, sized)
+        return setup
+    return register
+
+
+def _election(size: int, **kwargs) -> ElectionConfig:
+    VotingStore.refresh_instance()
+    config = ElectionConfig(voter_count=size, seed=size, **kwargs)
+    load_election(config, VotingStore.get_instance())
+    return config
+
+
+def _unvoted_ballots(config: ElectionConfig, count: int) -> List[Tuple[str, str]]:
+    """
+    (national ID, ballot number) pairs of voters that haven't voted yet, with their last issued ballot
+    """
+    unvoted = []
+    for (national_id, _, _, status), ballots in generate_election(config):
+        if VoterStatus(status) == VoterStatus.REGISTERED_NOT_VOTED:
+            unvoted.append((national_id, ballots[-1][0]))
+            if len(unvoted) == count:
+                break
+    return unvoted
+
+
+def _comment(words: int, rng: random.Random) -> str:
+    return " ".join(rng.choices(COMMENT_WORDS, k=words)) + \
+        " call me at (839) 838-1627 or best_citizen@atlantisnet.co.atlantis, my id is 345-23-2334. Adam Smith"
+
+
+@benchmark("register_voter")
+def _register_voter(size: int, iterations: int):
+    _election(size)
+    return registry.register_voter, [(Voter("Adam", "Smith", synthetic_national_id(size + i, size)),)
+                                     for i in range(iterations)]
+
+
+@benchmark("issue_ballot")
+def _issue_ballot(size: int, iterations: int):
+    _election(size)
+    return balloting.issue_ballot, [(synthetic_national_id(i % size, size),) for i in range(iterations)]
+
+
+@benchmark("count_ballot")
+def _count_ballot(size: int, iterations: int):
+    config = _election(size, turnout_rate=0.0)
+    rng = random.Random(size)
+    return balloting.count_ballot, [(Ballot(ballot_number, "1", _comment(10, rng)), national_id)
+                                    for national_id, ballot_number in _unvoted_ballots(config, iterations)]
+
+
+@benchmark("invalidate_ballot")
+def _invalidate_ballot(size: int, iterations: int):
+    config = _election(size, turnout_rate=0.0, invalidation_rate=0.0)
+    return balloting.invalidate_ballot, [(ballot_number,)
+                                         for _, ballot_number in _unvoted_ballots(config, iterations)]
+
+
+@benchmark("verify_ballot")
+def _verify_ballot(size: int, iterations: int):
+    config = _election(size, turnout_rate=0.0)
+    return balloting.verify_ballot, _unvoted_ballots(config, iterations)
+
+
+@benchmark("compute_election_winner")
+def _compute_election_winner(size: int, iterations: int):
+    _election(size)
+    return balloting.compute_election_winner, [() for _ in range(min(iterations, AGGREGATE_ITERATIONS))]
+
+
+@benchmark("get_all_ballot_comments")
+def _get_all_ballot_comments(size: int, iterations: int):
+    _election(size)
+    return balloting.get_all_ballot_comments, [() for _ in range(min(iterations, AGGREGATE_ITERATIONS))]
+
+
+@benchmark("get_all_fraudulent_voters")
+def _get_all_fraudulent_voters(size: int, iterations: int):
+    # Every voter votes, and 1% of them vote twice
+    _election(size, turnout_rate=1.0, fraud_rate=0.01)
+    return balloting.get_all_fraudulent_voters, [() for _ in range(min(iterations, AGGREGATE_ITERATIONS))]
+
+
+@benchmark("redact_free_text")
+def _redact_free_text(size: int, iterations: int):
+    # Comments don't grow with the registry, so the size is capped to keep them at a realistic length
+    rng = random.Random(size)
+    return redact_free_text, [(_comment(min(size, 2000), rng), "Adam", "Smith") for _ in range(iterations)]
+
+
+@benchmark("encrypt_name", sized=False)
+def _encrypt_name(size: int, iterations: int):
+    return encrypt_name, [("Adam",) for _ in range(iterations)]
+
+
+@benchmark("decrypt_name", sized=False)
+def _decrypt_name(size: int, iterations: int):
+    return decrypt_name, [(encrypt_name("Adam"),) for _ in range(iterations)]
+
+
+@benchmark("generate_ballot_number", sized=False)
+def _generate_ballot_number(size: int, iterations: int):
+    return generate_ballot_number, [(synthetic_national_id(i),) for i in range(iterations)]
+
+
+@benchmark("issue_ballot_number", sized=False)
+def _issue_ballot_number(size: int, iterations: int):
+    # Filled up front, so that every call takes a pooled nonce as it would with the refill thread keeping up
+    pool = BallotNumberPool(low_watermark=0, high_watermark=iterations + 1)
+    pool.refill()
+    return pool.ballot_number, [(synthetic_national_id(i),) for i in range(iterations)]
+
+
+class _DictVoter:
+    """
+    A voter stored the way Voter was before it had __slots__, as the baseline of the memory benchmark
+    """
+    def __init__(self, first_name: str, last_name: str, national_id: str):
+        self.national_id = national_id
+        self.first_name = first_name
+        self.last_name = last_name
+
+
+# Ways of holding the same voter record, compared by the memory benchmark
+VOTER_REPRESENTATIONS: Dict[str, Callable[[str, str, str], object]] = {
+    "dict object": _DictVoter,
+    "slots object": Voter,
+    "row tuple": lambda first_name, last_name, national_id: (first_name, last_name, national_id),
+}
+
+
+def measure_voter_memory(record_count: int) -> dict:
+    """
+    Measures the memory it takes to hold the given number of voter records in every representation. The national IDs
+    are made up front, so only the records themselves are counted.
+
+    :returns: The bytes per record of every representation, and how much smaller each is than dict objects
+    """
+    national_ids = [synthetic_national_id(index) for index in range(record_count)]
+    bytes_per_record = {}
+    for name, make in VOTER_REPRESENTATIONS.items():
+        tracemalloc.start()
+        records = [make("Adam", "Smith", national_id) for national_id in national_ids]
+        bytes_per_record[name] = tracemalloc.get_traced_memory()[0] / record_count
+        tracemalloc.stop()
+        del records
+
+    baseline = bytes_per_record["dict object"]
+    for name, size in bytes_per_record.items():
+        print("{0:<14} {1:>8.1f} bytes per record, {2:>5.1f}% less than dict objects".format(
+            name, size, 100 * (1 - size / baseline)), file=sys.stderr)
+    return {
+        "records": record_count,
+        "bytes_per_record": bytes_per_record,
+        "reduction": {name: 1 - size / baseline for name, size in bytes_per_record.items()},
+    }
+
+
+def run_benchmark(name: str, size: int, iterations: int) -> dict:
+    """
+    Runs a single benchmark, timing every call separately
+
+    :returns: The result of the benchmark, as it is written to the results file
+    """
+    setup, _ = BENCHMARKS[name]
+    operation, all_args = setup(size, iterations)
+
+    timings = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for args in all_args:
+            start = time.perf_counter()
+            operation(*args)
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "name": name,
+        "size": size,
+        "iterations": len(timings),
+        "mean_s": sum(timings) / len(timings),
+        "median_s": timings[len(timings) // 2],
+        "p95_s": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_s": timings[0],
+        "max_s": timings[-1],
+    }
+
+
+def run_benchmarks(names: List[str], sizes: List[int], iterations: int, backend: Optional[str] = None) -> dict:
+    """
+    Runs the benchmarks at every size
+
+    :param: backend The storage backend to run on, defaults to the configured one
+    """
+    results = []
+    with _storage_backend(backend):
+        backend = configured_backend()
+        for name in names:
+            _, sized = BENCHMARKS[name]
+            for size in (sizes if sized else [0]):
+                result = run_benchmark(name, size, iterations)
+                print("{name:<28} size={size:<10} median={median:>12.1f}us p95={p95:>12.1f}us".format(
+                    name=name, size=size, median=result["median_s"] * 1e6, p95=result["p95_s"] * 1e6),
+                    file=sys.stderr)
+                results.append(result)
+        VotingStore.refresh_instance()
+
+    return {
+        "commit": _git_commit(),
+        "backend": backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Compares the medians of two runs
+
+    :returns: A description of every benchmark that got slower than the threshold allows
+    """
+    baseline_medians = {(result["name"], result["size"]): result["median_s"] for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = baseline_medians.get((result["name"], result["size"]))
+        if not before:
+            continue
+        ratio = result["median_s"] / before
+        print("{0:<28} size={1:<10} {2:>6.2f}x".format(result["name"], result["size"], ratio), file=sys.stderr)
+        if ratio > threshold:
+            regressions.append("{0} (size {1}) is {2:.2f}x slower than {3}".format(
+                result["name"], result["size"], ratio, baseline.get("commit")))
+    return regressions
+
+
+def compare_backends(names: List[str], sizes: List[int], iterations: int) -> Dict[str, dict]:
+    """
+    Runs the benchmarks on every storage backend, and prints how much faster each is than sqlite
+
+    :returns: The results of every backend, by backend name
+    """
+    runs = {backend: run_benchmarks(names, sizes, iterations, backend) for backend in STORAGE_BACKENDS}
+    sqlite_medians = {(result["name"], result["size"]): result["median_s"] for result in runs["sqlite"]["results"]}
+    for backend, run in runs.items():
+        if backend == "sqlite":
+            continue
+        for result in run["results"]:
+            print("{0:<28} size={1:<10} {2} is {3:>8.2f}x faster than sqlite".format(
+                result["name"], result["size"], backend,
+                sqlite_medians[(result["name"], result["size"])] / max(result["median_s"], 1e-9)), file=sys.stderr)
+    return runs
+
+
+def over_budget(current: dict) -> List[str]:
+    """
+    :returns: A description of every benchmark whose median went over its budget
+    """
+    failures = []
+    for result in current["results"]:
+        budget = BUDGETS.get((result["name"], result["size"]))
+        if budget is not None and result["median_s"] > budget:
+            failures.append("{0} (size {1}) took {2:.3f}s, over its budget of {3}s".format(
+                result["name"], result["size"], result["median_s"], budget))
+    return failures
+
+
+@contextlib.contextmanager
+def _storage_backend(backend: Optional[str]):
+    if backend is None:
+        yield
+        return
+    previous = os.environ.get(STORAGE_BACKEND_ENV)
+    os.environ[STORAGE_BACKEND_ENV] = backend
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[STORAGE_BACKEND_ENV]
+        else:
+            os.environ[STORAGE_BACKEND_ENV] = previous
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the registry, balloting and detection hot paths")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated numbers of registered voters")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--out", help="file to write the json results to, defaults to stdout")
+    parser.add_argument("--compare", help="json results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="slowdown ratio of the median that counts as a regression")
+    parser.add_argument("--backend", choices=STORAGE_BACKENDS, help="storage backend, defaults to the configured one")
+    parser.add_argument("--compare-backends", action="store_true",
+                        help="run on every storage backend and write all their results")
+    parser.add_argument("--memory-records", type=int,
+                        help="instead of timing, measure the memory of this many voter records")
+    args = parser.parse_args()
+
+    if args.memory_records:
+        json.dump(measure_voter_memory(args.memory_records), sys.stdout, indent=2)
+        return
+
+    names, sizes = args.benchmarks.split(","), [int(size) for size in args.sizes.split(",")]
+    if args.compare_backends:
+        runs = compare_backends(names, sizes, args.iterations)
+        if args.out:
+            with open(args.out, "w") as out:
+                json.dump(runs, out, indent=2)
+        else:
+            json.dump(runs, sys.stdout, indent=2)
+        return
+
+    results = run_benchmarks(names, sizes, args.iterations, args.backend)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(results, out, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+    failures = ["OVER BUDGET: " + failure for failure in over_budget(results)]
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            failures += ["REGRESSION: " + regression
+                         for regression in compare(json.load(baseline_file), results, args.threshold)]
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,21 @@
 # $ flask run
 #
 
-from flask import request
+from flask import Response, request, stream_with_context
 import backend.main.api.balloting as balloting
 import backend.main.api.registry as registry
 from backend.main.objects.voter import Voter, BallotStatus
 from backend.main.objects.ballot import Ballot
 from flask_api import FlaskAPI, status
+import json
 import jsons
 from flask_cors import CORS
+from backend.main.monitoring import metrics, profiling
 
 app = FlaskAPI(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:*", "http://127.0.0.1:*"]}})
+metrics.instrument_app(app)
+profiling.instrument_app(app)
 
 
 @app.route('/')
@@ -35,7 +39,7 @@ def count_ballot():
     voter_national_id = req_data['voter_national_id']
 
     ballot = Ballot(ballot_number, chosen_candidate_id, voter_comments)
-    result = balloting.count_ballot(ballot, voter_national_id)
+    result = balloting.count_ballot(ballot, voter_national_id, request.headers.get("Idempotency-Key"))
     return {"status": jsons.dumps(result.value)}, \
         status.HTTP_202_ACCEPTED if result == BallotStatus.BALLOT_COUNTED else status.HTTP_409_CONFLICT
 
@@ -45,6 +49,13 @@ def get_all_candidates():
     return jsons.dumps(registry.get_all_candidates())
 
 
+@app.route('/api/ballot_comments')
+def stream_ballot_comments():
+    # Newline-delimited json, one comment per line, streamed page by page so memory stays flat however many there are
+    lines = (json.dumps(comment) + "\n" for comment in balloting.iter_ballot_comments())
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+
 def populate_database():
     """
     This method is for you as a developer. This is where you can add more candidates for the election,
@@ -1,12 +1,17 @@
-from typing import Set, Optional
+from typing import Iterator, List, Set, Optional, Tuple
 
 from backend.main.objects.voter import Voter, BallotStatus,VoterStatus
 from backend.main.objects.candidate import Candidate
-from backend.main.objects.ballot import Ballot, generate_ballot_number
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.ballot_number_pool import issue_ballot_number
 from backend.main import api,store
-from backend.main.store.data_registry import VotingStore
+from backend.main.store.data_registry import DEFAULT_PAGE_SIZE, VotingStore
+from backend.main.store.result_cache import request_digest
+from backend.main.store.storage import VotingStorage
+from backend.main.monitoring import metrics
 
 
+@metrics.timed("balloting")
 def issue_ballot(voter_national_id: str) -> Optional[str]:
     """
     Issues a new ballot to a given voter. The ballot number of the new ballot. This method should NOT invalidate any old
@@ -17,12 +22,13 @@ def issue_ballot(voter_national_id: str) -> Optional[str]:
     """
 
     store = VotingStore.get_instance()
+    if not store.might_have_voter(voter_national_id):
+        return(None)
     
     votor_status=store.get_vote_status(voter_national_id)
-    print("votor_status",votor_status)
     if(votor_status):
-        # If the voter registered,Issues a new ballot to a given voter.
-        ballot_id= generate_ballot_number(voter_national_id)
+        # If the voter registered,Issues a new ballot to a given voter, from the pool of ballot numbers
+        ballot_id= issue_ballot_number(voter_national_id)
         #print("isuue:generate_ballot_numbe",ballot_id)
         
         store.new_ballot(voter_national_id,ballot_id)
@@ -32,7 +38,13 @@ def issue_ballot(voter_national_id: str) -> Optional[str]:
         #If the voter isn't registered, should return None
         return(None)
     
-def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
+# Results that changed the store. A retry of a request that got one of these must get the same answer back, rather
+# than being mistaken for a second ballot.
+RETRYABLE_RESULTS = {BallotStatus.BALLOT_COUNTED, BallotStatus.FRAUD_COMMITTED}
+
+
+@metrics.timed("balloting")
+def count_ballot(ballot: Ballot, voter_national_id: str, idempotency_key: Optional[str] = None) -> BallotStatus:
     """
     Validates and counts the ballot for the given voter. If the ballot contains a sensitive comment, this method will
     appropriately redact the sensitive comment.
@@ -44,21 +56,51 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     4. BallotStatus.BALLOT_COUNTED - If the ballot submitted in this request was successfully counted
     5. BallotStatus.VOTER_NOT_REGISTERED - If the voter is not registered
 
+    Submitting the exact same ballot again (or a request with the same idempotency key) shortly after it was counted is
+    treated as a client retry: the original Ballot Status is returned, and nothing is counted twice.
+
     :param: ballot The Ballot to count
     :param: voter_national_id The sensitive ID of the voter who the ballot corresponds to.
+    :param: idempotency_key Optional key chosen by the client, shared by all retries of the same request
     :returns: The Ballot Status after the ballot has been processed
     """
     store = VotingStore.get_instance()
+    sanitized_national_id = voter_national_id.replace("-", "").replace(" ", "").strip()
+    if idempotency_key:
+        key = request_digest(idempotency_key, ballot.ballot_number, sanitized_national_id)
+    else:
+        key = request_digest(ballot.ballot_number, str(ballot.chosen_candidate_id), ballot.voter_comments,
+                             sanitized_national_id)
+    return store.recent_count_results.get_or_compute(
+        key, lambda: _count_ballot_atomically(store, ballot, voter_national_id),
+        lambda result: result in RETRYABLE_RESULTS)
+
+
+def _count_ballot_atomically(store: VotingStorage, ballot: Ballot, voter_national_id: str) -> BallotStatus:
+    # Counting takes several commits; holding the write lock keeps aggregate snapshots from landing between them
+    with store.write_lock:
+        status = _count_ballot(store, ballot, voter_national_id)
+    # Counted here rather than in count_ballot, so that retries answered from the recent results aren't counted again
+    metrics.increment(metrics.BALLOT_OUTCOMES, status=status.name)
+    return status
+
+
+def _count_ballot(store: VotingStorage, ballot: Ballot, voter_national_id: str) -> BallotStatus:
+    # Never registered voters and never issued ballots are turned away without asking the database
+    if not store.might_have_voter(voter_national_id):
+        return(BallotStatus.VOTER_NOT_REGISTERED)
+    if not store.might_have_ballot(ballot.ballot_number):
+        return(BallotStatus.INVALID_BALLOT)
     
-    voter=store.get_vote(voter_national_id)
-    if voter==None:
-         return(BallotStatus.VOTER_NOT_REGISTERED)
-    
-     
+    # Only the status is read here; the voter's names are decrypted by the store if there is a comment to redact
     voter_status=store.get_vote_status(voter_national_id)
     print("voter_status---->",voter_status)
+    if voter_status==None or VoterStatus(voter_status)==VoterStatus.NOT_REGISTERED:
+         return(BallotStatus.VOTER_NOT_REGISTERED)
     ballot_status=store.get_ballot(ballot.ballot_number)
     print("ballot_status===>",ballot_status)
+    if ballot_status==None:
+        return(BallotStatus.INVALID_BALLOT)
     
     check_vote_ballot=store.check_specifically_and_valid(voter_national_id,ballot.ballot_number)
 
@@ -67,7 +109,7 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     
     
     if BallotStatus(ballot_status)==BallotStatus.VOTER_NOT_REGISTERED:
-        store.registory_ballot(ballot,str(BallotStatus.VOTER_NOT_REGISTERED.value),voter_national_id,voter)
+        store.registory_ballot(ballot,str(BallotStatus.VOTER_NOT_REGISTERED.value),voter_national_id)
         
         if VoterStatus(voter_status) == VoterStatus.REGISTERED_NOT_VOTED :
             store.update_vote_status(voter_national_id,str(VoterStatus.BALLOT_COUNTED.value))
@@ -93,6 +135,7 @@ def count_ballot(ballot: Ballot, voter_national_id: str) -> BallotStatus:
     
 
    
+@metrics.timed("balloting")
 def invalidate_ballot(ballot_number: str) -> bool:
     """
     Marks a ballot as invalid so that it cannot be used. This should only work on ballots that have NOT been cast. If a
@@ -104,6 +147,8 @@ def invalidate_ballot(ballot_number: str) -> bool:
               Otherwise will return Boolean TRUE.
     """
     store = VotingStore.get_instance()
+    if not store.might_have_ballot(ballot_number):
+        return(False)
     ballot_status=store.get_ballot(ballot_number)
    
     if ballot_status==None:
@@ -116,6 +161,22 @@ def invalidate_ballot(ballot_number: str) -> bool:
         store.update_ballot_status(ballot_number,str(BallotStatus.INVALID_BALLOT.value))
         return(True)
 
+@metrics.timed("balloting")
+def invalidate_outstanding_ballots(voter_national_id: str, except_ballot: Optional[str] = None) -> int:
+    """
+    Invalidates every ballot issued to the voter that hasn't been cast yet, e.g. once they were given a replacement.
+    Ballots that were already cast are left alone.
+
+    :param: voter_national_id The sensitive ID of the voter whose ballots to invalidate
+    :param: except_ballot The ballot number of a ballot to leave valid, typically the replacement
+    :returns: The number of ballots that were invalidated
+    """
+    store = VotingStore.get_instance()
+    if not store.might_have_voter(voter_national_id):
+        return 0
+    return store.invalidate_outstanding_ballots(voter_national_id, except_ballot)
+
+@metrics.timed("balloting")
 def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
     """
     Verifies the following:
@@ -143,6 +204,7 @@ def verify_ballot(voter_national_id: str, ballot_number: str) -> bool:
 # Aggregate API
 #
 
+@metrics.timed("balloting")
 def get_all_ballot_comments() -> Set[str]:
     """
     Returns a list of all the ballot comments that are non-empty.
@@ -151,6 +213,7 @@ def get_all_ballot_comments() -> Set[str]:
     store = VotingStore.get_instance()
     return store.get_comments()
 
+@metrics.timed("balloting")
 def compute_election_winner() -> Candidate:
     """
     Computes the winner of the election - the candidate that gets the most votes (even if there is not a majority).
@@ -159,6 +222,7 @@ def compute_election_winner() -> Candidate:
     store = VotingStore.get_instance()
     return store.get_winner()
 
+@metrics.timed("balloting")
 def get_all_fraudulent_voters() -> Set[str]:
     """
     Returns a complete list of voters who committed fraud. For example, if the following committed fraud:
@@ -171,3 +235,40 @@ def get_all_fraudulent_voters() -> Set[str]:
     store = VotingStore.get_instance()
     return store.fraudulent_voters()
 
+@metrics.timed("balloting")
+def get_ballot_comments_page(after: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+    """
+    Returns one page of the ballot comments that get_all_ballot_comments would return.
+
+    :param: after The cursor returned with the previous page, or 0 for the first page
+    :param: limit The most comments to return
+    :returns: The comments, and the cursor of the next page, or None if this was the last one
+    """
+    store = VotingStore.get_instance()
+    return store.get_comments_page(after, limit)
+
+def iter_ballot_comments(page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+    """
+    Yields the ballot comments that get_all_ballot_comments would return, without ever holding all of them in memory
+    """
+    store = VotingStore.get_instance()
+    return store.iter_comments(page_size)
+
+@metrics.timed("balloting")
+def get_fraudulent_voters_page(after: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+    """
+    Returns one page of the voters that get_all_fraudulent_voters would return.
+
+    :param: after The cursor returned with the previous page, or 0 for the first page
+    :param: limit The most voters to return
+    :returns: The voter names, and the cursor of the next page, or None if this was the last one
+    """
+    store = VotingStore.get_instance()
+    return store.fraudulent_voters_page(after, limit)
+
+def iter_fraudulent_voters(page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+    """
+    Yields the voters that get_all_fraudulent_voters would return, without ever holding all of them in memory
+    """
+    store = VotingStore.get_instance()
+    return store.iter_fraudulent_voters(page_size)
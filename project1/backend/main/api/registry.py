@@ -4,16 +4,21 @@
 #
 #from asyncio.windows_events import NULL
 #from asyncio.windows_events import NULL
-from typing import List
-from backend.main.objects.voter import Voter, VoterStatus
+from typing import Dict, Iterable, List
+from backend.main.objects.voter import Voter, VoterStatus, DeRegistrationStatus
 from backend.main.objects.candidate import Candidate
 from backend.main.store.data_registry import VotingStore
+from backend.main.monitoring import metrics
+
+# National IDs de-registered per transaction by de_register_voters
+DE_REGISTRATION_CHUNK_SIZE = 10_000
 
 #
 # Voter Registration
 #
 
 
+@metrics.timed("registry")
 def register_voter(voter: Voter) -> bool:
     """
     Registers a specific voter for the election. This method doesn't verify that the voter is eligible to vote or any
@@ -31,6 +36,7 @@ def register_voter(voter: Voter) -> bool:
 
 
 
+@metrics.timed("registry")
 def get_voter_status(voter_national_id: str) -> VoterStatus:
     """
     Checks to see if the specified voter is registered.
@@ -39,6 +45,8 @@ def get_voter_status(voter_national_id: str) -> VoterStatus:
     :returns: The status of the voter that best describes their situation
     """
     store = VotingStore.get_instance()
+    if not store.might_have_voter(voter_national_id):
+        return (VoterStatus.NOT_REGISTERED)
 
     voter=store.get_vote_status(voter_national_id)
     if voter==None :
@@ -48,6 +56,42 @@ def get_voter_status(voter_national_id: str) -> VoterStatus:
     #raise NotImplementedError()
 
 
+@metrics.timed("registry")
+def de_register_voters(voter_national_ids: Iterable[str], erase: bool = False,
+                       chunk_size: int = DE_REGISTRATION_CHUNK_SIZE) -> Dict[str, DeRegistrationStatus]:
+    """
+    De-registers a whole batch of voters, e.g. a week of erasure requests. Follows the same rule as de_register_voter:
+    voters who committed fraud stay registered. Every unused ballot of a de-registered voter becomes invalid.
+
+    The voters are processed in chunks, each in a single transaction, so a failure part way through leaves every
+    chunk either fully applied or untouched.
+
+    :param: voter_national_ids The sensitive IDs of the voters to de-register.
+    :param: erase Boolean TRUE to also delete the voters and their uncounted ballots from the registry. Their counted
+                  ballots stay in the tally, but no longer point back at them.
+    :param: chunk_size The number of voters per transaction
+    :returns: What happened to every national ID, keyed by the national ID as it was given.
+    """
+    store = VotingStore.get_instance()
+    report = {}
+    chunk: Dict[str, List[str]] = {}
+    for voter_national_id in voter_national_ids:
+        chunk.setdefault(voter_national_id.replace("-", "").replace(" ", "").strip(), []).append(voter_national_id)
+        if len(chunk) == chunk_size:
+            _de_register_chunk(store, chunk, erase, report)
+            chunk = {}
+    if chunk:
+        _de_register_chunk(store, chunk, erase, report)
+    return report
+
+
+def _de_register_chunk(store, chunk: Dict[str, List[str]], erase: bool, report: Dict[str, DeRegistrationStatus]):
+    for sanitized_national_id, status in store.de_register_voters(list(chunk), erase).items():
+        for voter_national_id in chunk[sanitized_national_id]:
+            report[voter_national_id] = status
+
+
+@metrics.timed("registry")
 def de_register_voter(voter_national_id: str) -> bool:
     """
     De-registers a voter from voting. This is to be used when the user requests to be removed from the system.
@@ -58,11 +102,12 @@ def de_register_voter(voter_national_id: str) -> bool:
     :returns: Boolean TRUE if de-registration was successful. Boolean FALSE otherwise.
     """
     store = VotingStore.get_instance()
-    if store.delete_Vote(voter_national_id):
-        store.update_vote_status(voter_national_id,str(VoterStatus.NOT_REGISTERED.value))
-        return(True)
-    else:
-        return(False)
+    with store.write_lock:
+        if store.delete_Vote(voter_national_id):
+            store.update_vote_status(voter_national_id,str(VoterStatus.NOT_REGISTERED.value))
+            return(True)
+        else:
+            return(False)
     #raise NotImplementedError()
 
 
@@ -70,6 +115,7 @@ def de_register_voter(voter_national_id: str) -> bool:
 # Candidate Registration (Already Implemented)
 #
 
+@metrics.timed("registry")
 def register_candidate(candidate_name: str):
     """
     Registers a candidate for the election, if not already registered.
@@ -78,6 +124,7 @@ def register_candidate(candidate_name: str):
     store.add_candidate(candidate_name)
 
 
+@metrics.timed("registry")
 def candidate_is_registered(candidate: Candidate) -> bool:
     """
     Checks to see if the specified candidate is registered.
@@ -89,6 +136,7 @@ def candidate_is_registered(candidate: Candidate) -> bool:
     return store.get_candidate(candidate.candidate_id) is not None
 
 
+@metrics.timed("registry")
 def get_all_candidates() -> List[Candidate]:
     store = VotingStore.get_instance()
     return store.get_all_candidates()
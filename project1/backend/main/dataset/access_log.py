@@ -0,0 +1,291 @@
+#
+# This file parses the access logs of the web portal, e.g. web portal data/access_log.log, which are in the Apache
+# combined log format:
+#
+#   96.172.175.66 - - [02/Sep/2021:14:38:45 -0400] "GET /list HTTP/1.0" 200 4988 "http://referer/" "Mozilla/5.0 ..."
+#
+# The log is memory mapped and split into chunks at line breaks, and the chunks are parsed in parallel on a pool of
+# worker processes with one precompiled pattern. A run reports the number of requests per path, status, method and
+# hour without keeping the lines themselves, so a log of any size takes memory bounded by the chunk size and the number
+# of distinct paths.
+#
+# Paths and query strings can hold PII, e.g. /patients/jane@example.com or ?ssn=..., so they go through the PII
+# patterns of the detection module before they are counted, and query parameters named after a kind of PII are
+# redacted whatever their values look like. A redacted copy of the log can be written too, with the client IPs and
+# users pseudonymized with the key of the de-identification module, or the IPs truncated to their network instead.
+#
+# To report on the log of the web portal and write a redacted copy, run the following from the project1/ directory
+#
+# $ python -m backend.main.dataset.access_log --redacted-log /tmp/access_log.log --out report.json
+#
+
+import argparse
+import ipaddress
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import quote, quote_plus, unquote, unquote_plus
+
+from backend.main.dataset.deidentification import pseudonym, pseudonym_key
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, WEB_PORTAL_DIR
+from backend.main.detection.pii_detection import redact_pii
+
+ACCESS_LOG = os.path.join(WEB_PORTAL_DIR, "access_log.log")
+
+LOG_LINE = re.compile(
+    rb'^(\S+) (\S+) (\S+) \[([^\]\n]+)\] "([A-Z]+) ([^" \n]+)(?: ([^"\n]*))?" (\d{3}|-) (\d+|-)'
+    rb'(?: "([^"\n]*)" "([^"\n]*)")?\r?$',
+    re.MULTILINE,
+)
+CLIENT, IDENT, USER, TIME, METHOD, TARGET, PROTOCOL, STATUS, SIZE, REFERER, AGENT = range(11)
+
+MONTHS = {month: index for index, month in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+# Query parameters whose values are PII whatever they look like
+QUERY_PII_KEYS = frozenset({
+    "name", "first", "last", "firstname", "lastname", "first_name", "last_name", "email", "phone", "ssn", "dob",
+    "birthdate", "address", "mrn", "patient", "user", "username",
+})
+REDACTED_QUERY_VALUE = "[REDACTED]"
+
+PSEUDONYM = "pseudonym"
+TRUNCATE = "truncate"
+IP_REDACTIONS = (PSEUDONYM, TRUNCATE)
+
+# Prefix lengths of the networks client IPs are truncated to
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+# The paths reported, the ones with the most requests
+DEFAULT_TOP_PATHS = 50
+
+# A chunk to parse: (path, start, end, how client IPs are redacted, or None to write no redacted copy)
+LogTask = Tuple[str, int, int, Optional[str]]
+
+
+def plan_log_chunks(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator[Tuple[str, int, int]]:
+    """
+    Splits a log into byte ranges of about chunk_bytes each, every one ending at a line break.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return
+    with open(path, "rb") as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            line_break = data.find(b"\n", min(start + chunk_bytes, size) - 1)
+            end = size if line_break == -1 else line_break + 1
+            yield path, start, end
+            start = end
+
+
+def hour_of(timestamp: str) -> str:
+    """
+    :returns: The hour of a log timestamp such as 02/Sep/2021:14:38:45 -0400, or 02/Sep/2021:14 -0400, as
+              2021-09-02T14-0400
+    """
+    try:
+        return "{0}-{1:02d}-{2}T{3}{4}".format(timestamp[7:11], MONTHS[timestamp[3:6]], timestamp[0:2],
+                                               timestamp[12:14], timestamp[-5:])
+    except KeyError:
+        return timestamp
+
+
+def redact_client(client: str, ip_redaction: str = PSEUDONYM) -> str:
+    """
+    :returns: The pseudonym of a client IP, or its network if ip_redaction is TRUNCATE
+    """
+    if client == "-":
+        return client
+    if ip_redaction == TRUNCATE:
+        try:
+            address = ipaddress.ip_address(client)
+        except ValueError:
+            return pseudonym(client)
+        prefix = IPV4_PREFIX if address.version == 4 else IPV6_PREFIX
+        return str(ipaddress.ip_network("{0}/{1}".format(address, prefix), strict=False).network_address)
+    return pseudonym(client)
+
+
+def redact_url(url: str, found: Counter) -> str:
+    """
+    Redacts the PII in the path and query string of a url or request target. Query parameters in QUERY_PII_KEYS are
+    redacted whatever their values, and everything else goes through the PII patterns.
+
+    :param: found The number of redactions of every kind is added to it
+    """
+    path, question_mark, query = url.partition("?")
+    unquoted = unquote(path)
+    redacted = redact_pii(unquoted, found)
+    if redacted != unquoted:
+        path = quote(redacted, safe="/:")
+    if not question_mark:
+        return path
+
+    parameters = []
+    for parameter in query.split("&"):
+        key, equals, value = parameter.partition("=")
+        unquoted = unquote_plus(value)
+        if key.lower() in QUERY_PII_KEYS and unquoted:
+            found["query_parameter"] += 1
+            value = quote_plus(REDACTED_QUERY_VALUE)
+        else:
+            redacted = redact_pii(unquoted, found)
+            if redacted != unquoted:
+                value = quote_plus(redacted)
+        parameters.append(key + equals + value)
+    return path + "?" + "&".join(parameters)
+
+
+def _redact_line(fields: Tuple[str, ...], ip_redaction: str, found: Counter) -> str:
+    request = "{0} {1}".format(fields[METHOD], redact_url(fields[TARGET], found))
+    if fields[PROTOCOL]:
+        request += " " + fields[PROTOCOL]
+    line = '{0} {1} {2} [{3}] "{4}" {5} {6}'.format(
+        redact_client(fields[CLIENT], ip_redaction), fields[IDENT],
+        fields[USER] if fields[USER] == "-" else pseudonym(fields[USER]), fields[TIME], request, fields[STATUS],
+        fields[SIZE])
+    if fields[REFERER] or fields[AGENT]:
+        line += ' "{0}" "{1}"'.format(redact_url(fields[REFERER], found), fields[AGENT])
+    return line + "\n"
+
+
+def parse_chunk(task: LogTask) -> dict:
+    """
+    Parses a chunk of a log. Runs in the worker processes.
+
+    :returns: {"start", "lines", "requests", "bytes_sent", "counts", "redactions", "redacted"}, with the requests per
+              (method, redacted path, status, hour) under counts, and the redacted lines under redacted if they were
+              asked for
+    """
+    path, start, end, ip_redaction = task
+    with open(path, "rb") as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        chunk = data[start:end]
+    lines = chunk.count(b"\n") + (0 if chunk.endswith(b"\n") else 1)
+    entries = LOG_LINE.findall(chunk)
+
+    # Lines are counted by their raw fields, with the timestamp cut to its hour, so only the distinct keys are decoded
+    raw_counts = Counter((entry[METHOD], entry[TARGET].partition(b"?")[0], entry[STATUS],
+                          entry[TIME][:14] + entry[TIME][-6:]) for entry in entries)
+    bytes_sent = sum(int(entry[SIZE]) for entry in entries if entry[SIZE] != b"-")
+    paths: Dict[bytes, str] = {}
+    counts = Counter()
+    for (method, target, status, hour), count in raw_counts.items():
+        if target not in paths:
+            paths[target] = redact_url(target.decode("utf-8", "surrogateescape"), Counter())
+        counts[method.decode(), paths[target], status.decode(), hour_of(hour.decode())] += count
+
+    found = Counter()
+    redacted = None
+    if ip_redaction is not None:
+        redacted = "".join(_redact_line(tuple(field.decode("utf-8", "surrogateescape") for field in entry),
+                                        ip_redaction, found) for entry in entries)
+    return {
+        "start": start,
+        "lines": lines,
+        "requests": len(entries),
+        "bytes_sent": bytes_sent,
+        "counts": counts,
+        "redactions": found,
+        "redacted": redacted,
+    }
+
+
+def _top(counts: Counter, limit: Optional[int] = None) -> Dict[str, int]:
+    return {key: count for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]}
+
+
+def parse_log(path: str = ACCESS_LOG, workers: Optional[int] = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+              redacted_path: Optional[str] = None, ip_redaction: str = PSEUDONYM,
+              top_paths: Optional[int] = DEFAULT_TOP_PATHS) -> dict:
+    """
+    Parses a log into the number of requests per path, status, method and hour.
+
+    :param: path The log to parse
+    :param: workers The number of worker processes, by default one per core
+    :param: redacted_path Where to write a redacted copy of the log, without the lines that couldn't be parsed
+    :param: ip_redaction How client IPs are redacted in the copy, PSEUDONYM or TRUNCATE
+    :param: top_paths The number of paths to report, the ones with the most requests, or None for every path
+    :returns: The aggregates, the redactions made in the copy, and the size and duration of the run
+    """
+    if ip_redaction not in IP_REDACTIONS:
+        raise ValueError("ip_redaction must be one of {0}, not {1!r}".format(IP_REDACTIONS, ip_redaction))
+    start = time.perf_counter()
+    pseudonym_key()
+    tasks = ((log_path, chunk_start, chunk_end, ip_redaction if redacted_path else None)
+             for log_path, chunk_start, chunk_end in plan_log_chunks(path, chunk_bytes))
+
+    lines = requests = bytes_sent = 0
+    counts = Counter()
+    redactions = Counter()
+    out = open(redacted_path, "w", encoding="utf-8", errors="surrogateescape") if redacted_path else None
+    try:
+        for chunk in run_tasks(parse_chunk, tasks, workers, ordered=out is not None):
+            lines += chunk["lines"]
+            requests += chunk["requests"]
+            bytes_sent += chunk["bytes_sent"]
+            counts.update(chunk["counts"])
+            redactions.update(chunk["redactions"])
+            if out is not None:
+                out.write(chunk["redacted"])
+    finally:
+        if out is not None:
+            out.close()
+
+    by_path, by_status, by_method, by_hour = Counter(), Counter(), Counter(), Counter()
+    for (method, request_path, status, hour), count in counts.items():
+        by_method[method] += count
+        by_path[request_path] += count
+        by_status[status] += count
+        by_hour[hour] += count
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(path)
+    return {
+        "path": path,
+        "redacted_path": redacted_path,
+        "bytes": size,
+        "lines": lines,
+        "requests": requests,
+        "malformed": lines - requests,
+        "bytes_sent": bytes_sent,
+        "distinct_paths": len(by_path),
+        "by_path": _top(by_path, top_paths),
+        "by_status": dict(sorted(by_status.items())),
+        "by_method": _top(by_method),
+        "by_hour": dict(sorted(by_hour.items())),
+        "redactions": dict(sorted(redactions.items())),
+        "seconds": seconds,
+        "megabytes_per_second": size / 1e6 / seconds if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parses, aggregates and redacts the access logs of the web portal")
+    parser.add_argument("path", nargs="?", default=ACCESS_LOG, help="log to parse, by default the web portal's")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--redacted-log", help="file to write a redacted copy of the log to")
+    parser.add_argument("--ip-redaction", choices=IP_REDACTIONS, default=PSEUDONYM,
+                        help="whether client IPs are pseudonymized or truncated to their network")
+    parser.add_argument("--top-paths", type=int, default=DEFAULT_TOP_PATHS, help="paths to report")
+    parser.add_argument("--out", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    report = parse_log(args.path, args.workers, args.chunk_bytes, args.redacted_log, args.ip_redaction,
+                       args.top_paths)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
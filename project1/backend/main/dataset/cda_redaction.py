@@ -0,0 +1,290 @@
+#
+# This file writes redacted copies of the HL7 CDA documents of subject access requests, e.g. the ones in the
+# "data request output" directory of the healthcare dataset.
+#
+# Documents are parsed with an incremental iterparse and written out as they are parsed: every element is written when
+# it starts and ends, and taken out of the tree as soon as it is written, so memory stays the same however large a
+# document is. The layout of the documents is kept as it is, and so are the codes of their entries.
+#
+#   name parts        given, family, prefix and suffix become [REDACTED NAME]
+#   addresses         street address lines and cities become [REDACTED ADDRESS], postal codes their 3 digit area
+#   telecom           the value of every telecom entry becomes [REDACTED TELECOM]
+#   birth times       become their year
+#   ids               UUID extensions, e.g. of the patient, become their pseudonym from the de-identification module
+#   everything else   text and comments go through the PII patterns of the detection module
+#
+# Redacted documents are named after the pseudonym of the patient UUID in their file name, as the file names of the
+# requests hold the names of the patients. Documents are redacted in parallel on a pool of worker processes.
+#
+# To redact the data request output of the patient health record system, run the following from the project1/
+# directory
+#
+# $ python -m backend.main.dataset.cda_redaction --out /tmp/redacted --workers 8
+#
+# Without --out, the documents are only inspected and the report says what would be redacted.
+#
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from backend.main.dataset.deidentification import generalize_zip, pseudonym, pseudonym_key
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import DATA_REQUEST_DIR, ENCODING
+from backend.main.detection.pii_detection import redact_pii
+
+CDA_NAMESPACE = "urn:hl7-org:v3"
+
+# Elements whose whole text is PII, with what it is replaced by and the kind it is counted as
+NAME_PARTS = ("given", "family", "prefix", "suffix")
+ADDRESS_PARTS = ("streetAddressLine", "city")
+REDACTED_TEXT = dict(
+    [(part, ("[REDACTED NAME]", "name")) for part in NAME_PARTS] +
+    [(part, ("[REDACTED ADDRESS]", "address")) for part in ADDRESS_PARTS]
+)
+
+UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+
+ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+def _redact_telecom(value: str) -> str:
+    return "[REDACTED TELECOM]"
+
+
+def _redact_birth_time(value: str) -> str:
+    return value[:4]
+
+
+def _redact_id(value: str) -> str:
+    return pseudonym(value) if UUID.fullmatch(value) else value
+
+
+# (element, attribute) whose values are PII, with how they are redacted and the kind they are counted as
+REDACTED_ATTRIBUTES = {
+    ("telecom", "value"): (_redact_telecom, "telecom"),
+    ("birthTime", "value"): (_redact_birth_time, "birth_time"),
+    ("id", "extension"): (_redact_id, "id"),
+}
+
+
+def redacted_name(path: str) -> str:
+    """
+    :returns: The file name of the redacted copy of a document, which doesn't give the patient away
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    patient = UUID.search(stem)
+    return pseudonym(patient.group(0) if patient else stem) + ".xml"
+
+
+class _StreamingRedactor:
+    """
+    Writes a redacted copy of a document from the events of iterparse. The text before a child element, or before
+    the end of an element, is known once the parser gets there, and is either the text of the element or the tail of
+    its last child, so an element only has to be kept until it ends and its tail is written.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.found = Counter()
+        self.elements = 0
+        # [element, local name, last child written] for every element that has started and not ended
+        self.stack = []
+        self.prefixes: Dict[str, str] = {}
+        self.declarations = []
+        self.qualified: Dict[str, str] = {}
+        # The last start tag written is only closed once it is known whether the element is empty
+        self.open_tag = False
+
+    def _qualify(self, name: str) -> str:
+        qualified = self.qualified.get(name)
+        if qualified is None:
+            if name[:1] == "{":
+                uri, local = name[1:].split("}", 1)
+                prefix = self.prefixes.get(uri, "")
+                qualified = "{0}:{1}".format(prefix, local) if prefix else local
+            else:
+                qualified = name
+            self.qualified[name] = qualified
+        return qualified
+
+    def _close_tag(self):
+        if self.open_tag:
+            self.out.write(">")
+            self.open_tag = False
+
+    def _write_text(self, text: Optional[str], local: Optional[str] = None):
+        if not text:
+            return
+        self._close_tag()
+        if local in REDACTED_TEXT and text.strip():
+            replacement, kind = REDACTED_TEXT[local]
+            self.found[kind] += 1
+            text = replacement
+        elif local == "postalCode" and text.strip():
+            self.found["zip"] += 1
+            text = generalize_zip(text)
+        elif text.strip():
+            text = redact_pii(text, self.found)
+        self.out.write(escape(text))
+
+    def _write_pending_text(self):
+        if self.stack:
+            element, local, last_child = self.stack[-1]
+            if last_child is None:
+                self._write_text(element.text, local)
+            else:
+                self._write_text(last_child.tail)
+
+    def _written(self, element):
+        """
+        Takes a written element out of the tree, keeping it only until its tail is written
+        """
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] = element
+            parent[0].remove(element)
+
+    def start_namespace(self, prefix: str, uri: str):
+        self.prefixes[uri] = prefix
+        self.declarations.append((prefix, uri))
+        self.qualified.clear()
+
+    def start(self, element):
+        self._write_pending_text()
+        self._close_tag()
+        self.elements += 1
+        local = element.tag.rsplit("}", 1)[-1]
+        tag = [self._qualify(element.tag)]
+        for prefix, uri in self.declarations:
+            tag.append('xmlns{0}="{1}"'.format(":" + prefix if prefix else "", escape(uri, ATTRIBUTE_ENTITIES)))
+        self.declarations = []
+        for name, value in element.attrib.items():
+            rule = REDACTED_ATTRIBUTES.get((local, name))
+            if rule is not None and value:
+                redacted = rule[0](value)
+                if redacted != value:
+                    self.found[rule[1]] += 1
+                    value = redacted
+            tag.append('{0}="{1}"'.format(self._qualify(name), escape(value, ATTRIBUTE_ENTITIES)))
+        self.out.write("<" + " ".join(tag))
+        self.open_tag = True
+        self.stack.append([element, local, None])
+
+    def end(self, element):
+        self._write_pending_text()
+        self.stack.pop()
+        if self.open_tag:
+            self.out.write("/>")
+            self.open_tag = False
+        else:
+            self.out.write("</{0}>".format(self._qualify(element.tag)))
+        self._written(element)
+
+    def comment(self, element):
+        self._write_pending_text()
+        self._close_tag()
+        self.out.write("<!--{0}-->".format(redact_pii(element.text or "", self.found)))
+        self._written(element)
+
+
+def redact_document(path: str, out_path: Optional[str] = None) -> dict:
+    """
+    Writes a redacted copy of a CDA document, reading and writing it as a stream.
+
+    :param: path The document to redact
+    :param: out_path Where to write the redacted copy, or None to only count what would be redacted
+    :returns: The size of the document, its number of elements and the redactions of every kind
+    """
+    start = time.perf_counter()
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+    with open(out_path or os.devnull, "w", encoding=ENCODING) as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        redactor = _StreamingRedactor(out)
+        for event, item in ET.iterparse(path, ("start-ns", "start", "end", "comment"), parser):
+            if event == "start":
+                redactor.start(item)
+            elif event == "end":
+                redactor.end(item)
+            elif event == "comment":
+                redactor.comment(item)
+            else:
+                redactor.start_namespace(*item)
+        out.write("\n")
+    return {
+        "source": path,
+        "path": out_path,
+        "bytes": os.path.getsize(path),
+        "elements": redactor.elements,
+        "redactions": dict(sorted(redactor.found.items())),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _redact_task(task: Tuple[str, Optional[str]]) -> dict:
+    return redact_document(*task)
+
+
+def redact_documents(paths: Iterable[str], out_dir: Optional[str] = None, workers: Optional[int] = None) -> dict:
+    """
+    Redacts the documents in parallel.
+
+    :param: paths The CDA documents to redact
+    :param: out_dir The directory to write the redacted copies to, or None to only inspect the documents
+    :param: workers The number of worker processes, by default one per core
+    :returns: The report of redact_document of every document under "documents", by the name of its redacted copy,
+              and the redactions, size and duration of the whole run
+    """
+    paths = sorted(paths)
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    pseudonym_key()
+    start = time.perf_counter()
+    tasks = ((path, None if out_dir is None else os.path.join(out_dir, redacted_name(path))) for path in paths)
+    documents = {}
+    redactions = Counter()
+    for report in run_tasks(_redact_task, tasks, workers):
+        documents[redacted_name(report["source"])] = report
+        redactions.update(report["redactions"])
+    seconds = time.perf_counter() - start
+    redacted_bytes = sum(report["bytes"] for report in documents.values())
+    return {
+        "documents": dict(sorted(documents.items())),
+        "redactions": dict(sorted(redactions.items())),
+        "bytes": redacted_bytes,
+        "elements": sum(report["elements"] for report in documents.values()),
+        "seconds": seconds,
+        "documents_per_second": len(documents) / seconds if seconds else None,
+        "megabytes_per_second": redacted_bytes / 1e6 / seconds if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redacts the CDA documents of subject access requests")
+    parser.add_argument("paths", nargs="*", help="CDA documents to redact, by default every document of the data "
+                                                 "request output")
+    parser.add_argument("--out", help="directory to write the redacted documents to, by default they are only "
+                                      "inspected")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--report", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    paths = args.paths or glob.glob(os.path.join(DATA_REQUEST_DIR, "*.xml"))
+    report = redact_documents(paths, args.out, args.workers)
+    if args.report:
+        with open(args.report, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#
+# This file classifies the columns of the healthcare dataset's csv tables by how likely they are to hold PII, from a
+# sample of their records, so that a scan only has to go through the cells of the columns that can't be told apart from
+# a sample. Most columns are clearly one or the other: SSN, DRIVERS, PASSPORT and ADDRESS are PII in every record,
+# while LAT, LON and HEALTHCARE_EXPENSES never are.
+#
+# Classes depend only on the column names of a table and the detection patterns, so they are cached under a hash of
+# both, and a new export with the layout of one seen before isn't sampled again.
+#
+# To classify and scan the patient health record system, keeping the classes for the next run, run the following from
+# the project1/ directory
+#
+# $ python -m backend.main.dataset.column_classifier --cache column-classes.json --out findings.json
+#
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from enum import Enum
+from typing import Dict, Iterable, List, Optional
+
+from backend.main.dataset.pii_scanner import DEFAULT_SAMPLE_LIMIT, merge_findings, run_tasks, scan_chunk, scan_tasks
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, PATIENT_RECORDS_DIR, list_tables, read_header, \
+    sample_records, table_name
+from backend.main.detection.pii_detection import PII_PATTERNS
+
+DEFAULT_SAMPLE_SIZE = 1000
+
+# Share of the sampled cells of a column that have to hold PII for the column to be PII
+DEFINITE_RATIO = 0.8
+# Fewest non-empty sampled cells a column is classified on; below that it is scanned in full
+MIN_SAMPLED_CELLS = 30
+
+# Columns whose header names a kind of PII are PII, whatever their sample looks like
+HEADER_HINTS = {
+    "ssn": {"SSN", "SOCIAL SECURITY NUMBER"},
+    "drivers_license": {"DRIVERS", "DRIVERS LICENSE", "DRIVER LICENSE"},
+    "passport": {"PASSPORT"},
+    "address": {"ADDRESS", "STREET", "STREET ADDRESS", "BILLING ADDRESS"},
+    "phone": {"PHONE", "TELEPHONE", "TELECOM", "PHONE NUMBER", "EMERGENCY PHONE"},
+    "email": {"EMAIL", "E-MAIL", "EMAIL ADDRESS"},
+    "name": {"FIRST", "LAST", "MAIDEN", "FIRST NAME", "LAST NAME", "MAIDEN NAME", "EMERGENCY CONTACT"},
+    "date_of_birth": {"DOB", "BIRTHDATE", "BIRTH DATE", "DATE OF BIRTH"},
+    "payment_card": {"CCN", "CARD NUMBER", "CREDIT CARD", "CREDIT CARD NUMBER", "CCN VISA / MASTER CARD / AMEX"},
+    "card_security_code": {"CVV", "CVC", "CVV2", "SECURITY CODE"},
+}
+HINT_CONFIDENCE = 0.9
+
+
+class ColumnClass(Enum):
+    """
+    How likely a column is to hold PII
+    """
+    DEFINITELY_PII = "definitely PII"
+    MAYBE_PII = "maybe PII"
+    CLEAN = "clean"
+
+
+def schema_hash(columns: List[str]) -> str:
+    """
+    :returns: The key the classes of a table with these columns are cached under
+    """
+    patterns = [[kind, pattern.pattern] for kind, pattern in PII_PATTERNS.items()]
+    return hashlib.sha256(json.dumps([columns, patterns]).encode()).hexdigest()
+
+
+def classify_column(column: str, cells: Iterable[str]) -> dict:
+    """
+    Classifies a column from a sample of its cells.
+
+    The confidence of a PII column is the share of its sampled cells that hold PII (at least HINT_CONFIDENCE if its
+    header names a kind of PII). The confidence of a clean column is 1 - 3/n for n sampled cells, the rule of three
+    bound on how often PII could be in it unseen. The confidence of a maybe column is the share of its sampled cells
+    that hold PII.
+
+    :returns: {"column", "class", "confidence", "sampled", "kinds": {kind: share of sampled cells}}
+    """
+    cells = [cell for cell in cells if cell]
+    hits = {kind: 0 for kind in PII_PATTERNS}
+    for cell in cells:
+        for kind, pattern in PII_PATTERNS.items():
+            if pattern.search(cell):
+                hits[kind] += 1
+    kinds = {kind: count / len(cells) for kind, count in hits.items() if count}
+    ratio = max(kinds.values(), default=0.0)
+    hinted = [kind for kind, headers in HEADER_HINTS.items() if column.strip().upper() in headers]
+
+    if hinted:
+        for kind in hinted:
+            kinds.setdefault(kind, 0.0)
+        column_class, confidence = ColumnClass.DEFINITELY_PII, max(ratio, HINT_CONFIDENCE)
+    elif len(cells) < MIN_SAMPLED_CELLS:
+        column_class, confidence = ColumnClass.MAYBE_PII, ratio
+    elif ratio >= DEFINITE_RATIO:
+        column_class, confidence = ColumnClass.DEFINITELY_PII, ratio
+    elif ratio == 0.0:
+        column_class, confidence = ColumnClass.CLEAN, 1 - 3 / len(cells)
+    else:
+        column_class, confidence = ColumnClass.MAYBE_PII, ratio
+    return {
+        "column": column,
+        "class": column_class.value,
+        "confidence": round(confidence, 4),
+        "sampled": len(cells),
+        "kinds": {kind: round(share, 4) for kind, share in sorted(kinds.items())},
+    }
+
+
+def classify_table(path: str, sample_size: int = DEFAULT_SAMPLE_SIZE) -> List[dict]:
+    """
+    :returns: The classify_column result for every column of the table, in order
+    """
+    columns, _ = read_header(path)
+    records = sample_records(path, sample_size)
+    return [classify_column(column, (record[index] for record in records)) for index, column in enumerate(columns)]
+
+
+class ClassificationCache:
+    """
+    Column classes by schema hash. With a path, they are kept in that json file across runs.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.classes: Dict[str, List[dict]] = {}
+        if path and os.path.exists(path):
+            with open(path) as cache_file:
+                self.classes = json.load(cache_file)
+
+    def get(self, schema: str) -> Optional[List[dict]]:
+        return self.classes.get(schema)
+
+    def put(self, schema: str, classes: List[dict]):
+        self.classes[schema] = classes
+        if self.path:
+            # Written next to the cache and moved over it, so an interrupted run never leaves half a cache behind
+            with open(self.path + ".tmp", "w") as cache_file:
+                json.dump(self.classes, cache_file, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def classify_tables(paths: Iterable[str], cache: Optional[ClassificationCache] = None,
+                    sample_size: int = DEFAULT_SAMPLE_SIZE) -> Dict[str, dict]:
+    """
+    Classifies the columns of every table, taking the classes from the cache where it has the table's schema.
+
+    :returns: {path: {"schema", "cached", "columns": [classify_column results]}}
+    """
+    cache = cache if cache is not None else ClassificationCache()
+    tables = {}
+    for path in paths:
+        schema = schema_hash(read_header(path)[0])
+        classes = cache.get(schema)
+        cached = classes is not None
+        if not cached:
+            classes = classify_table(path, sample_size)
+            cache.put(schema, classes)
+        tables[path] = {"schema": schema, "cached": cached, "columns": classes}
+    return tables
+
+
+def classify_and_scan(paths: Iterable[str], cache: Optional[ClassificationCache] = None,
+                      workers: Optional[int] = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                      sample_size: int = DEFAULT_SAMPLE_SIZE, sample_limit: int = DEFAULT_SAMPLE_LIMIT) -> dict:
+    """
+    Classifies the columns of the tables, then scans every cell of the maybe PII columns only. A maybe column the scan
+    finds no PII in is clean.
+
+    :returns: {"tables": {table: {"path", "schema", "cached", "records", "columns": [classes, with "findings" from
+              pii_scanner.merge_findings for the scanned ones]}}, plus the duration of both steps}
+    """
+    paths = list(paths)
+    start = time.perf_counter()
+    classified = classify_tables(paths, cache, sample_size)
+    classify_seconds = time.perf_counter() - start
+
+    to_scan = {path: tuple(index for index, column in enumerate(table["columns"])
+                           if column["class"] == ColumnClass.MAYBE_PII.value)
+               for path, table in classified.items()}
+    to_scan = {path: indexes for path, indexes in to_scan.items() if indexes}
+    findings = merge_findings(run_tasks(scan_chunk, scan_tasks(to_scan, chunk_bytes, sample_limit, to_scan), workers),
+                              sample_limit)
+    scan_seconds = time.perf_counter() - start - classify_seconds
+
+    tables = {}
+    for path, table in classified.items():
+        name = table_name(path)
+        columns = [dict(column) for column in table["columns"]]
+        scanned = findings.get(name)
+        for index in to_scan.get(path, ()):
+            column = columns[index]
+            column["findings"] = scanned["columns"].get(column["column"], {}) if scanned else {}
+            if not column["findings"]:
+                column["class"], column["confidence"] = ColumnClass.CLEAN.value, 1.0
+        tables[name] = {
+            "path": path,
+            "schema": table["schema"],
+            "cached": table["cached"],
+            "records": scanned["records"] if scanned else None,
+            "columns": columns,
+        }
+    return {"tables": tables, "classify_seconds": classify_seconds, "scan_seconds": scan_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classifies the columns of csv tables by PII, and scans the columns "
+                                                 "that can't be classified from a sample")
+    parser.add_argument("paths", nargs="*", help="csv tables to classify, by default every table of the patient "
+                                                 "health record system")
+    parser.add_argument("--cache", help="json file to keep the column classes in across runs")
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE, help="records sampled per table")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--out", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    report = classify_and_scan(args.paths or list_tables(PATIENT_RECORDS_DIR), ClassificationCache(args.cache),
+                               args.workers, args.chunk_bytes, args.sample_size)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
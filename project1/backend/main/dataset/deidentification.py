@@ -0,0 +1,267 @@
+#
+# This file writes de-identified copies of the csv tables of the healthcare dataset. Every column gets one transform:
+#
+#   drop       the column is left out, e.g. SSN, PASSPORT, FIRST, ADDRESS
+#   pseudonym  a keyed hash of the value, e.g. of the patient UUIDs in Id and PATIENT. The key is the same for every
+#              table, so a patient gets the same pseudonym everywhere and the tables can still be joined
+#   year       dates become their year, e.g. BIRTHDATE
+#   zip3       ZIP codes become their first 3 digits, or 000 for the 3 digit areas with fewer than 20,000 people
+#   redact     free text goes through the PII patterns of the detection module, e.g. DESCRIPTION
+#   keep       the column is copied as it is
+#
+# Columns with no transform of their own that the column classifier finds to be PII are dropped, and the ones it finds
+# may be PII are redacted and listed under "review" in the manifest, so that someone can give them a rule.
+#
+# The pseudonym key is read from the "dataset pseudonym key" secret. If it isn't set, a random key is made for the run,
+# and the pseudonyms can't be matched with those of any other run. To keep pseudonyms stable across runs and releases,
+# set it to the same base64 encoded 32 random bytes every time, e.g.
+#
+# $ env "dataset pseudonym key=$(cat /secrets/pseudonym.key)" python -m backend.main.dataset.deidentification --out ...
+#
+# Tables are transformed in chunks on a pool of worker processes. A chunk is turned into columns, each transform is
+# mapped over a whole column at once, and the chunks are written out in order, so a run takes time linear in the number
+# of records and memory bounded by the chunk size.
+#
+# To write de-identified copies of the patient health record system, run the following from the project1/ directory
+#
+# $ python -m backend.main.dataset.deidentification --out /tmp/deidentified
+#
+
+import argparse
+import csv
+import functools
+import hmac
+import io
+import json
+import os
+import re
+import sys
+import time
+from hashlib import sha256
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Crypto.Random import get_random_bytes
+
+from backend.main.dataset.column_classifier import ClassificationCache, ColumnClass, classify_tables
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, ENCODING, PATIENT_RECORDS_DIR, list_tables, plan_chunks, \
+    read_chunk, read_header, table_name
+from backend.main.detection.pii_detection import redact_pii
+from backend.main.store import secret_registry
+
+PSEUDONYM_KEY = "dataset pseudonym key"
+PSEUDONYM_KEY_BYTES = 32
+
+DROP = "drop"
+PSEUDONYM = "pseudonym"
+YEAR = "year"
+ZIP3 = "zip3"
+REDACT = "redact"
+KEEP = "keep"
+
+DEFAULT_RULES = {
+    "Id": PSEUDONYM,
+    "PATIENT": PSEUDONYM,
+    "ENCOUNTER": PSEUDONYM,
+    "BIRTHDATE": YEAR,
+    "DEATHDATE": YEAR,
+    "ZIP": ZIP3,
+    "DESCRIPTION": REDACT,
+    "REASONDESCRIPTION": REDACT,
+    "SSN": DROP,
+    "DRIVERS": DROP,
+    "PASSPORT": DROP,
+    "PREFIX": DROP,
+    "FIRST": DROP,
+    "LAST": DROP,
+    "SUFFIX": DROP,
+    "MAIDEN": DROP,
+    "FIRST NAME": DROP,
+    "LAST NAME": DROP,
+    "BIRTHPLACE": DROP,
+    "ADDRESS": DROP,
+    "LAT": DROP,
+    "LON": DROP,
+}
+
+# The 3 digit ZIP areas with 20,000 people or fewer, which the HIPAA safe harbor method turns into 000
+SPARSE_ZIP3 = frozenset({
+    "036", "059", "063", "102", "203", "556", "692", "790", "821", "823", "830", "831", "878", "879", "884", "890",
+    "893",
+})
+
+YEAR_PATTERN = re.compile(r"^(\d{4})-|/(\d{2}|\d{4})$")
+
+# (column index, transform) for every column that is written, in the order they are written
+ColumnPlan = Tuple[Tuple[int, str], ...]
+
+
+def pseudonym_key() -> bytes:
+    """
+    :returns: The key of the pseudonyms. If none was set, a random one is created that only lasts as long as the process,
+              so the pseudonyms won't match those of any other run.
+    """
+    key = secret_registry.get_secret_bytes(PSEUDONYM_KEY)
+    if not key:
+        key = get_random_bytes(PSEUDONYM_KEY_BYTES)
+        set_pseudonym_key(key)
+    return key
+
+
+def set_pseudonym_key(key: bytes):
+    """
+    Sets the key of the pseudonyms, e.g. to the one of an earlier release so that the pseudonyms match it. Pseudonyms
+    cached under the previous key are forgotten. The key must be changed through here, not in the secret directly.
+    """
+    secret_registry.overwrite_secret_bytes(PSEUDONYM_KEY, key)
+    pseudonym.cache_clear()
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def pseudonym(value: str) -> str:
+    """
+    Keyed hash of a value, formatted like a UUID. The same patient is in many records, so recent ones are cached.
+    """
+    if not value:
+        return value
+    digest = hmac.new(pseudonym_key(), value.strip().lower().encode(ENCODING), sha256).hexdigest()
+    return "{0}-{1}-{2}-{3}-{4}".format(digest[:8], digest[8:12], digest[12:16], digest[16:20], digest[20:32])
+
+
+def generalize_year(value: str) -> str:
+    """
+    :returns: The year of a date such as 1989-05-25 or 10/25/82, or the value itself if it isn't a date
+    """
+    match = YEAR_PATTERN.search(value)
+    return (match.group(1) or match.group(2)) if match else value
+
+
+def generalize_zip(value: str) -> str:
+    """
+    :returns: The first 3 digits of a ZIP code, or 000 for the sparsely populated areas
+    """
+    digits = value.strip()[:3]
+    if len(digits) < 3:
+        return value
+    return "000" if digits in SPARSE_ZIP3 else digits
+
+
+TRANSFORMS = {
+    PSEUDONYM: pseudonym,
+    YEAR: generalize_year,
+    ZIP3: generalize_zip,
+    REDACT: redact_pii,
+}
+
+
+def plan_columns(columns: List[str], rules: Dict[str, str], classes: Optional[List[dict]] = None) -> ColumnPlan:
+    """
+    Picks the transform of every column: its rule, or if it has none drop if it is PII, redact if it may be, or keep
+
+    :param: classes The column classes of the table, from the column classifier
+    """
+    plan = []
+    for index, column in enumerate(columns):
+        transform = rules.get(column.strip())
+        if transform is None:
+            column_class = classes[index]["class"] if classes is not None else None
+            if column_class == ColumnClass.DEFINITELY_PII.value:
+                transform = DROP
+            elif column_class == ColumnClass.MAYBE_PII.value:
+                transform = REDACT
+            else:
+                transform = KEEP
+        if transform not in (DROP, KEEP) and transform not in TRANSFORMS:
+            raise ValueError("Unknown transform {0!r} for column {1!r}".format(transform, column))
+        if transform != DROP:
+            plan.append((index, transform))
+    return tuple(plan)
+
+
+def deidentify_chunk(task: Tuple[str, int, int, ColumnPlan]) -> Tuple[int, str]:
+    """
+    Transforms a chunk of a table. Runs in the worker processes.
+
+    :returns: The number of records, and the transformed records as csv
+    """
+    path, start, end, plan = task
+    rows = [row for _, row in read_chunk(path, start, end)]
+    width = max((index for index, _ in plan), default=-1) + 1
+    rows = [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+
+    columns = list(zip(*rows)) if rows else [()] * width
+    out_columns = []
+    for index, transform in plan:
+        column = columns[index]
+        out_columns.append(column if transform == KEEP else list(map(TRANSFORMS[transform], column)))
+
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(zip(*out_columns))
+    return len(rows), out.getvalue()
+
+
+def deidentify_tables(paths: Iterable[str], out_dir: str, rules: Dict[str, str] = None,
+                      cache: Optional[ClassificationCache] = None, workers: Optional[int] = None,
+                      chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> dict:
+    """
+    Writes a de-identified copy of every table to out_dir, under the same file name.
+
+    :param: rules The transform of every column name, by default DEFAULT_RULES
+    :param: cache Where the column classes of the tables are cached
+    :returns: For every table the records written, the transform of every column, and the columns to review: those
+              with no rule that may be PII, and are redacted until they get one. Plus the duration of the run.
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    paths = list(paths)
+    os.makedirs(out_dir, exist_ok=True)
+    pseudonym_key()
+    start = time.perf_counter()
+    classes = classify_tables(paths, cache)
+
+    tables = {}
+    for path in paths:
+        columns, first_record = read_header(path)
+        plan = plan_columns(columns, rules, classes[path]["columns"])
+        out_path = os.path.join(out_dir, os.path.basename(path))
+        records = 0
+        with open(out_path, "w", encoding=ENCODING, newline="") as out:
+            csv.writer(out, lineterminator="\n").writerow([columns[index] for index, _ in plan])
+            tasks = ((path, chunk_start, chunk_end, plan)
+                     for _, chunk_start, chunk_end in plan_chunks(path, chunk_bytes, first_record))
+            for chunk_records, chunk_csv in run_tasks(deidentify_chunk, tasks, workers, ordered=True):
+                records += chunk_records
+                out.write(chunk_csv)
+        planned = dict(plan)
+        tables[table_name(path)] = {
+            "path": out_path,
+            "records": records,
+            "columns": {column: planned.get(index, DROP) for index, column in enumerate(columns)},
+            "review": [column for index, column in enumerate(columns) if column.strip() not in rules and
+                       classes[path]["columns"][index]["class"] == ColumnClass.MAYBE_PII.value],
+        }
+    return {"tables": tables, "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes de-identified copies of the csv tables of the healthcare "
+                                                 "dataset")
+    parser.add_argument("paths", nargs="*", help="csv tables to de-identify, by default every table of the patient "
+                                                 "health record system")
+    parser.add_argument("--out", required=True, help="directory to write the de-identified tables to")
+    parser.add_argument("--rules", help="json file of {column: transform} to use instead of the default rules")
+    parser.add_argument("--cache", help="json file the column classes are kept in across runs")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules) as rules_file:
+            rules = json.load(rules_file)
+    manifest = deidentify_tables(args.paths or list_tables(PATIENT_RECORDS_DIR), args.out, rules,
+                                 ClassificationCache(args.cache), args.workers, args.chunk_bytes)
+    json.dump(manifest, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+#
+# This file checks whether a table of the healthcare dataset is k-anonymous on its quasi-identifiers, and finds the
+# least lossy generalization of them that makes it so.
+#
+# The table is read once, on a pool of worker processes, into the count of records per combination of quasi-identifier
+# values. Every generalization is then worked out from those counts alone, never reading the table again, and the counts
+# of recently evaluated generalizations are memoized, to roll up the ones above them from. Since being k-anonymous
+# carries over to every generalization, and not being k-anonymous to every specialization, the search through the
+# lattice of generalizations only evaluates a fraction of them.
+#
+# Generalization hierarchies, from level 0 (the value as it is) up:
+#
+#   BIRTHDATE  1989-05-25, 1989-05, 1989, 1985-1989, 1980-1989, *
+#   ZIP        01013, 0101*, 010**, 01***, 0****, *****
+#   others     the value, *
+#
+# To check and generalize the patient table for k = 5, allowing 1% of the patients to be left out, run the following
+# from the project1/ directory
+#
+# $ python -m backend.main.dataset.k_anonymity --k 5 --max-suppression 0.01 --out generalized-patients.csv
+#
+
+import argparse
+import csv
+import itertools
+import json
+import operator
+import os
+import sys
+import time
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, ENCODING, PATIENT_RECORDS_DIR, plan_chunks, read_chunk, \
+    read_header
+
+QUASI_IDENTIFIERS = ("BIRTHDATE", "GENDER", "ZIP", "RACE", "COUNTY")
+SUPPRESSED = "*"
+
+# Records counted between checks of the number of classes of a generalization
+COUNT_BLOCK = 1 << 16
+
+# Generalizations whose counts are kept to roll others up from, besides the table's own classes
+DEFAULT_MAX_MEMOIZED = 32
+
+# Levels of generalization, one per quasi-identifier
+Node = Tuple[int, ...]
+
+
+def _suppress(value: str) -> str:
+    return SUPPRESSED
+
+
+def _mask_last_digit(value: str) -> str:
+    kept = len(value.rstrip(SUPPRESSED))
+    return value[:kept - 1] + SUPPRESSED * (len(value) - kept + 1) if kept else value
+
+
+def _month(value: str) -> str:
+    return value[:7]
+
+
+def _year(value: str) -> str:
+    return value[:4]
+
+
+def _year_range(width: int) -> Callable[[str], str]:
+    def generalize(value: str) -> str:
+        if not value[:4].isdigit():
+            return SUPPRESSED
+        first = int(value[:4]) // width * width
+        return "{0}-{1}".format(first, first + width - 1)
+    return generalize
+
+
+# For every quasi-identifier, the step from each level of generalization to the next
+HIERARCHIES: Dict[str, Tuple[Callable[[str], str], ...]] = {
+    "BIRTHDATE": (_month, _year, _year_range(5), _year_range(10), _suppress),
+    "ZIP": (_mask_last_digit,) * 5,
+}
+DEFAULT_HIERARCHY = (_suppress,)
+
+
+def hierarchy(quasi_identifier: str) -> Tuple[Callable[[str], str], ...]:
+    return HIERARCHIES.get(quasi_identifier, DEFAULT_HIERARCHY)
+
+
+def _count_chunk(task: Tuple[str, int, int, Tuple[int, ...]]) -> Counter:
+    path, start, end, indexes = task
+    counts = Counter()
+    for _, row in read_chunk(path, start, end):
+        counts[tuple(row[index] if index < len(row) else "" for index in indexes)] += 1
+    return counts
+
+
+def count_classes(path: str, quasi_identifiers: Sequence[str] = QUASI_IDENTIFIERS, workers: Optional[int] = None,
+                  chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Counter:
+    """
+    Reads the table once, counting the records of every equivalence class, i.e. combination of quasi-identifiers
+
+    :returns: {(quasi-identifier values): records}
+    """
+    columns, first_record = read_header(path)
+    missing = [column for column in quasi_identifiers if column not in columns]
+    if missing:
+        raise ValueError("{0} has no column {1}".format(path, ", ".join(missing)))
+    indexes = tuple(columns.index(column) for column in quasi_identifiers)
+    counts = Counter()
+    tasks = ((path, start, end, indexes) for _, start, end in plan_chunks(path, chunk_bytes, first_record))
+    for chunk_counts in run_tasks(_count_chunk, tasks, workers):
+        counts.update(chunk_counts)
+    return counts
+
+
+def class_report(counts: Counter, k: int) -> dict:
+    """
+    :returns: How far the equivalence classes are from k-anonymity: their number, the smallest, and how many records
+              are in classes smaller than k, by class size
+    """
+    small = Counter()
+    for size in counts.values():
+        if size < k:
+            small[size] += size
+    return {
+        "records": sum(counts.values()),
+        "classes": len(counts),
+        "smallest_class": min(counts.values(), default=0),
+        "records_below_k": sum(small.values()),
+        "records_below_k_by_class_size": {size: small[size] for size in sorted(small)},
+    }
+
+
+class GeneralizationLattice:
+    """
+    The equivalence classes of a table under every generalization of its quasi-identifiers, worked out from the counts
+    of the table's own classes, or of a memoized specialization with fewer classes, and memoized.
+
+    The table's classes are kept as one column of integer codes per quasi-identifier, and for every level of its
+    hierarchy, a list from each code to the code of its generalization. Counting the classes of a generalization is
+    then a matter of mapping, adding and counting integers, which happens in C rather than in Python.
+    """
+    def __init__(self, base_counts: Counter, quasi_identifiers: Sequence[str] = QUASI_IDENTIFIERS,
+                 max_memoized: int = DEFAULT_MAX_MEMOIZED):
+        self.quasi_identifiers = tuple(quasi_identifiers)
+        self.steps = [hierarchy(column) for column in self.quasi_identifiers]
+        self.max_levels: Node = tuple(len(steps) for steps in self.steps)
+        self.bottom: Node = (0,) * len(self.steps)
+        self.records = sum(base_counts.values())
+        self.weights = array("q", base_counts.values())
+        self.unit_weights = all(size == 1 for size in self.weights)
+
+        # For every quasi-identifier: the code of each of its values, the code of the value of every class, and for
+        # every level, the code of each value's generalization and the number of generalized values
+        self.codes: List[Dict[str, int]] = []
+        self.columns: List[array] = []
+        self.level_codes: List[List[List[int]]] = []
+        self.level_sizes: List[List[int]] = []
+        for position, steps in enumerate(self.steps):
+            values = sorted({key[position] for key in base_counts})
+            codes = {value: code for code, value in enumerate(values)}
+            self.codes.append(codes)
+            self.columns.append(array("q", (codes[key[position]] for key in base_counts)))
+            level_codes, level_sizes = [], []
+            for level in range(len(steps) + 1):
+                if level:
+                    values = [steps[level - 1](value) for value in values]
+                ranks: Dict[str, int] = {}
+                level_codes.append([ranks.setdefault(value, len(ranks)) for value in values])
+                level_sizes.append(len(ranks))
+            self.level_codes.append(level_codes)
+            self.level_sizes.append(level_sizes)
+
+        self.counts: "OrderedDict[Node, Counter]" = OrderedDict()
+        self.key_codes: Dict[Node, List[List[int]]] = {}
+        self.step_codes: Dict[Tuple[int, int, int], List[int]] = {}
+        self.generalized: List[Dict[Tuple[str, int], str]] = [{} for _ in self.steps]
+        self.max_memoized = max_memoized
+        self.rollups = 0
+
+    def nodes(self) -> List[Node]:
+        """
+        :returns: Every generalization, the most specific ones first
+        """
+        levels = itertools.product(*(range(max_level + 1) for max_level in self.max_levels))
+        return sorted(levels, key=lambda node: (sum(node), node))
+
+    def generalize(self, position: int, value: str, level: int) -> str:
+        """
+        Generalizes a value of a quasi-identifier to a level of its hierarchy
+        """
+        key = (value, level)
+        cache = self.generalized[position]
+        if key not in cache:
+            generalized = value
+            for step in self.steps[position][:level]:
+                generalized = step(generalized)
+            cache[key] = generalized
+        return cache[key]
+
+    def _key_codes(self, node: Node) -> List[List[int]]:
+        # The code of each value's generalization, times the place of the quasi-identifier in the key of a class
+        if node in self.key_codes:
+            return self.key_codes[node]
+        key_codes = []
+        place = 1
+        for position, level in enumerate(node):
+            key_codes.append([code * place for code in self.level_codes[position][level]])
+            place *= self.level_sizes[position][level]
+        self.key_codes[node] = key_codes
+        return key_codes
+
+    def class_key(self, node: Node, values: Sequence[str]) -> int:
+        """
+        :param: values The quasi-identifiers of a record of the table, as they are
+        :returns: The key of the record's class under the generalization, in counts_at
+        """
+        return sum(key_codes[self.codes[position][value]]
+                   for position, (key_codes, value) in enumerate(zip(self._key_codes(node), values)))
+
+    def _step_codes(self, position: int, from_level: int, to_level: int) -> List[int]:
+        # The code of each value generalized to from_level, generalized further to to_level
+        key = (position, from_level, to_level)
+        if key not in self.step_codes:
+            step_codes = [0] * self.level_sizes[position][from_level]
+            for code, generalized in zip(self.level_codes[position][from_level], self.level_codes[position][to_level]):
+                step_codes[code] = generalized
+            self.step_codes[key] = step_codes
+        return self.step_codes[key]
+
+    def _nearest_memoized(self, node: Node) -> Optional[Node]:
+        # The memoized specialization of the node with the fewest classes, if it has fewer than the table
+        specializations = [memoized for memoized in self.counts
+                           if all(level <= generalized for level, generalized in zip(memoized, node))]
+        nearest = min(specializations, key=lambda memoized: len(self.counts[memoized]), default=None)
+        return nearest if nearest is not None and len(self.counts[nearest]) < len(self.weights) else None
+
+    def _rolled_up_columns(self, source: Node, node: Node) -> Tuple[List[List[int]], List[List[int]]]:
+        # The classes of the source as columns of codes, and the key codes that map them onto the node's classes
+        keys = list(self.counts[source])
+        columns, key_codes = [], []
+        source_place = node_place = 1
+        for position, (source_level, level) in enumerate(zip(source, node)):
+            source_size = self.level_sizes[position][source_level]
+            columns.append([key // source_place % source_size for key in keys])
+            key_codes.append([code * node_place for code in self._step_codes(position, source_level, level)])
+            source_place *= source_size
+            node_place *= self.level_sizes[position][level]
+        return columns, key_codes
+
+    def counts_at(self, node: Node, max_classes: Optional[int] = None) -> Optional[Counter]:
+        """
+        Counts the classes of a generalization, rolling them up from the memoized specialization of it with the fewest
+        classes, or from the table's own classes if none has fewer
+
+        :param: max_classes Give up, returning None, as soon as the generalization is found to have more classes
+        :returns: The records per equivalence class under the generalization, keyed by class_key
+        """
+        if node in self.counts:
+            self.counts.move_to_end(node)
+            counts = self.counts[node]
+            return None if max_classes is not None and len(counts) > max_classes else counts
+
+        source = self._nearest_memoized(node)
+        if source is None:
+            columns, key_codes = self.columns, self._key_codes(node)
+        else:
+            self.counts.move_to_end(source)
+            columns, key_codes = self._rolled_up_columns(source, node)
+
+        keys = None
+        for node_codes, column in zip(key_codes, columns):
+            if not any(node_codes):
+                continue
+            generalized = map(node_codes.__getitem__, column)
+            keys = generalized if keys is None else map(operator.add, keys, generalized)
+        if keys is None:
+            keys = itertools.repeat(0, len(self.weights) if source is None else len(self.counts[source]))
+        if source is None and not self.unit_weights:
+            keys = itertools.chain.from_iterable(map(itertools.repeat, keys, self.weights))
+
+        # Counted a block at a time, so that a generalization with too many classes is given up on early. The classes
+        # of a memoized generalization are added up by their sizes rather than repeated once per record.
+        counts = Counter()
+        weights = None if source is None else iter(self.counts[source].values())
+        for block in iter(lambda: list(itertools.islice(keys, COUNT_BLOCK)), []):
+            if weights is None:
+                counts.update(block)
+            else:
+                for key, weight in zip(block, weights):
+                    counts[key] += weight
+            if max_classes is not None and len(counts) > max_classes:
+                return None
+
+        self.counts[node] = counts
+        if source is not None:
+            self.rollups += 1
+        if len(self.counts) > self.max_memoized:
+            self.counts.popitem(last=False)
+        return counts
+
+    def precision_loss(self, node: Node) -> float:
+        """
+        :returns: The mean share of its hierarchy each quasi-identifier is generalized by, from 0 (none) to 1 (all
+                  suppressed)
+        """
+        return sum(level / max_level for level, max_level in zip(node, self.max_levels)) / len(node)
+
+
+def information_loss(lattice: GeneralizationLattice, node: Node, k: int) -> dict:
+    """
+    :returns: The precision loss of the generalization, its discernibility (every record costs the size of its class,
+              or the size of the table if it is suppressed), the average class size relative to k, and the number of
+              records that have to be suppressed
+    """
+    counts = lattice.counts_at(node)
+    records = sum(counts.values())
+    suppressed = sum(size for size in counts.values() if size < k)
+    kept_classes = sum(1 for size in counts.values() if size >= k)
+    return {
+        "precision_loss": round(lattice.precision_loss(node), 4),
+        "discernibility": sum(size * size for size in counts.values() if size >= k) + suppressed * records,
+        "average_class_size": round((records - suppressed) / kept_classes / k, 4) if kept_classes else None,
+        "suppressed_records": suppressed,
+    }
+
+
+def _path_up(lattice: GeneralizationLattice, node: Node) -> List[Node]:
+    # A chain of ever more general nodes from the node to the top of the lattice
+    path = [node]
+    while node != lattice.max_levels:
+        position = next(position for position, (level, max_level) in enumerate(zip(node, lattice.max_levels))
+                        if level < max_level)
+        node = node[:position] + (node[position] + 1,) + node[position + 1:]
+        path.append(node)
+    return path
+
+
+def find_generalization(lattice: GeneralizationLattice, k: int,
+                        max_suppression: float = 0.0) -> Tuple[Optional[Node], dict]:
+    """
+    Finds the k-anonymous generalization that loses the least precision, breaking ties by discernibility.
+
+    A generalization is k-anonymous if at most max_suppression of the records are in classes smaller than k, those
+    records being left out. Every generalization of a k-anonymous one is k-anonymous too, and every specialization of
+    one that isn't, isn't either. So rather than evaluating every generalization, the search binary searches chains
+    of generalizations from the bottom of the lattice up, and every evaluation settles all the generalizations (or
+    specializations) of the one evaluated. The most specific generalizations, with as many classes as the table has
+    records, are mostly settled without being rolled up.
+
+    :returns: The levels of the generalization, or None if there is none, and how many generalizations were evaluated
+    """
+    records = lattice.records
+    allowed = int(max_suppression * records)
+    anonymous: List[Node] = []
+    not_anonymous: List[Node] = []
+    evaluated = 0
+
+    def settled(node: Node) -> Optional[bool]:
+        if any(all(a >= b for a, b in zip(node, found)) for found in anonymous):
+            return True
+        if any(all(a <= b for a, b in zip(node, found)) for found in not_anonymous):
+            return False
+        return None
+
+    # Classes of k records or more can't outnumber records / k, and each smaller one leaves out at least one record
+    max_classes = records // k + allowed
+
+    def evaluate(node: Node) -> bool:
+        nonlocal evaluated
+        evaluated += 1
+        counts = lattice.counts_at(node, max_classes)
+        is_anonymous = counts is not None and sum(size for size in counts.values() if size < k) <= allowed
+        (anonymous if is_anonymous else not_anonymous).append(node)
+        return is_anonymous
+
+    nodes = lattice.nodes()
+    for node in nodes:
+        if settled(node) is not None:
+            continue
+        path = [step for step in _path_up(lattice, node) if settled(step) is None]
+        low, high = 0, len(path) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            if settled(path[middle]) is None and evaluate(path[middle]):
+                high = middle - 1
+            elif settled(path[middle]) is False:
+                low = middle + 1
+            else:
+                high = middle - 1
+
+    # Precision loss grows with every level, so the best generalization is a minimal anonymous one
+    minimal = [node for node in nodes if settled(node) and
+               not any(settled(node[:position] + (level - 1,) + node[position + 1:])
+                       for position, level in enumerate(node) if level)]
+    best = None
+    if minimal:
+        least_loss = min(lattice.precision_loss(node) for node in minimal)
+        best = min((node for node in minimal if lattice.precision_loss(node) == least_loss),
+                   key=lambda node: information_loss(lattice, node, k)["discernibility"])
+    return best, {"lattice_size": len(nodes), "evaluated": evaluated, "minimal_anonymous": len(minimal),
+                  "rollups": lattice.rollups}
+
+
+def write_generalized(path: str, out_path: str, lattice: GeneralizationLattice, node: Node, k: int) -> int:
+    """
+    Writes a copy of the table with its quasi-identifiers generalized, leaving out the records of classes smaller than
+    k
+
+    :returns: The number of records written
+    """
+    columns, first_record = read_header(path)
+    indexes = [columns.index(column) for column in lattice.quasi_identifiers]
+    counts = lattice.counts_at(node)
+    written = 0
+    with open(out_path, "w", encoding=ENCODING, newline="") as out:
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(columns)
+        for _, start, end in plan_chunks(path, DEFAULT_CHUNK_BYTES, first_record):
+            for _, row in read_chunk(path, start, end):
+                row = row + [""] * (len(columns) - len(row))
+                values = [row[index] for index in indexes]
+                if counts[lattice.class_key(node, values)] < k:
+                    continue
+                for position, (index, value) in enumerate(zip(indexes, values)):
+                    row[index] = lattice.generalize(position, value, node[position])
+                writer.writerow(row)
+                written += 1
+    return written
+
+
+def anonymize(path: str, k: int, quasi_identifiers: Sequence[str] = QUASI_IDENTIFIERS, max_suppression: float = 0.0,
+              out_path: Optional[str] = None, workers: Optional[int] = None) -> dict:
+    """
+    Checks the table for k-anonymity, finds the generalization that makes it k-anonymous, and writes the generalized
+    table to out_path if given
+
+    :returns: The class_report of the table as it is, and the generalization found, with its information loss
+    """
+    start = time.perf_counter()
+    counts = count_classes(path, quasi_identifiers, workers)
+    counted = time.perf_counter()
+    lattice = GeneralizationLattice(counts, quasi_identifiers)
+    node, search = find_generalization(lattice, k, max_suppression)
+
+    report = {
+        "table": path,
+        "k": k,
+        "quasi_identifiers": list(quasi_identifiers),
+        "max_suppression": max_suppression,
+        "as_is": class_report(counts, k),
+        "search": search,
+        "generalization": None,
+    }
+    if node is not None:
+        report["generalization"] = {
+            "levels": dict(zip(quasi_identifiers, node)),
+            "classes": class_report(lattice.counts_at(node), k),
+            "information_loss": information_loss(lattice, node, k),
+        }
+        if out_path:
+            report["generalization"]["written_records"] = write_generalized(path, out_path, lattice, node, k)
+    report["count_seconds"] = counted - start
+    report["search_seconds"] = time.perf_counter() - counted
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks a csv table for k-anonymity on its quasi-identifiers, and "
+                                                 "generalizes them until it is")
+    parser.add_argument("path", nargs="?", default=os.path.join(PATIENT_RECORDS_DIR, "patients.csv"))
+    parser.add_argument("--k", type=int, required=True)
+    parser.add_argument("--quasi-identifiers", default=",".join(QUASI_IDENTIFIERS),
+                        help="comma separated quasi-identifier columns")
+    parser.add_argument("--max-suppression", type=float, default=0.0,
+                        help="share of the records that may be left out instead of generalizing further")
+    parser.add_argument("--out", help="file to write the generalized table to")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    args = parser.parse_args()
+
+    report = anonymize(args.path, args.k, args.quasi_identifiers.split(","), args.max_suppression, args.out,
+                       args.workers)
+    json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
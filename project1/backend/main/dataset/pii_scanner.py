@@ -0,0 +1,174 @@
+#
+# This file scans the csv tables of the healthcare dataset for PII with the patterns of the detection module. Tables
+# are split into chunks of whole records, and the chunks of every table are scanned in parallel by a pool of worker
+# processes, so a scan uses every core and only ever holds a few chunks in memory.
+#
+# The report says, for every column of every table, how many cells hold each kind of PII, and the byte offsets of the
+# first few records they were found in. Values themselves are never put in the report.
+#
+# To scan the patient health record system, run the following from the project1/ directory
+#
+# $ python -m backend.main.dataset.pii_scanner --workers 8 --out findings.json
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, PATIENT_RECORDS_DIR, list_tables, plan_chunks, \
+    read_chunk, read_header, table_name
+from backend.main.detection.pii_detection import PII_PATTERNS
+
+# Record offsets kept per column and kind of PII
+DEFAULT_SAMPLE_LIMIT = 5
+
+# Every non-empty cell of a column with one of these headers is a name, whatever it looks like
+NAME_COLUMN = re.compile(r"^(FIRST|LAST|MAIDEN)( NAME)?$", re.IGNORECASE)
+
+# A chunk to scan: (path, start, end, columns to scan, indexes of the name columns, sample limit)
+ScanTask = Tuple[str, int, int, Optional[Tuple[int, ...]], Tuple[int, ...], int]
+# What a chunk held: (path, records, {column: {kind: count}}, {column: {kind: [offsets]}})
+ChunkFindings = Tuple[str, int, Dict[int, Dict[str, int]], Dict[int, Dict[str, List[int]]]]
+
+
+def name_columns(columns: List[str]) -> Tuple[int, ...]:
+    """
+    :returns: The indexes of the columns whose header says they hold names
+    """
+    return tuple(index for index, column in enumerate(columns) if NAME_COLUMN.match(column.strip()))
+
+
+def scan_chunk(task: ScanTask) -> ChunkFindings:
+    """
+    Scans every cell of a chunk of a table. Runs in the worker processes.
+    """
+    path, start, end, columns, names, sample_limit = task
+    counts: Dict[int, Dict[str, int]] = {}
+    samples: Dict[int, Dict[str, List[int]]] = {}
+    records = 0
+    patterns = list(PII_PATTERNS.items())
+    for offset, row in read_chunk(path, start, end):
+        records += 1
+        for index in (range(len(row)) if columns is None else columns):
+            if index >= len(row) or not row[index]:
+                continue
+            cell = row[index]
+            kinds = [kind for kind, pattern in patterns if pattern.search(cell)]
+            if index in names and "name" not in kinds:
+                kinds.append("name")
+            for kind in kinds:
+                column_counts = counts.setdefault(index, {})
+                column_counts[kind] = column_counts.get(kind, 0) + 1
+                column_samples = samples.setdefault(index, {}).setdefault(kind, [])
+                if len(column_samples) < sample_limit:
+                    column_samples.append(offset)
+    return path, records, counts, samples
+
+
+def scan_tasks(paths: Iterable[str], chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+               sample_limit: int = DEFAULT_SAMPLE_LIMIT,
+               columns: Optional[Dict[str, Tuple[int, ...]]] = None) -> Iterator[ScanTask]:
+    """
+    Splits the tables into scan tasks. Nothing is read past the headers until a task is run.
+
+    :param: columns For the tables that shouldn't be scanned in full, the indexes of the columns to scan
+    """
+    for path in paths:
+        header, first_record = read_header(path)
+        only = None if columns is None or path not in columns else tuple(columns[path])
+        for _, start, end in plan_chunks(path, chunk_bytes, first_record):
+            yield path, start, end, only, name_columns(header), sample_limit
+
+
+def run_tasks(function, tasks: Iterable, workers: Optional[int] = None, ordered: bool = False) -> Iterator:
+    """
+    Runs the function on every task, on a pool of worker processes, yielding the results as they finish. With one
+    worker the tasks are run in this process.
+
+    :param: workers The number of worker processes, by default one per core
+    :param: ordered Yield the results in the order of the tasks instead
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(function, tasks)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from (pool.imap if ordered else pool.imap_unordered)(function, tasks)
+
+
+def merge_findings(findings: Iterable[ChunkFindings], sample_limit: int = DEFAULT_SAMPLE_LIMIT) -> Dict[str, dict]:
+    """
+    Adds up the findings of the chunks of every table.
+
+    :returns: {table: {"path", "records", "columns": {column: {kind: {"count", "samples"}}}}}, with the samples being
+              the offsets of the first records the kind was found in, whatever order the chunks finished in
+    """
+    headers: Dict[str, List[str]] = {}
+    tables: Dict[str, dict] = {}
+    for path, records, counts, samples in findings:
+        if path not in headers:
+            headers[path] = read_header(path)[0]
+            tables[path] = {"path": path, "records": 0, "columns": {}}
+        table = tables[path]
+        table["records"] += records
+        for index, kinds in counts.items():
+            column = headers[path][index] if index < len(headers[path]) else "#{0}".format(index)
+            column = column or "#{0}".format(index)
+            for kind, count in kinds.items():
+                finding = table["columns"].setdefault(column, {}).setdefault(kind, {"count": 0, "samples": []})
+                finding["count"] += count
+                finding["samples"] = sorted(finding["samples"] + samples[index][kind])[:sample_limit]
+    return {table_name(path): tables[path] for path in sorted(tables)}
+
+
+def scan_tables(paths: Iterable[str], workers: Optional[int] = None, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                sample_limit: int = DEFAULT_SAMPLE_LIMIT) -> dict:
+    """
+    Scans every cell of the tables for PII.
+
+    :param: paths The csv tables to scan
+    :param: workers The number of worker processes, by default one per core
+    :param: chunk_bytes The size of the chunks the tables are scanned in
+    :param: sample_limit The most record offsets to report per column and kind of PII
+    :returns: The findings of merge_findings under "tables", and the size and duration of the scan
+    """
+    paths = list(paths)
+    start = time.perf_counter()
+    findings = run_tasks(scan_chunk, scan_tasks(paths, chunk_bytes, sample_limit), workers)
+    tables = merge_findings(findings, sample_limit)
+    seconds = time.perf_counter() - start
+    scanned_bytes = sum(os.path.getsize(path) for path in paths)
+    return {
+        "tables": tables,
+        "bytes": scanned_bytes,
+        "seconds": seconds,
+        "megabytes_per_second": scanned_bytes / 1e6 / seconds if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scans the csv tables of the healthcare dataset for PII")
+    parser.add_argument("paths", nargs="*", help="csv tables to scan, by default every table of the patient health "
+                                                 "record system")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLE_LIMIT,
+                        help="record offsets to report per column and kind of PII")
+    parser.add_argument("--out", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    report = scan_tables(args.paths or list_tables(PATIENT_RECORDS_DIR), args.workers, args.chunk_bytes, args.samples)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#
+# This file answers subject access requests from the csv tables of the healthcare dataset without scanning them. A
+# sqlite index maps every patient to the byte ranges their records take up in every table, e.g. encounters.csv,
+# conditions.csv and observations.csv, so exporting a patient reads only that patient's records, straight out of a
+# memory map of each table.
+#
+# Consecutive records of the same patient are kept as one range, and the ranges are clustered by patient, so the index
+# stays a small fraction of the size of the tables and a lookup is a single range scan.
+#
+# The index is built once, on a pool of worker processes, and after that kept up to date incrementally: a table that
+# was only appended to has just its new bytes indexed, and a table that was rewritten is indexed again. A table counts
+# as appended to if it has grown, its header is the same and the bytes before the indexed end haven't changed.
+#
+# To build the index and export a patient, run the following from the project1/ directory
+#
+# $ python -m backend.main.dataset.sar_index --index /tmp/sar.sqlite3 update
+# $ python -m backend.main.dataset.sar_index --index /tmp/sar.sqlite3 export 1d604da9-9a81-4ba9-80c2-de3375d59b40
+#
+
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import time
+from hashlib import sha256
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import DEFAULT_CHUNK_BYTES, ENCODING, PATIENT_RECORDS_DIR, list_tables, \
+    parse_records, plan_chunks, read_chunk, read_header, table_name
+
+# The column that says whose record a record is. In the patients table it is the id of the record itself.
+PATIENT_COLUMN = "PATIENT"
+PATIENT_COLUMNS = {"patients": "Id"}
+
+# Bytes before the indexed end of a table that must be unchanged for it to count as appended to
+FINGERPRINT_BYTES = 4096
+
+UNCHANGED = "unchanged"
+APPENDED = "appended"
+INDEXED = "indexed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_tables (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    header_hash TEXT NOT NULL,
+    patient_column INTEGER NOT NULL,
+    indexed_bytes INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS record_ranges (
+    patient_id INTEGER NOT NULL,
+    table_id INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, table_id, start)
+) WITHOUT ROWID;
+"""
+
+# The records of a patient in a byte range of a table: (patient, start, end, records)
+RecordRange = Tuple[str, int, int, int]
+
+
+def patient_column(path: str, columns: List[str]) -> Optional[int]:
+    """
+    :returns: The index of the column of a table that holds the patient ids, or None if it has none
+    """
+    name = PATIENT_COLUMNS.get(table_name(path), PATIENT_COLUMN)
+    stripped = [column.strip() for column in columns]
+    return stripped.index(name) if name in stripped else None
+
+
+def header_hash(columns: List[str]) -> str:
+    return sha256("\x1f".join(columns).encode(ENCODING)).hexdigest()
+
+
+def fingerprint(path: str, first_record: int, indexed_bytes: int) -> str:
+    """
+    :returns: A hash of the bytes just before the indexed end of a table
+    """
+    start = max(first_record, indexed_bytes - FINGERPRINT_BYTES)
+    with open(path, "rb") as table:
+        table.seek(start)
+        return sha256(table.read(indexed_bytes - start)).hexdigest()
+
+
+def index_chunk(task: Tuple[str, int, int, int]) -> Tuple[str, int, List[RecordRange]]:
+    """
+    Finds the byte ranges of the records of every patient in a chunk of a table. Runs in the worker processes.
+
+    :returns: The path and start of the chunk, and its ranges in order
+    """
+    path, start, end, column = task
+    ranges: List[RecordRange] = []
+    patient, range_start, records = None, start, 0
+    for offset, row in read_chunk(path, start, end):
+        record_patient = row[column].strip() if column < len(row) else ""
+        if record_patient != patient:
+            if patient:
+                ranges.append((patient, range_start, offset, records))
+            patient, range_start, records = record_patient, offset, 0
+        records += 1
+    if patient:
+        ranges.append((patient, range_start, end, records))
+    return path, start, ranges
+
+
+def coalesce(ranges: Iterable[RecordRange]) -> List[RecordRange]:
+    """
+    Joins the ranges of a patient that follow each other, e.g. the ones a chunk boundary split up
+    """
+    joined: List[RecordRange] = []
+    for patient, start, end, records in ranges:
+        if joined and joined[-1][0] == patient and joined[-1][2] == start:
+            joined[-1] = (patient, joined[-1][1], end, joined[-1][3] + records)
+        else:
+            joined.append((patient, start, end, records))
+    return joined
+
+
+class SarIndex:
+    """
+    The on-disk index of the records of every patient, see the top of this file
+    """
+
+    def __init__(self, path: str):
+        """
+        :param: path The sqlite file the index is kept in, created if it doesn't exist
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _patient_ids(self, patients: Iterable[str]) -> Dict[str, int]:
+        patients = set(patients)
+        self.connection.executemany("INSERT OR IGNORE INTO patients (patient) VALUES (?)",
+                                    ((patient,) for patient in patients))
+        ids = {}
+        for patient in patients:
+            ids[patient] = self.connection.execute("SELECT id FROM patients WHERE patient = ?", (patient,)).fetchone()[0]
+        return ids
+
+    def _plan_update(self, path: str) -> Tuple[str, Optional[int], int]:
+        """
+        :returns: What has to be done to bring a table up to date, and the id of its entry and the offset to index
+                  it from
+        """
+        columns, first_record = read_header(path)
+        stat = os.stat(path)
+        entry = self.connection.execute(
+            "SELECT id, header_hash, indexed_bytes, mtime_ns, fingerprint FROM indexed_tables WHERE path = ?",
+            (path,)).fetchone()
+        if entry is None:
+            return INDEXED, None, first_record
+        table_id, indexed_hash, indexed_bytes, mtime_ns, indexed_fingerprint = entry
+        if stat.st_size == indexed_bytes and stat.st_mtime_ns == mtime_ns:
+            return UNCHANGED, table_id, indexed_bytes
+        if stat.st_size >= indexed_bytes and indexed_hash == header_hash(columns) and \
+                fingerprint(path, first_record, indexed_bytes) == indexed_fingerprint:
+            return APPENDED, table_id, indexed_bytes
+        return INDEXED, table_id, first_record
+
+    def update(self, paths: Iterable[str], workers: Optional[int] = None,
+               chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> dict:
+        """
+        Brings the index of every table up to date, indexing only what was appended to a table since it was last
+        indexed where possible. Tables without a patient column are left out.
+
+        :param: paths The csv tables to index
+        :param: workers The number of worker processes, by default one per core
+        :returns: For every table what was done, and the bytes and ranges indexed, and the duration of the update
+        """
+        start = time.perf_counter()
+        tables = {}
+        tasks = []
+        plans = {}
+        for path in sorted(os.path.abspath(path) for path in paths):
+            columns, first_record = read_header(path)
+            column = patient_column(path, columns)
+            if column is None:
+                continue
+            action, table_id, offset = self._plan_update(path)
+            size = os.path.getsize(path)
+            plans[path] = (action, table_id, offset, size, columns, first_record, column)
+            tables[table_name(path)] = {"path": path, "action": action, "bytes": size - offset, "ranges": 0}
+            if action != UNCHANGED:
+                tasks.extend((path, chunk_start, chunk_end, column)
+                             for _, chunk_start, chunk_end in plan_chunks(path, chunk_bytes, offset))
+
+        found: Dict[str, List[Tuple[int, List[RecordRange]]]] = {path: [] for path in plans}
+        for path, chunk_start, ranges in run_tasks(index_chunk, tasks, workers):
+            found[path].append((chunk_start, ranges))
+
+        with self.connection:
+            for path, (action, table_id, offset, size, columns, first_record, column) in plans.items():
+                if action == UNCHANGED:
+                    continue
+                ranges = coalesce(record_range for _, chunk in sorted(found[path]) for record_range in chunk)
+                table_id = self._store(path, action, table_id, ranges, columns, first_record, column, size)
+                tables[table_name(path)]["ranges"] = len(ranges)
+        return {"tables": tables, "seconds": time.perf_counter() - start}
+
+    def _store(self, path: str, action: str, table_id: Optional[int], ranges: List[RecordRange],
+               columns: List[str], first_record: int, column: int, size: int) -> int:
+        entry = (header_hash(columns), column, size, os.stat(path).st_mtime_ns,
+                 fingerprint(path, first_record, size))
+        if table_id is None:
+            table_id = self.connection.execute(
+                "INSERT INTO indexed_tables (path, header_hash, patient_column, indexed_bytes, mtime_ns, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (path,) + entry).lastrowid
+        else:
+            self.connection.execute(
+                "UPDATE indexed_tables SET header_hash = ?, patient_column = ?, indexed_bytes = ?, mtime_ns = ?, "
+                "fingerprint = ? WHERE id = ?", entry + (table_id,))
+            if action == INDEXED:
+                self.connection.execute("DELETE FROM record_ranges WHERE table_id = ?", (table_id,))
+
+        ids = self._patient_ids(patient for patient, _, _, _ in ranges)
+        if action == APPENDED and ranges:
+            # The first new records can carry on the last range of the same patient
+            patient, start, end, records = ranges[0]
+            extended = self.connection.execute(
+                "UPDATE record_ranges SET end = ?, records = records + ? "
+                "WHERE patient_id = ? AND table_id = ? AND end = ?", (end, records, ids[patient], table_id, start))
+            if extended.rowcount:
+                ranges = ranges[1:]
+        self.connection.executemany(
+            "INSERT INTO record_ranges (patient_id, table_id, start, end, records) VALUES (?, ?, ?, ?, ?)",
+            ((ids[patient], table_id, start, end, records) for patient, start, end, records in ranges))
+        return table_id
+
+    def ranges(self, patient: str) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        :returns: The byte ranges of the records of the patient, by the path of every table they are in
+        """
+        ranges: Dict[str, List[Tuple[int, int]]] = {}
+        for path, start, end in self.connection.execute(
+                "SELECT indexed_tables.path, start, end FROM record_ranges "
+                "JOIN patients ON patients.id = record_ranges.patient_id "
+                "JOIN indexed_tables ON indexed_tables.id = record_ranges.table_id "
+                "WHERE patients.patient = ? ORDER BY indexed_tables.path, start", (patient.strip(),)):
+            ranges.setdefault(path, []).append((start, end))
+        return ranges
+
+    def export(self, patient: str, refresh: bool = True) -> dict:
+        """
+        Reads every record of a patient, for a subject access request. Only the patient's own records are read.
+
+        :param: patient The id of the patient
+        :param: refresh Bring the index of the tables up to date first, so that records appended since are included
+        :returns: {"patient", "records", "tables": {table: {"columns", "records"}}}
+        """
+        patient = patient.strip()
+        if refresh:
+            paths = [path for path, in self.connection.execute("SELECT path FROM indexed_tables")]
+            self.update(paths, workers=1)
+        tables = {}
+        for path, ranges in self.ranges(patient).items():
+            columns, _ = read_header(path)
+            records = []
+            with open(path, "rb") as table, mmap.mmap(table.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for start, end in ranges:
+                    records.extend(row for _, row in parse_records(data[start:end], start))
+            tables[table_name(path)] = {"columns": columns, "records": records}
+        return {
+            "patient": patient,
+            "records": sum(len(table["records"]) for table in tables.values()),
+            "tables": dict(sorted(tables.items())),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexes the csv tables of the healthcare dataset by patient, and "
+                                                 "exports the records of a patient")
+    parser.add_argument("--index", required=True, help="sqlite file the index is kept in")
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="builds the index, or brings it up to date")
+    update.add_argument("paths", nargs="*", help="csv tables to index, by default every table of the patient health "
+                                                 "record system")
+    update.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    update.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    export = commands.add_parser("export", help="exports every record of a patient")
+    export.add_argument("patient", help="id of the patient")
+    export.add_argument("--out", help="file to write the json export to, defaults to stdout")
+    args = parser.parse_args()
+
+    with SarIndex(args.index) as index:
+        if args.command == "update":
+            json.dump(index.update(args.paths or list_tables(PATIENT_RECORDS_DIR), args.workers, args.chunk_bytes),
+                      sys.stdout, indent=2)
+        elif args.out:
+            with open(args.out, "w") as out:
+                json.dump(index.export(args.patient), out, indent=2)
+        else:
+            json.dump(index.export(args.patient), sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#
+# This file reads the csv tables of the healthcare dataset in project2. Tables are split into byte ranges that start and
+# end on record boundaries, so that every range can be parsed on its own, by any process, without reading the rest of
+# the file.
+#
+
+import csv
+import glob
+import itertools
+import os
+from typing import Iterator, List, Tuple
+
+DATASET_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "project2",
+                                            "PENDC2-PROJECT-data set"))
+PATIENT_RECORDS_DIR = os.path.join(DATASET_DIR, "patient health record system")
+DATA_REQUEST_DIR = os.path.join(PATIENT_RECORDS_DIR, "data request output")
+EXPORT_DIR = os.path.join(DATASET_DIR, "export")
+WEB_PORTAL_DIR = os.path.join(DATASET_DIR, "web portal data")
+
+# Bytes of a table parsed at once. Memory per worker stays around a few times this, whatever the size of the table.
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+ENCODING = "utf-8"
+BYTE_ORDER_MARK = b"\xef\xbb\xbf"
+
+# A byte range of a table: (path, start, end)
+Chunk = Tuple[str, int, int]
+
+
+def list_tables(directory: str = PATIENT_RECORDS_DIR) -> List[str]:
+    """
+    :returns: The paths of the csv tables in the directory, sorted by name
+    """
+    return sorted(glob.glob(os.path.join(directory, "*.csv")))
+
+
+def table_name(path: str) -> str:
+    """
+    :returns: The name a table is reported under, e.g. "patients" for .../patients.csv
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _read_record(table) -> bytes:
+    # A newline inside a quoted field doesn't end the record; the quotes seen so far are odd until the field closes
+    record = table.readline()
+    while record.count(b'"') % 2:
+        line = table.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def read_header(path: str) -> Tuple[List[str], int]:
+    """
+    :returns: The column names of the table, and the byte offset of its first record
+    """
+    with open(path, "rb") as table:
+        record = _read_record(table)
+        offset = table.tell()
+    if record.startswith(BYTE_ORDER_MARK):
+        record = record[len(BYTE_ORDER_MARK):]
+    columns = next(csv.reader([record.decode(ENCODING, errors="replace").rstrip("\r\n")]), [])
+    return columns, offset
+
+
+def plan_chunks(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES, start: int = None) -> Iterator[Chunk]:
+    """
+    Splits a table into byte ranges of about chunk_bytes each, every one holding whole records only.
+
+    :param: start The byte offset to start at, by default the first record after the header
+    """
+    if start is None:
+        start = read_header(path)[1]
+    size = os.path.getsize(path)
+    with open(path, "rb") as table:
+        while start < size:
+            if size - start <= chunk_bytes:
+                yield path, start, size
+                return
+            table.seek(start)
+            quotes = table.read(chunk_bytes).count(b'"')
+            # Finish the line the range ends in, then keep going until every quoted field is closed
+            line = table.readline()
+            quotes += line.count(b'"')
+            while quotes % 2 and line:
+                line = table.readline()
+                quotes += line.count(b'"')
+            end = table.tell()
+            yield path, start, end
+            start = end
+
+
+def read_chunk(path: str, start: int, end: int) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Parses the records in a byte range returned by plan_chunks.
+
+    :returns: (byte offset of the record, fields) for every non-empty record in the range
+    """
+    with open(path, "rb") as table:
+        table.seek(start)
+        data = table.read(end - start)
+    return parse_records(data, start)
+
+
+def parse_records(data: bytes, start: int = 0) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Parses records that were read from a table, e.g. a byte range returned by plan_chunks.
+
+    :param: start The byte offset the data was read from
+    :returns: (byte offset of the record, fields) for every non-empty record in the data
+    """
+    lines = data.split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    offsets = []
+    offset = start
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line) + 1
+
+    reader = csv.reader(line.decode(ENCODING, errors="replace") + "\n" for line in lines)
+    first_line = 0
+    for row in reader:
+        if row:
+            yield offsets[first_line], row
+        first_line = reader.line_num
+
+
+def sample_records(path: str, sample_size: int = 1000, spots: int = 8,
+                   window_bytes: int = 64 * 1024) -> List[List[str]]:
+    """
+    Reads about sample_size records from evenly spread places in a table, reading at most spots * window_bytes of
+    it. A place is entered at the next line break, so in tables with line breaks inside quoted fields a sampled record
+    can be cut; records with the wrong number of fields are left out for that reason.
+    """
+    columns, first_record = read_header(path)
+    size = os.path.getsize(path)
+    per_spot = -(-sample_size // spots)
+    records: List[List[str]] = []
+    with open(path, "rb") as table:
+        end = first_record
+        for spot in range(spots):
+            start = first_record + (size - first_record) * spot // spots
+            if start <= end:
+                start = end
+            else:
+                table.seek(start)
+                start += len(table.readline())
+            if start >= size:
+                break
+            table.seek(start)
+            window = table.read(window_bytes)
+            end = start + len(window) if start + len(window) >= size else start + window.rfind(b"\n") + 1
+            spot_records = (row for _, row in read_chunk(path, start, end) if len(row) == len(columns))
+            records.extend(itertools.islice(spot_records, per_spot))
+    return records[:sample_size]
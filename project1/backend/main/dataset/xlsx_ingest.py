@@ -0,0 +1,463 @@
+#
+# This file ingests the multi-part xlsx workbooks of the healthcare dataset, e.g. patient-registration.db-part1..5.xlsx
+# in the web portal data, into a single sqlite cache, so analyses read one table per dataset instead of parsing every
+# workbook again.
+#
+# A workbook is read as a stream, straight out of its zip archive: rows are parsed with an incremental iterparse and
+# taken out of the tree as soon as they are read, so only the shared strings of a part are held in memory whatever its
+# size. Parts are read in parallel on a pool of worker processes, each into a temporary sqlite file of its own, so
+# records never pile up in memory or get sent between processes. Every part of a dataset must have the same header,
+# and as soon as the last part of a dataset is read, the rows of its parts are merged into one table of the cache,
+# with the part and row every record came from.
+#
+# The columns of every dataset are classified with the column classifier, and kept in the cache with it. A later run
+# uses the cache unless a part was added, removed or changed: a part whose size and mtime changed is hashed, and only
+# counts as changed if its hash did too.
+#
+# Parts that are encrypted with a password, as some of the web portal data is, can't be read. They are reported and
+# left out of the merged table, and the dataset is marked incomplete.
+#
+# To ingest the web portal data, run the following from the project1/ directory
+#
+# $ python -m backend.main.dataset.xlsx_ingest --cache /tmp/portal.sqlite3 --workers 8
+#
+
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from hashlib import sha256
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.main.dataset.column_classifier import DEFAULT_SAMPLE_SIZE, classify_column
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.dataset.tables import WEB_PORTAL_DIR
+
+SPREADSHEET_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_NAMESPACE = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_RELATIONSHIP_NAMESPACE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+ROW = SPREADSHEET_NAMESPACE + "row"
+CELL = SPREADSHEET_NAMESPACE + "c"
+VALUE = SPREADSHEET_NAMESPACE + "v"
+TEXT = SPREADSHEET_NAMESPACE + "t"
+RICH_TEXT_RUN = SPREADSHEET_NAMESPACE + "r"
+INLINE_STRING = SPREADSHEET_NAMESPACE + "is"
+SHARED_STRING = SPREADSHEET_NAMESPACE + "si"
+SHEET_DATA = SPREADSHEET_NAMESPACE + "sheetData"
+
+# Files that start with this are OLE containers, which is what a password protected xlsx file is
+OLE_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+PART_NAME = re.compile(r"^(?P<dataset>.+?)(?:\.db)?-part(?P<part>\d+)\.xlsx$", re.IGNORECASE)
+CELL_COLUMN = re.compile(r"^[A-Z]+")
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+INGESTED = "ingested"
+ENCRYPTED = "encrypted"
+UNREADABLE = "unreadable"
+
+# Columns every dataset table has before the columns of its workbooks
+PART_COLUMN = "_part"
+ROW_COLUMN = "_row"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parts (
+    path TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS columns (
+    dataset TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    classification TEXT NOT NULL,
+    PRIMARY KEY (dataset, position)
+);
+"""
+
+
+class UnreadableWorkbook(ValueError):
+    """
+    A part that isn't an xlsx workbook that can be read, e.g. because it is encrypted
+    """
+
+    def __init__(self, path: str, status: str, reason: str):
+        super().__init__("{0}: {1}".format(path, reason))
+        self.status = status
+
+
+class SchemaMismatch(ValueError):
+    """
+    Parts of a dataset whose headers differ, which can't be merged into one table
+    """
+
+
+def split_part_name(path: str) -> Tuple[str, int]:
+    """
+    :returns: The dataset a workbook is a part of and its part number, e.g. ("patient-registration", 3) for
+              patient-registration.db-part3.xlsx. A workbook that isn't a part is the only part of its own dataset.
+    """
+    name = os.path.basename(path)
+    match = PART_NAME.match(name)
+    if match is None:
+        return os.path.splitext(name)[0], 1
+    return match.group("dataset"), int(match.group("part"))
+
+
+def group_parts(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    :returns: The paths of the parts of every dataset, in the order of their part numbers
+    """
+    datasets: Dict[str, List[Tuple[int, str]]] = {}
+    for path in paths:
+        dataset, part = split_part_name(path)
+        datasets.setdefault(dataset, []).append((part, os.path.abspath(path)))
+    return {dataset: [path for _, path in sorted(parts)] for dataset, parts in sorted(datasets.items())}
+
+
+def file_hash(path: str) -> str:
+    digest = sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _column_index(reference: str) -> int:
+    index = 0
+    for letter in CELL_COLUMN.match(reference).group(0):
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def _text(element) -> str:
+    # Rich text is split into runs, and phonetic hints are left out
+    return "".join(text.text or "" for text in element.findall(TEXT) + element.findall(RICH_TEXT_RUN + "/" + TEXT))
+
+
+def _first_sheet(archive: zipfile.ZipFile) -> str:
+    workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+    sheet = workbook.find(SPREADSHEET_NAMESPACE + "sheets/" + SPREADSHEET_NAMESPACE + "sheet")
+    relationship = sheet.get(RELATIONSHIP_NAMESPACE + "id")
+    for target in ET.fromstring(archive.read("xl/_rels/workbook.xml.rels")):
+        if target.get("Id") == relationship:
+            target_path = target.get("Target")
+            return target_path.lstrip("/") if target_path.startswith("/") else "xl/" + target_path
+    raise KeyError(relationship)
+
+
+def _shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as source:
+        for _, element in ET.iterparse(source):
+            if element.tag == SHARED_STRING:
+                strings.append(_text(element))
+                element.clear()
+    return strings
+
+
+def _cell_value(cell, strings: List[str]):
+    cell_type = cell.get("t", "n")
+    if cell_type == "inlineStr":
+        inline = cell.find(INLINE_STRING)
+        return _text(inline) if inline is not None else None
+    value = cell.findtext(VALUE)
+    if value is None:
+        return None
+    if cell_type == "s":
+        return strings[int(value)]
+    if cell_type == "b":
+        return int(value)
+    if cell_type == "n":
+        number = float(value)
+        return int(number) if number.is_integer() and "E" not in value.upper() else number
+    return value
+
+
+def read_rows(path: str) -> Iterator[List]:
+    """
+    Reads the rows of the first worksheet of a workbook as a stream. Cells are strings and numbers, or None if empty.
+
+    :raises UnreadableWorkbook: If the file is encrypted or isn't an xlsx workbook
+    """
+    with open(path, "rb") as source:
+        if source.read(len(OLE_SIGNATURE)) == OLE_SIGNATURE:
+            raise UnreadableWorkbook(path, ENCRYPTED, "the workbook is encrypted with a password")
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile as error:
+        raise UnreadableWorkbook(path, UNREADABLE, str(error))
+
+    with archive:
+        strings = _shared_strings(archive)
+        sheet_data = None
+        with archive.open(_first_sheet(archive)) as source:
+            for event, element in ET.iterparse(source, ("start", "end")):
+                if event == "start":
+                    if element.tag == SHEET_DATA:
+                        sheet_data = element
+                    continue
+                if element.tag != ROW:
+                    continue
+                row = []
+                for cell in element.iter(CELL):
+                    reference = cell.get("r")
+                    index = _column_index(reference) if reference else len(row)
+                    row.extend([None] * (index - len(row)))
+                    row.append(_cell_value(cell, strings))
+                if sheet_data is not None:
+                    sheet_data.remove(element)
+                yield row
+
+
+def read_part(task: Tuple[str, str]) -> dict:
+    """
+    Reads a part of a dataset into a sqlite file, as a table named rows holding the row number and then the cells of
+    every record. Runs in the worker processes.
+
+    :param: task The path of the part, and the sqlite file to write its records to
+    :returns: {"path", "size", "mtime_ns", "sha256", "status", "columns", "rows", "records", "seconds"}, with the
+              header of the part under columns, the number of its records under rows, and the sqlite file they were
+              written to under records, or None if the part couldn't be read
+    """
+    path, records_path = task
+    start = time.perf_counter()
+    stat = os.stat(path)
+    part = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(path),
+            "status": INGESTED, "columns": [], "rows": 0, "records": None}
+    try:
+        rows = read_rows(path)
+        header = next(rows, [])
+    except UnreadableWorkbook as error:
+        part["status"] = error.status
+        part["error"] = str(error)
+    else:
+        while header and header[-1] is None:
+            header.pop()
+        width = len(header)
+        part["columns"] = ["" if column is None else str(column).strip() for column in header]
+
+        def records() -> Iterator[List]:
+            # The header is row 1 of the workbook
+            for row in rows:
+                row = row[:width] + [None] * (width - len(row))
+                if any(cell is not None and cell != "" for cell in row):
+                    part["rows"] += 1
+                    yield [part["rows"] + 1] + row
+
+        connection = sqlite3.connect(records_path)
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute("CREATE TABLE rows ({0})".format(
+                ", ".join([ROW_COLUMN] + ["c{0}".format(index) for index in range(width)])))
+            with connection:
+                connection.executemany("INSERT INTO rows VALUES ({0})".format(", ".join("?" * (width + 1))), records())
+        finally:
+            connection.close()
+        part["records"] = records_path
+    part["seconds"] = time.perf_counter() - start
+    return part
+
+
+def quote(identifier: str) -> str:
+    return '"{0}"'.format(identifier.replace('"', '""'))
+
+
+class XlsxCache:
+    """
+    The sqlite cache of the datasets of the xlsx workbooks, see the top of this file
+    """
+
+    def __init__(self, path: str):
+        """
+        :param: path The sqlite file the cache is kept in, created if it doesn't exist
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_cached(self, dataset: str, paths: List[str]) -> bool:
+        """
+        :returns: Whether the cache holds the dataset as it is in the parts at the paths
+        """
+        cached = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in self.connection.execute(
+            "SELECT path, size, mtime_ns, sha256 FROM parts WHERE dataset = ?", (dataset,))}
+        if set(cached) != set(paths):
+            return False
+        for path in paths:
+            size, mtime_ns, digest = cached[path]
+            stat = os.stat(path)
+            if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+                continue
+            if stat.st_size != size or file_hash(path) != digest:
+                return False
+            with self.connection:
+                self.connection.execute("UPDATE parts SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, path))
+        return True
+
+    def ingest(self, paths: Iterable[str], workers: Optional[int] = None,
+               sample_size: int = DEFAULT_SAMPLE_SIZE) -> dict:
+        """
+        Brings the cache of the datasets of the workbooks up to date, reading only the datasets that changed.
+
+        :param: paths The xlsx workbooks, grouped into datasets by their names
+        :param: workers The number of worker processes, by default one per core
+        :param: sample_size The most records of a dataset its columns are classified from
+        :returns: For every dataset whether the cache was used, its parts, records and column classes, and the
+                  duration of the run
+        :raises SchemaMismatch: If the headers of the parts of a dataset differ. Nothing of that dataset is written.
+        """
+        start = time.perf_counter()
+        datasets = group_parts(paths)
+        stale = [dataset for dataset, parts in datasets.items() if not self.is_cached(dataset, parts)]
+        dataset_of = {path: dataset for dataset in stale for path in datasets[dataset]}
+        read: Dict[str, Dict[str, dict]] = {dataset: {} for dataset in stale}
+        with tempfile.TemporaryDirectory(prefix="xlsx-ingest-", dir=os.path.dirname(os.path.abspath(self.path))) \
+                as records_dir:
+            tasks = [(path, os.path.join(records_dir, "part{0}.sqlite3".format(index)))
+                     for index, path in enumerate(dataset_of)]
+            for part in run_tasks(read_part, tasks, workers):
+                dataset = dataset_of[part["path"]]
+                read[dataset][part["path"]] = part
+                if len(read[dataset]) == len(datasets[dataset]):
+                    self._store(dataset, [read[dataset][path] for path in datasets[dataset]], sample_size)
+                    for stored in read.pop(dataset).values():
+                        if stored["records"] is not None:
+                            os.remove(stored["records"])
+
+        report = {}
+        for dataset in datasets:
+            report[dataset] = self.describe(dataset)
+            report[dataset]["cached"] = dataset not in stale
+        return {"datasets": report, "cache": self.path, "seconds": time.perf_counter() - start}
+
+    def _store(self, dataset: str, parts: List[dict], sample_size: int):
+        readable = [part for part in parts if part["status"] == INGESTED]
+        columns = readable[0]["columns"] if readable else []
+        for part in readable[1:]:
+            if part["columns"] != columns:
+                raise SchemaMismatch("The header of {0} is {1}, but the header of {2} is {3}".format(
+                    part["path"], part["columns"], readable[0]["path"], columns))
+
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS {0}".format(quote(dataset)))
+            self.connection.execute("DELETE FROM parts WHERE dataset = ?", (dataset,))
+            self.connection.execute("DELETE FROM columns WHERE dataset = ?", (dataset,))
+            self.connection.executemany(
+                "INSERT INTO parts (path, dataset, part, size, mtime_ns, sha256, status, rows) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((part["path"], dataset, split_part_name(part["path"])[1], part["size"], part["mtime_ns"],
+                  part["sha256"], part["status"], part["rows"]) for part in parts))
+            if not readable:
+                return
+
+            table_columns = [PART_COLUMN, ROW_COLUMN] + columns
+            self.connection.execute("CREATE TABLE {0} ({1})".format(
+                quote(dataset), ", ".join(quote(column) for column in table_columns)))
+            insert = "INSERT INTO {0} VALUES ({1})".format(quote(dataset), ", ".join("?" * len(table_columns)))
+            for part in readable:
+                number = split_part_name(part["path"])[1]
+                source = sqlite3.connect(part["records"])
+                try:
+                    self.connection.executemany(insert, ((number,) + row for row in
+                                                         source.execute("SELECT * FROM rows ORDER BY rowid")))
+                finally:
+                    source.close()
+
+            # Records are numbered from 1 in the order they were merged in, and start with their part and row
+            records = sum(part["rows"] for part in readable)
+            step = max(1, records // sample_size)
+            sample = [row[2:] for row in self.connection.execute(
+                "SELECT * FROM {0} WHERE (rowid - 1) % ? = 0 ORDER BY rowid LIMIT ?".format(quote(dataset)),
+                (step, sample_size))]
+            self.connection.executemany(
+                "INSERT INTO columns (dataset, position, name, classification) VALUES (?, ?, ?, ?)",
+                ((dataset, index, column, json.dumps(classify_column(
+                    column, ("" if row[index] is None else str(row[index]) for row in sample))))
+                 for index, column in enumerate(columns)))
+
+    def describe(self, dataset: str) -> dict:
+        """
+        :returns: {"parts", "complete", "records", "columns"}, the parts of the dataset with their status and records,
+                  whether every part could be read, and the class of every column from the column classifier
+        """
+        parts = [{"path": path, "part": part, "status": status, "records": rows} for path, part, status, rows in
+                 self.connection.execute("SELECT path, part, status, rows FROM parts WHERE dataset = ? ORDER BY part",
+                                         (dataset,))]
+        columns = [json.loads(classification) for classification, in self.connection.execute(
+            "SELECT classification FROM columns WHERE dataset = ? ORDER BY position", (dataset,))]
+        return {
+            "parts": parts,
+            "complete": all(part["status"] == INGESTED for part in parts),
+            "records": sum(part["records"] for part in parts),
+            "columns": columns,
+        }
+
+    def columns(self, dataset: str) -> List[str]:
+        """
+        :returns: The header of the dataset
+        """
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM columns WHERE dataset = ? ORDER BY position", (dataset,))]
+
+    def records(self, dataset: str) -> Iterator[tuple]:
+        """
+        :returns: The records of the dataset in the order of their parts and rows, without the part and row
+        """
+        columns = self.columns(dataset)
+        if not columns:
+            return iter(())
+        return self.connection.execute("SELECT {0} FROM {1} ORDER BY {2}, {3}".format(
+            ", ".join(quote(column) for column in columns), quote(dataset), quote(PART_COLUMN), quote(ROW_COLUMN)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingests the multi-part xlsx workbooks of the healthcare dataset into "
+                                                 "a sqlite cache")
+    parser.add_argument("paths", nargs="*", help="xlsx workbooks to ingest, by default every workbook of the web "
+                                                 "portal data")
+    parser.add_argument("--cache", required=True, help="sqlite file the datasets are cached in")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help="most records of a dataset its columns are classified from")
+    parser.add_argument("--out", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    with XlsxCache(args.cache) as cache:
+        report = cache.ingest(args.paths or glob.glob(os.path.join(WEB_PORTAL_DIR, "*.xlsx")), args.workers,
+                              args.sample_size)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#
+# This file finds registrations that are probably the same person registered twice, e.g. with a typo in the national
+# ID, which add_Vote can't catch since it only rejects national IDs that were registered exactly.
+#
+# Comparing every pair of voters is quadratic, so voters are first put into blocks, and only voters that share a
+# block are compared. A voter's blocks are keyed by the soundex code of their last name together with either the first
+# ID_PREFIX_LENGTH or the last ID_SUFFIX_LENGTH characters of their national ID. Those two leave a digit between them
+# in a 9 digit ID, so no single mistyped, swapped, missing or extra digit changes both, and an ID with such a typo still
+# shares one of its blocks with the ID that was meant. A block that still holds more than max_block_size voters, e.g. a
+# common last name over a prefix, is split by the soundex code of the first name, and is skipped and reported if that
+# isn't enough.
+#
+# The pairs in a block are scored by how alike their national IDs (edit distance, counting a transposition as one
+# edit) and names (Jaro-Winkler) are, and pairs scoring at least the threshold are reported as suspects, best first.
+# Both the decryption of the names and the scoring run on a pool of worker processes.
+#
+# To check the voters of a snapshot of the store, run the following from the project1/ directory
+#
+# $ python -m backend.main.detection.duplicate_registrations --snapshot /tmp/voting_store.db --out suspects.json
+#
+
+import argparse
+import json
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.main.dataset.pii_scanner import run_tasks
+from backend.main.objects.voter import decrypt_names
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.storage import DEFAULT_PAGE_SIZE, VotingStorage
+
+ID_PREFIX_LENGTH = 4
+ID_SUFFIX_LENGTH = 4
+
+# Pairs whose national IDs are more edits apart than this are never suspects, whatever their names
+MAX_ID_DISTANCE = 2
+
+ID_WEIGHT = 0.5
+LAST_NAME_WEIGHT = 0.3
+FIRST_NAME_WEIGHT = 0.2
+DEFAULT_THRESHOLD = 0.85
+
+DEFAULT_MAX_BLOCK_SIZE = 64
+
+# Voters read per keying task, and compared per scoring task
+DEFAULT_TASK_VOTERS = 10_000
+
+SOUNDEX_CODES = {letter: str(code)
+                 for code, letters in enumerate(("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"))
+                 for letter in letters}
+
+# (national_id, first_name, last_name), with the names normalized
+Registration = Tuple[str, str, str]
+
+
+def normalize_name(name: str) -> str:
+    """
+    :returns: The name in lower case, with accents dropped and anything but the letters a-z removed
+    """
+    return "".join(letter for letter in unicodedata.normalize("NFKD", name.lower()) if "a" <= letter <= "z")
+
+
+def normalize_national_id(national_id: str) -> str:
+    """
+    :returns: The national ID without separators or spaces, in upper case
+    """
+    return "".join(character for character in national_id if character.isalnum()).upper()
+
+
+def soundex(name: str) -> str:
+    """
+    The American soundex code of a name, e.g. "R163" for both Robert and Rupert, or "" if it has no letters
+    """
+    name = normalize_name(name)
+    if not name:
+        return ""
+    digits = []
+    previous = SOUNDEX_CODES[name[0]]
+    for letter in name[1:]:
+        code = SOUNDEX_CODES[letter]
+        if code != "0" and code != previous:
+            digits.append(code)
+        # Letters with the same code are coded once if only h or w separate them, but twice if a vowel does
+        if letter not in "hw":
+            previous = code
+    return (name[0].upper() + "".join(digits) + "000")[:4]
+
+
+def jaro_winkler(first: str, second: str, prefix_scale: float = 0.1) -> float:
+    """
+    The Jaro-Winkler similarity of two strings, from 0.0 for nothing in common to 1.0 for equal strings, boosted for
+    strings that start the same way
+    """
+    if first == second:
+        return 1.0
+    if not first or not second:
+        return 0.0
+
+    window = max(max(len(first), len(second)) // 2 - 1, 0)
+    matched = [False] * len(second)
+    first_matches = []
+    for index, character in enumerate(first):
+        for other in range(max(0, index - window), min(index + window + 1, len(second))):
+            if not matched[other] and second[other] == character:
+                matched[other] = True
+                first_matches.append(character)
+                break
+    matches = len(first_matches)
+    if not matches:
+        return 0.0
+
+    second_matches = (character for character, is_match in zip(second, matched) if is_match)
+    transpositions = sum(a != b for a, b in zip(first_matches, second_matches)) // 2
+    jaro = (matches / len(first) + matches / len(second) + (matches - transpositions) / matches) / 3
+
+    prefix = 0
+    for a, b in zip(first[:4], second[:4]):
+        if a != b:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def id_distance(first: str, second: str, bound: int = MAX_ID_DISTANCE) -> int:
+    """
+    The number of insertions, deletions, substitutions and transpositions of adjacent characters that turn one
+    national ID into the other.
+
+    :param: bound Stop counting once the distance is known to be more than this
+    :returns: The distance, or bound + 1 if it is more than the bound
+    """
+    if abs(len(first) - len(second)) > bound:
+        return bound + 1
+    before_previous: List[int] = []
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first[i - 1] != second[j - 1]))
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current[j] = distance
+        if min(current) > bound:
+            return bound + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], bound + 1)
+
+
+def score_pair(first: Registration, second: Registration) -> Optional[Tuple[float, float, float, float]]:
+    """
+    :returns: (score, national ID similarity, first name similarity, last name similarity) of two registrations, or
+              None if their national IDs are too far apart for them to be the same person
+    """
+    distance = id_distance(first[0], second[0])
+    if distance > MAX_ID_DISTANCE:
+        return None
+    id_similarity = 1 - distance / max(len(first[0]), len(second[0]))
+    first_name_similarity = jaro_winkler(first[1], second[1])
+    last_name_similarity = jaro_winkler(first[2], second[2])
+    score = ID_WEIGHT * id_similarity + FIRST_NAME_WEIGHT * first_name_similarity + \
+        LAST_NAME_WEIGHT * last_name_similarity
+    return score, id_similarity, first_name_similarity, last_name_similarity
+
+
+@lru_cache(maxsize=1 << 16)
+def _name_key(name: str) -> Tuple[str, str]:
+    return normalize_name(name), soundex(name)
+
+
+def key_voters(task: Tuple[List[Tuple[str, str, str]], bool]) -> List[Tuple[str, str, str, str, str]]:
+    """
+    The worker that prepares a page of voters for blocking.
+
+    :param: task The (national_id, first_name, last_name) rows of the page, and whether the names are encrypted
+    :returns: (national_id, first_name, last_name, last name soundex, first name soundex) for every voter, with the
+              national ID and names normalized
+    """
+    rows, encrypted = task
+    names: Iterable[str] = (name for row in rows for name in row[1:])
+    if encrypted:
+        names = decrypt_names(names)
+    names = iter(names)
+    keyed = []
+    for row in rows:
+        first_name, first_code = _name_key(next(names))
+        last_name, last_code = _name_key(next(names))
+        keyed.append((normalize_national_id(row[0]), first_name, last_name, last_code, first_code))
+    return keyed
+
+
+def score_blocks(task: Tuple[List[List[Registration]], float]) -> Tuple[int, List[tuple]]:
+    """
+    The worker that compares every pair of registrations within each block.
+
+    :param: task The blocks, and the lowest score of a suspect pair
+    :returns: The number of pairs compared, and (score, national_id, national_id, national ID similarity, first name
+              similarity, last name similarity) for every pair scoring at least the threshold
+    """
+    blocks, threshold = task
+    pairs = 0
+    suspects = []
+    for block in blocks:
+        for index, first in enumerate(block):
+            for second in block[index + 1:]:
+                pairs += 1
+                scores = score_pair(first, second)
+                if scores is not None and scores[0] >= threshold:
+                    low, high = sorted((first[0], second[0]))
+                    suspects.append((scores[0], low, high) + scores[1:])
+    return pairs, suspects
+
+
+def _voter_pages(store: VotingStorage, task_voters: int) -> Iterator[Tuple[List[Tuple[str, str, str]], bool]]:
+    page = []
+    for row in store.iter_voter_rows(DEFAULT_PAGE_SIZE, decrypt=False):
+        page.append(row)
+        if len(page) >= task_voters:
+            yield page, store.encrypts_names
+            page = []
+    if page:
+        yield page, store.encrypts_names
+
+
+def _split_block(block: List[tuple], max_block_size: int) -> Tuple[List[List[tuple]], List[List[tuple]]]:
+    """
+    :returns: The parts of the block small enough to be compared, and the ones that are still too large
+    """
+    if len(block) <= max_block_size:
+        return [block], []
+    by_first_name = defaultdict(list)
+    for voter in block:
+        by_first_name[voter[3]].append(voter)
+    parts = [part for part in by_first_name.values() if len(part) > 1]
+    return [part for part in parts if len(part) <= max_block_size], \
+        [part for part in parts if len(part) > max_block_size]
+
+
+def _scoring_tasks(blockings: List[Dict[tuple, List[tuple]]], threshold: float, max_block_size: int,
+                   task_voters: int, counts: Dict[str, int]) -> Iterator[Tuple[List[List[Registration]], float]]:
+    """
+    Yields the blocks of every blocking in batches of about task_voters voters, emptying the blockings as it goes so
+    that the memory of a block is freed once it was sent to be scored
+    """
+    task: List[List[Registration]] = []
+    task_size = 0
+    for blocking in blockings:
+        while blocking:
+            _, block = blocking.popitem()
+            if len(block) < 2:
+                continue
+            parts, skipped = _split_block(block, max_block_size)
+            counts["skipped_blocks"] += len(skipped)
+            counts["skipped_voters"] += sum(len(part) for part in skipped)
+            for part in parts:
+                counts["blocks"] += 1
+                counts["largest_block"] = max(counts["largest_block"], len(part))
+                task.append([voter[:3] for voter in part])
+                task_size += len(part)
+            if task_size >= task_voters:
+                yield task, threshold
+                task = []
+                task_size = 0
+    if task:
+        yield task, threshold
+
+
+def find_duplicate_registrations(store: Optional[VotingStorage] = None,
+                                 workers: Optional[int] = None,
+                                 threshold: float = DEFAULT_THRESHOLD,
+                                 max_block_size: int = DEFAULT_MAX_BLOCK_SIZE,
+                                 task_voters: int = DEFAULT_TASK_VOTERS,
+                                 limit: Optional[int] = None) -> dict:
+    """
+    Finds the pairs of registrations in the store that are probably the same person.
+
+    :param: store The store whose voters to check, by default the voting store
+    :param: workers The number of worker processes, by default one per core
+    :param: threshold The lowest score of a reported pair
+    :param: max_block_size The most voters compared with each other in one block
+    :param: limit The most suspect pairs to report, by default all of them
+    :returns: The suspect pairs, best first, with how many voters, blocks and pairs it took to find them
+    """
+    start = time.perf_counter()
+    store = store or VotingStore.get_instance()
+
+    # Voters sharing a name share its string, which matters over millions of voters
+    names: Dict[str, str] = {}
+    prefixes: Dict[tuple, List[tuple]] = defaultdict(list)
+    suffixes: Dict[tuple, List[tuple]] = defaultdict(list)
+    voters = 0
+    for page in run_tasks(key_voters, _voter_pages(store, task_voters), workers):
+        for national_id, first_name, last_name, last_code, first_code in page:
+            voter = (national_id, names.setdefault(first_name, first_name), names.setdefault(last_name, last_name),
+                     first_code)
+            prefixes[last_code, national_id[:ID_PREFIX_LENGTH]].append(voter)
+            suffixes[last_code, national_id[-ID_SUFFIX_LENGTH:]].append(voter)
+            voters += 1
+    names.clear()
+
+    counts = {"blocks": 0, "largest_block": 0, "skipped_blocks": 0, "skipped_voters": 0}
+    pairs = 0
+    suspects: Dict[Tuple[str, str], tuple] = {}
+    tasks = _scoring_tasks([prefixes, suffixes], threshold, max_block_size, task_voters, counts)
+    for compared, found in run_tasks(score_blocks, tasks, workers):
+        pairs += compared
+        for suspect in found:
+            suspects[suspect[1:3]] = max(suspects.get(suspect[1:3], suspect), suspect)
+
+    ranked = sorted(suspects.values(), key=lambda suspect: (-suspect[0], suspect[1], suspect[2]))
+    seconds = time.perf_counter() - start
+    return {
+        "voters": voters,
+        "blocks": counts["blocks"],
+        "largest_block": counts["largest_block"],
+        "skipped_blocks": counts["skipped_blocks"],
+        "skipped_voters": counts["skipped_voters"],
+        "candidate_pairs": pairs,
+        "all_pairs": voters * (voters - 1) // 2,
+        "suspect_pairs": len(ranked),
+        "suspects": [{
+            "national_ids": [first_id, second_id],
+            "score": round(score, 4),
+            "national_id_similarity": round(id_similarity, 4),
+            "first_name_similarity": round(first_name_similarity, 4),
+            "last_name_similarity": round(last_name_similarity, 4),
+        } for score, first_id, second_id, id_similarity, first_name_similarity, last_name_similarity
+            in ranked[:limit]],
+        "seconds": seconds,
+        "voters_per_second": voters / seconds if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finds voters who are probably registered more than once")
+    parser.add_argument("--snapshot", help="snapshot of the store to check, written by VotingStore.snapshot")
+    parser.add_argument("--workers", type=int, help="worker processes, by default one per core")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="lowest score of a suspect pair")
+    parser.add_argument("--max-block-size", type=int, default=DEFAULT_MAX_BLOCK_SIZE)
+    parser.add_argument("--limit", type=int, help="most suspect pairs to report")
+    parser.add_argument("--out", help="file to write the json report to, defaults to stdout")
+    args = parser.parse_args()
+
+    store = VotingStore.get_instance()
+    if args.snapshot:
+        store.restore(args.snapshot)
+    report = find_duplicate_registrations(store, args.workers, args.threshold, args.max_block_size,
+                                          limit=args.limit)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
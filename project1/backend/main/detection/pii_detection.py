@@ -1,4 +1,6 @@
 import re
+from collections import Counter
+from typing import List, Optional, Tuple
 
 def redact_free_text(free_text: str, first_name_voter: str, last_name_voter: str) -> str:
     """
@@ -20,3 +22,99 @@ def redact_free_text(free_text: str, first_name_voter: str, last_name_voter: str
     free_text = re.sub(last_name_voter, "[REDACTED NAME]", free_text)
 
     return free_text
+
+
+# Patterns for the kinds of PII that turn up in the tables of the healthcare dataset. They are compiled once, and are
+# stricter than the ones above, since structured columns are full of codes that a loose pattern would match.
+STREET_SUFFIXES = (
+    "Alley", "Annex", "Approach", "Arcade", "Ave", "Avenue", "Bay", "Bend", "Blvd", "Boulevard", "Branch", "Bridge",
+    "Burg", "Byway", "Camp", "Center", "Circle", "Club", "Common", "Corner", "Court", "Cove", "Crescent", "Crest",
+    "Crossing", "Ct", "Dam", "Divide", "Dr", "Drive", "Estate", "Expressway", "Extension", "Ferry", "Flat", "Forge",
+    "Freeway", "Garden", "Gardens", "Gate", "Gateway", "Glen", "Green", "Grove", "Harbor", "Haven", "Heights",
+    "Highlands", "Highway", "Hill", "Hollow", "Hwy", "Junction", "Key", "Knoll", "Landing", "Lane", "Light", "Ln",
+    "Loaf", "Lodge", "Loop", "Mall", "Manor", "Meadow", "Meadows", "Mews", "Mill", "Mission", "Orchard", "Overpass",
+    "Parade", "Park", "Parkway", "Pass", "Passage", "Path", "Pike", "Pkwy", "Pl", "Place", "Plaza", "Point", "Port",
+    "Quay", "Ramp", "Rd", "Ridge", "Road", "Route", "Row", "Rue", "Run", "Springs", "Square", "St", "Station",
+    "Street", "Terrace", "Throughway", "Trafficway", "Trail", "Trailer", "Tunnel", "Turnpike", "Underpass", "Vale",
+    "Valley", "View", "Ville", "Vista", "Walk", "Wall", "Way",
+)
+
+
+def luhn_valid(digits: str) -> bool:
+    """
+    :param: digits A string of digits
+    :returns: Whether the last digit is the Luhn check digit of the others, as on every payment card number
+    """
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if position % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+class LuhnCheckedPattern:
+    """
+    A pattern whose matches only count if their digits pass the Luhn check, with the methods of a compiled pattern
+    that are used on PII_PATTERNS
+    """
+    def __init__(self, pattern: str):
+        self.regex = re.compile(pattern)
+        self.pattern = pattern
+
+    def _valid(self, match) -> bool:
+        return luhn_valid("".join(character for character in match.group() if character.isdigit()))
+
+    def search(self, text: str):
+        return next((match for match in self.regex.finditer(text) if self._valid(match)), None)
+
+    def subn(self, replacement: str, text: str) -> Tuple[str, int]:
+        count = 0
+
+        def replace(match) -> str:
+            nonlocal count
+            if not self._valid(match):
+                return match.group()
+            count += 1
+            return replacement
+
+        return self.regex.sub(replace, text), count
+
+
+PII_PATTERNS = {
+    "ssn": re.compile(r"(?<![\w-])\d{3}-\d{2}-\d{4}(?![\w-])"),
+    # 13 to 19 digits, possibly in groups split by spaces or dashes, ending with a Luhn check digit. Digits after a
+    # decimal point are part of a number, not a card.
+    "payment_card": LuhnCheckedPattern(r"(?<![\w.-])\d(?:[ -]?\d){12,18}(?![\w-]|\.\d)"),
+    "phone": re.compile(r"(?<![\w.)-])(?:\+?1[-. ]?)?(?:\(\d{3}\) ?|\d{3}[-. ]?)\d{3}[-. ]?\d{4}(?![\w-]|\.\d)"),
+    "email": re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),
+    "passport": re.compile(r"\b[A-Z]\d{5,8}[A-Z]\b"),
+    "drivers_license": re.compile(r"\b[A-Z]\d{8}\b"),
+    # A house number and street name, followed by a street suffix or a unit
+    "address": re.compile(r"\b\d{1,6}(?: [A-Z][A-Za-z]+){1,4} (?:(?:" + "|".join(STREET_SUFFIXES) + r")\b|"
+                          r"(?:Apt|Suite|Unit)\.? ?\d+)", re.IGNORECASE),
+    # Generated names carry a numeric suffix, e.g. "Milo271 Feil794"
+    "name": re.compile(r"\b[A-Z][a-zà-ÿ'’]+(?:[ -][A-Z][a-zà-ÿ'’]+)*\d{1,4}\b"),
+}
+
+
+def find_pii(text: str) -> List[str]:
+    """
+    :param: text The text to look for PII in
+    :returns: The kinds of PII (keys of PII_PATTERNS) found in the text, in the order of PII_PATTERNS
+    """
+    return [kind for kind, pattern in PII_PATTERNS.items() if pattern.search(text)]
+
+
+def redact_pii(text: str, found: Optional[Counter] = None) -> str:
+    """
+    Redacts every match of PII_PATTERNS, e.g. "[REDACTED SSN]", for free text that isn't tied to a known person
+
+    :param: text The free text to remove sensitive data from
+    :param: found If given, the number of matches of every kind of PII is added to it
+    :returns: The redacted free text
+    """
+    for kind, pattern in PII_PATTERNS.items():
+        text, matches = pattern.subn("[REDACTED {0}]".format(kind.replace("_", " ").upper()), text)
+        if matches and found is not None:
+            found[kind] += matches
+    return text
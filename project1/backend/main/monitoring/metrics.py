@@ -0,0 +1,240 @@
+#
+# This file records latency histograms, counters and gauges for the store, the internal APIs and the REST API, and
+# renders them in the Prometheus text format.
+#
+# Metrics are off unless the METRICS_ENABLED environment variable is set to 1 (or metrics.enable() is called), and
+# while they are off every instrumented call costs a single flag check.
+#
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+
+METRICS_ENABLED_ENV = "METRICS_ENABLED"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+OPERATION_DURATION = "voting_operation_duration_seconds"
+OPERATION_ERRORS = "voting_operation_errors_total"
+BALLOT_OUTCOMES = "voting_ballot_outcomes_total"
+HTTP_REQUEST_DURATION = "voting_http_request_duration_seconds"
+HTTP_REQUESTS = "voting_http_requests_total"
+
+HELP = {
+    OPERATION_DURATION: "Latency of store methods and internal API functions",
+    OPERATION_ERRORS: "Store methods and internal API functions that raised",
+    BALLOT_OUTCOMES: "Ballots processed by count_ballot, per resulting BallotStatus",
+    HTTP_REQUEST_DURATION: "Latency of REST API requests, per route",
+    HTTP_REQUESTS: "REST API requests, per route and response status",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_enabled = os.getenv(METRICS_ENABLED_ENV) == "1"
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram. Bucket counts are kept per bucket and only made cumulative when rendered.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Holds every metric recorded by the process. Safe to use from multiple threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        key = _labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name: str, value: float, **labels: str):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = _labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for metric_type, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted(metrics):
+                    _header(lines, name, metric_type)
+                    for labels, value in sorted(metrics[name].items()):
+                        lines.append("{0}{1} {2}".format(name, _format_labels(labels), _format_value(value)))
+
+            for name in sorted(self.histograms):
+                _header(lines, name, "histogram")
+                for labels, histogram in sorted(self.histograms[name].items(), key=lambda item: item[0]):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.bucket_counts):
+                        cumulative += bucket_count
+                        bucket_labels = labels + (("le", _format_value(bound)),)
+                        lines.append("{0}_bucket{1} {2}".format(name, _format_labels(bucket_labels), cumulative))
+                    lines.append("{0}_sum{1} {2}".format(name, _format_labels(labels), _format_value(histogram.sum)))
+                    lines.append("{0}_count{1} {2}".format(name, _format_labels(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def increment(name: str, amount: float = 1, **labels: str):
+    if _enabled:
+        REGISTRY.increment(name, amount, **labels)
+
+
+def set_gauge(name: str, value: float, **labels: str):
+    if _enabled:
+        REGISTRY.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    if _enabled:
+        REGISTRY.observe(name, value, **labels)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def timed(layer: str) -> Callable:
+    """
+    Decorator that records the latency of every call of the decorated function, and the calls that raised.
+
+    :param: layer The part of the system the function belongs to, e.g. "store" or "balloting"
+    """
+    def decorate(func: Callable) -> Callable:
+        operation = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                REGISTRY.increment(OPERATION_ERRORS, layer=layer, operation=operation)
+                raise
+            finally:
+                REGISTRY.observe(OPERATION_DURATION, time.perf_counter() - start, layer=layer, operation=operation)
+
+        return wrapper
+    return decorate
+
+
+def instrument_methods(layer: str) -> Callable:
+    """
+    Class decorator that applies timed to every public method of the class. Static methods are left alone.
+    """
+    def decorate(cls):
+        for name, attribute in list(vars(cls).items()):
+            if not name.startswith("_") and callable(attribute) and not isinstance(attribute, staticmethod):
+                setattr(cls, name, timed(layer)(attribute))
+        return cls
+    return decorate
+
+
+def instrument_app(app):
+    """
+    Records the latency and response status of every request made to the Flask app, and serves the metrics at
+    /metrics. While metrics are disabled, /metrics answers 404.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        if _enabled:
+            g.metrics_request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_request_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REGISTRY.observe(HTTP_REQUEST_DURATION, time.perf_counter() - start, route=route, method=request.method)
+            REGISTRY.increment(HTTP_REQUESTS, route=route, method=request.method, status=str(response.status_code))
+        return response
+
+    def get_metrics():
+        if not _enabled:
+            return Response("metrics are disabled\n", status=404, mimetype="text/plain")
+        return Response(render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", get_metrics)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _header(lines, name: str, metric_type: str):
+    lines.append("# HELP {0} {1}".format(name, HELP.get(name, name.replace("_", " "))))
+    lines.append("# TYPE {0} {1}".format(name, metric_type))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,243 @@
+#
+# This file lets an operator profile the running API server without restarting it. A capture samples the stacks of
+# every thread for a few seconds, and times every sqlite statement the VotingStore runs in the meantime.
+#
+# Captures can be started in two ways:
+#
+# 1. POST /admin/profile?seconds=10 from the server's own machine, with the X-Admin-Token header set to the
+#    "profiling admin token" secret. Without that secret the endpoint doesn't exist.
+# 2. kill -USR2 <pid>, which writes the capture as json to the system's temporary directory.
+#
+
+import hmac
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from backend.main.store import secret_registry
+
+ADMIN_TOKEN_SECRET = "profiling admin token"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+LOCAL_ADDRESSES = {"127.0.0.1", "::1"}
+
+DEFAULT_SECONDS = 10
+MAX_SECONDS = 60
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 50
+
+# Leaf functions of threads that are waiting for work rather than doing any
+IDLE_FUNCTIONS = {"select", "poll", "wait", "accept", "sleep", "_wait_for_tstate_lock", "serve_forever"}
+
+FunctionKey = Tuple[str, int, str]
+
+_capture_lock = threading.Lock()
+
+
+class StatementTimings:
+    """
+    Accumulates how often each sql statement ran and how long it took
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings: Dict[str, List[float]] = {}
+
+    def record(self, statement: str, seconds: float):
+        statement = " ".join(statement.split())
+        with self.lock:
+            timing = self.timings.get(statement)
+            if timing is None:
+                self.timings[statement] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def report(self) -> List[dict]:
+        with self.lock:
+            return [{"statement": statement, "count": count, "total_s": total, "mean_s": total / count, "max_s": slowest}
+                    for statement, (count, total, slowest) in
+                    sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)]
+
+
+class _TimedCursor:
+    def __init__(self, cursor, timings: StatementTimings):
+        self._cursor = cursor
+        self._timings = timings
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, *args)
+        finally:
+            self._timings.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, *args)
+        finally:
+            self._timings.record(sql, time.perf_counter() - start)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """
+    Stands in for a sqlite connection while a capture runs, timing every statement executed through it. Cursors are
+    timed too, and anything else is passed through to the real connection.
+    """
+    def __init__(self, connection, timings: StatementTimings):
+        self.connection = connection
+        self._timings = timings
+
+    def cursor(self, *args):
+        return _TimedCursor(self.connection.cursor(*args), self._timings)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> dict:
+    """
+    Samples the stack of every other thread until the time runs out, skipping threads that are idle
+
+    :returns: The number of samples, and for every function the samples it was running in (total) and the samples it
+              was the innermost frame of (self)
+    """
+    own_thread = threading.get_ident()
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    samples = 0
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            samples += 1
+            seen = set()
+            self_counts[_function_key(frame)] += 1
+            while frame is not None:
+                key = _function_key(frame)
+                if key not in seen:
+                    seen.add(key)
+                    total_counts[key] += 1
+                frame = frame.f_back
+        time.sleep(interval)
+
+    return {
+        "samples": samples,
+        "functions": [{"function": name, "file": filename, "line": line, "total": total,
+                       "self": self_counts.get((filename, line, name), 0)}
+                      for (filename, line, name), total in total_counts.most_common(TOP_FUNCTIONS)],
+    }
+
+
+def capture(seconds: float = DEFAULT_SECONDS) -> Optional[dict]:
+    """
+    Profiles the process for the given number of seconds. Only one capture can run at a time.
+
+    :returns: The aggregated profile and sqlite statement timings, or None if another capture is already running
+    """
+    from backend.main.store.data_registry import VotingStore
+
+    if not _capture_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = max(0.0, min(float(seconds), MAX_SECONDS))
+        store = VotingStore.get_instance()
+        timings = StatementTimings()
+        if not isinstance(store, VotingStore):
+            # Only the sqlite backend has statements to time
+            profile = sample_stacks(seconds)
+        else:
+            timed_connection = TimedConnection(store.connection, timings)
+            store.connection = timed_connection
+            try:
+                profile = sample_stacks(seconds)
+            finally:
+                if store.connection is timed_connection:
+                    store.connection = timed_connection.connection
+
+        profile["seconds"] = seconds
+        profile["statements"] = timings.report()
+        return profile
+    finally:
+        _capture_lock.release()
+
+
+def write_capture(seconds: float = DEFAULT_SECONDS, directory: Optional[str] = None) -> Optional[str]:
+    """
+    Runs a capture and writes it as json into the directory
+
+    :returns: The path of the written file, or None if another capture is already running
+    """
+    profile = capture(seconds)
+    if profile is None:
+        return None
+    path = os.path.join(directory or tempfile.gettempdir(),
+                        "voting-profile-{0}-{1}.json".format(os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+    with open(path, "w") as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    return path
+
+
+def install_signal_handler(seconds: float = DEFAULT_SECONDS, directory: Optional[str] = None) -> bool:
+    """
+    Makes SIGUSR2 start a capture in the background. Signal handlers can only be installed from the main thread of
+    platforms that have SIGUSR2; elsewhere this does nothing.
+
+    :returns: Boolean TRUE if the handler was installed
+    """
+    if not hasattr(signal, "SIGUSR2") or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def handle(signum, frame):
+        threading.Thread(target=write_capture, args=(seconds, directory), daemon=True).start()
+
+    signal.signal(signal.SIGUSR2, handle)
+    return True
+
+
+def instrument_app(app):
+    """
+    Adds the POST /admin/profile endpoint to the Flask app, and the SIGUSR2 handler to the process
+    """
+    from flask import abort, request
+    from flask_api import status
+
+    def profile():
+        admin_token = secret_registry.get_secret_str(ADMIN_TOKEN_SECRET)
+        if not admin_token or request.remote_addr not in LOCAL_ADDRESSES:
+            abort(status.HTTP_404_NOT_FOUND)
+        if not hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ""), admin_token):
+            abort(status.HTTP_403_FORBIDDEN)
+
+        result = capture(request.args.get("seconds", DEFAULT_SECONDS, type=float))
+        if result is None:
+            return {"status": "a capture is already running"}, status.HTTP_409_CONFLICT
+        return result
+
+    app.add_url_rule("/admin/profile", "profile", profile, methods=["POST"])
+    install_signal_handler()
+
+
+def _function_key(frame) -> FunctionKey:
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
@@ -1,13 +1,25 @@
+import hmac
 from  base64 import b64encode,b64decode
+from  hashlib import sha256
+from  typing import Iterable, Iterator
 from  backend.main.store import secret_registry
 from  Crypto.Random import get_random_bytes
 from  Crypto.Cipher import AES
 import jsons
 
+BALLOT_NUMBER_KEY = "ballot_number encryption key"
+BALLOT_NUMBER_KEY_BYTES = 32
+BALLOT_NUMBER_NONCE_BYTES = 16
+
+BALLOT_OWNER_KEY = "ballot owner key"
+BALLOT_OWNER_KEY_BYTES = 32
+
 class Ballot:
     """
     A ballot that exists in a specific, secret manner
     """
+    __slots__ = ("ballot_number", "chosen_candidate_id", "voter_comments")
+
     def __init__(self, ballot_number: str, chosen_candidate_id: str, voter_comments: str):
         self.ballot_number = ballot_number
         self.chosen_candidate_id = chosen_candidate_id
@@ -33,14 +45,10 @@ def generate_ballot_number(national_id:str) -> str:
     
     """
     national_id = national_id.replace("-", "").replace(" ", "").strip()
-    expected_bytes=16
     
-    encryption_key= secret_registry.get_secret_bytes("ballot_number encryption key")
-    if not encryption_key:
-        encryption_key = get_random_bytes(expected_bytes * 2)
-        secret_registry.overwrite_secret_bytes("ballot_number encryption key", encryption_key)
+    encryption_key  = ballot_number_key()
     
-    nonce           = get_random_bytes(expected_bytes)
+    nonce           = get_random_bytes(BALLOT_NUMBER_NONCE_BYTES)
     cipher          = AES.new(encryption_key, AES.MODE_SIV, nonce=nonce)
     ciphertext, tag = cipher.encrypt_and_digest(national_id.encode("utf-8"))
     
@@ -49,3 +57,35 @@ def generate_ballot_number(national_id:str) -> str:
     ciphertext_str   = b64encode(ciphertext).decode("utf-8")
     
     return nonce_str+"-"+tag_str+"-"+ciphertext_str
+
+
+def ballot_number_key() -> bytes:
+    """
+    The AES-SIV key ballot numbers are sealed with, made on first use
+    """
+    encryption_key = secret_registry.get_secret_bytes(BALLOT_NUMBER_KEY)
+    if not encryption_key:
+        encryption_key = get_random_bytes(BALLOT_NUMBER_KEY_BYTES)
+        secret_registry.overwrite_secret_bytes(BALLOT_NUMBER_KEY, encryption_key)
+    return encryption_key
+
+
+def ballot_owner_key(national_id: str) -> str:
+    """
+    Keyed hash of the national ID of the voter a ballot was issued to. Every ballot of a voter gets the same one, so
+    the ballot table can be indexed by it, but without the key it can't be traced back to the national ID.
+    """
+    return next(ballot_owner_keys((national_id,)))
+
+
+def ballot_owner_keys(national_ids: Iterable[str]) -> Iterator[str]:
+    """
+    Batch version of ballot_owner_key, which looks the key up only once
+    """
+    owner_key = secret_registry.get_secret_bytes(BALLOT_OWNER_KEY)
+    if not owner_key:
+        owner_key = get_random_bytes(BALLOT_OWNER_KEY_BYTES)
+        secret_registry.overwrite_secret_bytes(BALLOT_OWNER_KEY, owner_key)
+    for national_id in national_ids:
+        sanitized_national_id = national_id.replace("-", "").replace(" ", "").strip()
+        yield hmac.new(owner_key, sanitized_national_id.encode("utf-8"), sha256).hexdigest()
@@ -0,0 +1,210 @@
+#
+# This file contains the pool that ballot numbers are issued from, so that issuing a ballot stays cheap when thousands
+# of voters are issued ballots at once, e.g. when a polling station opens.
+#
+# A ballot number is the voter's national ID sealed with AES-SIV (RFC 5297) under the ballot number key and a fresh
+# random nonce, exactly as generate_ballot_number makes it. A background thread draws the nonces in bulk from the
+# random generator and base64 encodes them ahead of time, and the key is only decoded again when its secret changes.
+# Issuing a ballot number from the pool then only takes AES.MODE_SIV over the national ID, with a nonce that is
+# random, secret until issued, and never used for a second ballot.
+#
+# The thread refills the pool up to its high watermark once it drops to its low watermark, and a ballot number issued
+# while the pool is empty is computed inline. The pool belongs to the key and to the process that drew its nonces, so
+# it is thrown away when the key is rotated, and a forked process never issues its parent's nonces.
+#
+# The watermarks are set with the BALLOT_NUMBER_POOL_LOW_WATERMARK and BALLOT_NUMBER_POOL_HIGH_WATERMARK environment
+# variables. A high watermark of 0 turns the pool off, and ballot numbers are made by generate_ballot_number instead.
+#
+
+import os
+import threading
+from base64 import b64encode
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import BALLOT_NUMBER_KEY, BALLOT_NUMBER_NONCE_BYTES, ballot_number_key, \
+    generate_ballot_number
+from backend.main.store import secret_registry
+
+LOW_WATERMARK_ENV = "BALLOT_NUMBER_POOL_LOW_WATERMARK"
+HIGH_WATERMARK_ENV = "BALLOT_NUMBER_POOL_HIGH_WATERMARK"
+DEFAULT_LOW_WATERMARK = 2_000
+DEFAULT_HIGH_WATERMARK = 10_000
+
+# Nonces drawn from the random generator at once while refilling
+REFILL_BATCH = 256
+
+BALLOT_NUMBER_POOL_ENTRIES = "voting_ballot_number_pool_entries"
+BALLOT_NUMBER_POOL_ISSUED = "voting_ballot_number_pool_issued_total"
+BALLOT_NUMBER_POOL_REFILLS = "voting_ballot_number_pool_refills_total"
+BALLOT_NUMBER_POOL_DISCARDED = "voting_ballot_number_pool_discarded_total"
+
+metrics.HELP.update({
+    BALLOT_NUMBER_POOL_ENTRIES: "Nonces ready in the ballot number pool",
+    BALLOT_NUMBER_POOL_ISSUED: "Ballot numbers issued, per whether the pool had a nonce ready (hit) or not (miss)",
+    BALLOT_NUMBER_POOL_REFILLS: "Times the ballot number pool was refilled up to its high watermark",
+    BALLOT_NUMBER_POOL_DISCARDED: "Pooled nonces thrown away because the key was rotated or the process forked",
+})
+
+# A pooled nonce, and its base64 encoding
+Entry = Tuple[bytes, str]
+
+
+class PooledKey:
+    """
+    A ballot number key, the secret it was decoded from, and the nonces pooled under it
+    """
+    def __init__(self, key: bytes, secret: Optional[str]):
+        self.key = key
+        self.secret = secret
+        self.entries: Deque[Entry] = deque()
+
+
+class BallotNumberPool:
+    """
+    A pool of nonces drawn ahead of time that ballot numbers are issued from. Safe to use from multiple threads: every
+    nonce is handed out once.
+    """
+    def __init__(self, low_watermark: int = DEFAULT_LOW_WATERMARK, high_watermark: int = DEFAULT_HIGH_WATERMARK):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("The watermarks must satisfy 0 <= low < high, not low={0} high={1}".format(
+                low_watermark, high_watermark))
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self._pooled_key: Optional[PooledKey] = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {"hits": 0, "misses": 0, "refills": 0, "discarded": 0}
+
+    def __len__(self) -> int:
+        pooled_key = self._pooled_key
+        return len(pooled_key.entries) if pooled_key else 0
+
+    def ballot_number(self, national_id: str) -> str:
+        """
+        Issues a ballot number, in the format of generate_ballot_number, from a pooled nonce if one is ready
+        """
+        national_id = national_id.replace("-", "").replace(" ", "").strip()
+        pooled_key = self._current_key()
+        try:
+            nonce, encoded_nonce = pooled_key.entries.popleft()
+            result, count = "hit", "hits"
+        except IndexError:
+            nonce = get_random_bytes(BALLOT_NUMBER_NONCE_BYTES)
+            encoded_nonce = b64encode(nonce).decode("utf-8")
+            result, count = "miss", "misses"
+        with self._lock:
+            self._counts[count] += 1
+        metrics.increment(BALLOT_NUMBER_POOL_ISSUED, result=result)
+        metrics.set_gauge(BALLOT_NUMBER_POOL_ENTRIES, len(pooled_key.entries))
+        if len(pooled_key.entries) <= self.low_watermark:
+            self._request_refill()
+
+        ciphertext, tag = AES.new(pooled_key.key, AES.MODE_SIV, nonce=nonce).encrypt_and_digest(
+            national_id.encode("utf-8"))
+        return encoded_nonce + "-" + b64encode(tag).decode("utf-8") + "-" + b64encode(ciphertext).decode("utf-8")
+
+    def refill(self) -> int:
+        """
+        Fills the pool up to its high watermark. Called by the background thread, but can be called directly to fill
+        the pool ahead of a burst.
+
+        :returns: The number of nonces added
+        """
+        pooled_key = self._current_key()
+        added = 0
+        while len(pooled_key.entries) < self.high_watermark and pooled_key is self._pooled_key:
+            count = min(REFILL_BATCH, self.high_watermark - len(pooled_key.entries))
+            nonces = get_random_bytes(BALLOT_NUMBER_NONCE_BYTES * count)
+            pooled_key.entries.extend((nonce, b64encode(nonce).decode("utf-8")) for nonce in (
+                nonces[offset:offset + BALLOT_NUMBER_NONCE_BYTES]
+                for offset in range(0, len(nonces), BALLOT_NUMBER_NONCE_BYTES)))
+            added += count
+        with self._lock:
+            self._counts["refills"] += 1
+        metrics.increment(BALLOT_NUMBER_POOL_REFILLS)
+        metrics.set_gauge(BALLOT_NUMBER_POOL_ENTRIES, len(pooled_key.entries))
+        return added
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :returns: The nonces ready, ballot numbers issued with (hits) and without (misses) a ready nonce, refills, and
+                  nonces discarded
+        """
+        with self._lock:
+            return dict(self._counts, entries=len(self))
+
+    def _current_key(self) -> PooledKey:
+        """
+        The current ballot number key and its nonces, starting over if the key was rotated or this process was forked
+        since the nonces were drawn
+        """
+        secret = secret_registry.get_secret_str(BALLOT_NUMBER_KEY)
+        pooled_key = self._pooled_key
+        if pooled_key is None or secret is None or pooled_key.secret != secret or self._pid != os.getpid():
+            with self._lock:
+                key = ballot_number_key()
+                secret = secret_registry.get_secret_str(BALLOT_NUMBER_KEY)
+                pooled_key = self._pooled_key
+                if pooled_key is not None and pooled_key.key == key and self._pid == os.getpid():
+                    pooled_key.secret = secret
+                else:
+                    if pooled_key is not None:
+                        self._counts["discarded"] += len(pooled_key.entries)
+                        metrics.increment(BALLOT_NUMBER_POOL_DISCARDED, len(pooled_key.entries))
+                    if self._pid != os.getpid():
+                        # The refill thread wasn't forked along with the pool
+                        self._pid = os.getpid()
+                        self._thread = None
+                    pooled_key = self._pooled_key = PooledKey(key, secret)
+        return pooled_key
+
+    def _request_refill(self):
+        self._refill_needed.set()
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refill_forever, name="ballot-number-pool",
+                                                    daemon=True)
+                    self._thread.start()
+
+    def _refill_forever(self):
+        while True:
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+            self.refill()
+
+
+_pool: Optional[BallotNumberPool] = None
+_pool_configured = False
+_pool_lock = threading.Lock()
+
+
+def ballot_number_pool() -> Optional[BallotNumberPool]:
+    """
+    The pool of this process, configured from the environment on first use, or None if it is turned off
+    """
+    global _pool, _pool_configured
+    if not _pool_configured:
+        with _pool_lock:
+            if not _pool_configured:
+                high_watermark = int(os.getenv(HIGH_WATERMARK_ENV, DEFAULT_HIGH_WATERMARK))
+                if high_watermark > 0:
+                    low_watermark = int(os.getenv(LOW_WATERMARK_ENV, min(DEFAULT_LOW_WATERMARK, high_watermark // 5)))
+                    _pool = BallotNumberPool(low_watermark, high_watermark)
+                _pool_configured = True
+    return _pool
+
+
+def issue_ballot_number(national_id: str) -> str:
+    """
+    Issues a ballot number from the pool of this process, or with generate_ballot_number if the pool is turned off
+    """
+    pool = ballot_number_pool()
+    return pool.ballot_number(national_id) if pool is not None else generate_ballot_number(national_id)
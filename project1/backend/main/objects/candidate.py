@@ -3,6 +3,8 @@ class Candidate:
 	"""
 	Information about a specific candidate in the election
 	"""
+	__slots__ = ("candidate_id", "name")
+
 	def __init__(self, candidate_id: str, name: str):
 		self.candidate_id = candidate_id
 		self.name = name
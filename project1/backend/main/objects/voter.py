@@ -4,10 +4,28 @@
 from  base64 import b64encode,b64decode
 from  backend.main.store import secret_registry
 from  Crypto.Random import get_random_bytes
-from  Crypto.Cipher import AES
+from  Crypto.Cipher import AES, ChaCha20_Poly1305
+from  Crypto.Hash import SHA256
+from  Crypto.Protocol.KDF import HKDF
+import json
 import jsons
+import threading
+from collections import OrderedDict
+from hashlib import sha256
 from random import shuffle
 from enum import Enum
+from typing import Iterable, Iterator, Optional, Union
+
+NAME_ENCRYPTION_KEY = "national id Encryption Key"
+NAME_KEY_BYTES = 64
+DEFAULT_NAME_CACHE_SIZE = 10_000
+
+# Binary name envelopes are laid out as version (1 byte) | nonce (12 bytes) | tag (16 bytes) | ciphertext, and are
+# sealed with ChaCha20-Poly1305 under a key derived from the name key. Building an AES-SIV cipher costs several times
+# more per name, which adds up over millions of stored names.
+NAME_ENVELOPE_VERSION = 1
+NAME_ENVELOPE_NONCE_BYTES = 12
+NAME_ENVELOPE_TAG_BYTES = 16
 
 
 def obfuscate_national_id(national_id: str) -> str:
@@ -33,10 +51,7 @@ def encrypt_name(name: str) -> str:
     """
     expected_bytes =32
     
-    encryption_key = secret_registry.get_secret_bytes("national id Encryption Key")
-    if not encryption_key:
-        encryption_key = get_random_bytes(expected_bytes * 2)
-        secret_registry.overwrite_secret_bytes("national id Encryption Key", encryption_key)
+    encryption_key = _name_encryption_key()
     
     nonce   = get_random_bytes(expected_bytes)
     cipher  = AES.new(encryption_key, AES.MODE_SIV,nonce=nonce)
@@ -52,27 +67,187 @@ def encrypt_name(name: str) -> str:
     return jsons.dumps({'ciphertext': ciphertext_str, 'tag': tag_str, 'nonce': nonce_str})
 
 
-def decrypt_name(encrypted_name: str) -> str:
+def encrypt_name_envelope(name: str) -> bytes:
+    """
+    Encrypts a name, non-deterministically, into a compact binary envelope. This is how names are stored at rest.
+
+    :param: name A plaintext name that is sensitive and needs to encrypt.
+    :return: The binary envelope holding the cipher text of the name.
+    """
+    return next(encrypt_name_envelopes((name,)))
+
+
+def encrypt_name_envelopes(names: Iterable[str]) -> Iterator[bytes]:
+    """
+    Encrypts many names into binary envelopes, loading the key once for the whole batch.
+    """
+    envelope_key = _envelope_key(_name_encryption_key())
+    header = bytes((NAME_ENVELOPE_VERSION,))
+    for name in names:
+        nonce = get_random_bytes(NAME_ENVELOPE_NONCE_BYTES)
+        cipher = ChaCha20_Poly1305.new(key=envelope_key, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(name.encode("utf-8"))
+        yield header + nonce + tag + ciphertext
+
+
+def decrypt_name(encrypted_name: Union[str, bytes]) -> str:
     """
     Decrypts a name. This is the inverse of the encrypt_name method above.
 
-    :param: encrypted_name The ciphertext of a name that is sensitive
+    :param: encrypted_name The ciphertext of a name that is sensitive, from encrypt_name or encrypt_name_envelope
     :return: The plaintext name
     """
-    ciphertext_and_tag_strings = jsons.loads(encrypted_name)
-    ciphertext  = b64decode(ciphertext_and_tag_strings['ciphertext'].encode("utf-8"))
-    tag         = b64decode(ciphertext_and_tag_strings['tag'].encode("utf-8"))
-    nonce       = b64decode(ciphertext_and_tag_strings['nonce'].encode("utf-8"))
-    
-  
-    encryption_key = secret_registry.get_secret_bytes("national id Encryption Key")
-    
-    cipher = AES.new(encryption_key, AES.MODE_SIV, nonce=nonce)
-    cipher.update(b"")
-    
-    return cipher.decrypt_and_verify(ciphertext, tag).decode("utf-8")
+    encryption_key = secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY)
+    return _decrypt_name(encrypted_name, encryption_key, _key_version(encryption_key), _envelope_key(encryption_key))
+
+
+def decrypt_names(encrypted_names: Iterable[Union[str, bytes]]) -> Iterator[str]:
+    """
+    Decrypts many names, e.g. for a report. The key is loaded once for the whole batch, and names are decrypted lazily
+    as the result is iterated over, so batches of any size can be streamed. The key is only looked up once there is a
+    name to decrypt, so an empty batch decrypts to nothing even before any name key exists.
+
+    :param: encrypted_names Ciphertexts produced by encrypt_name or encrypt_name_envelope
+    :return: The plaintext names, in the same order
+    """
+    encryption_key = key_version = envelope_key = None
+    for encrypted_name in encrypted_names:
+        if encryption_key is None:
+            encryption_key = secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY)
+            key_version = _key_version(encryption_key)
+            envelope_key = _envelope_key(encryption_key)
+        yield _decrypt_name(encrypted_name, encryption_key, key_version, envelope_key)
+
+
+def _decrypt_name(encrypted_name: Union[str, bytes], encryption_key: bytes, key_version: str,
+                  envelope_key: bytes) -> str:
+    name_cache = _name_cache
+    if name_cache is not None:
+        name = name_cache.get(key_version, encrypted_name)
+        if name is not None:
+            return name
+
+    if isinstance(encrypted_name, bytes):
+        if encrypted_name[0] != NAME_ENVELOPE_VERSION:
+            raise ValueError("Unknown name envelope version {0}".format(encrypted_name[0]))
+        tag_start = 1 + NAME_ENVELOPE_NONCE_BYTES
+        nonce       = encrypted_name[1:tag_start]
+        tag         = encrypted_name[tag_start:tag_start + NAME_ENVELOPE_TAG_BYTES]
+        ciphertext  = encrypted_name[tag_start + NAME_ENVELOPE_TAG_BYTES:]
+        cipher = ChaCha20_Poly1305.new(key=envelope_key, nonce=nonce)
+    else:
+        ciphertext_and_tag_strings = json.loads(encrypted_name)
+        ciphertext  = b64decode(ciphertext_and_tag_strings['ciphertext'])
+        tag         = b64decode(ciphertext_and_tag_strings['tag'])
+        nonce       = b64decode(ciphertext_and_tag_strings['nonce'])
+        cipher = AES.new(encryption_key, AES.MODE_SIV, nonce=nonce)
+        cipher.update(b"")
+
+    name = cipher.decrypt_and_verify(ciphertext, tag).decode("utf-8")
+
+    if name_cache is not None:
+        name_cache.put(key_version, encrypted_name, name)
+    return name
+
+
+def _name_encryption_key() -> bytes:
+    encryption_key = secret_registry.get_secret_bytes(NAME_ENCRYPTION_KEY)
+    if not encryption_key:
+        encryption_key = get_random_bytes(NAME_KEY_BYTES)
+        secret_registry.overwrite_secret_bytes(NAME_ENCRYPTION_KEY, encryption_key)
+    return encryption_key
+
+
+def _envelope_key(encryption_key: bytes) -> bytes:
+    """
+    The key binary name envelopes are sealed with, derived from the name key so that rotating one rotates both
+    """
+    return HKDF(encryption_key, 32, b"", SHA256, context=b"name envelope v1")
+
+
+def _key_version(encryption_key: bytes) -> str:
+    """
+    Identifies a key without revealing it, so that cached names can be tied to the key that encrypted them
+    """
+    return sha256(b"name key version" + encryption_key).hexdigest()[:16]
 
 
+class DecryptedNameCache:
+    """
+    A bounded, least recently used cache of decrypted names, keyed by ciphertext.
+
+    Every entry belongs to the version of the name key it was decrypted with. As soon as a different key is seen, the
+    whole cache is cleared, so a rotated key never serves names decrypted with the old one. Names are held in
+    bytearrays that are overwritten with zeros when evicted or cleared; copies handed out as str are beyond reach.
+    """
+    def __init__(self, max_entries: int = DEFAULT_NAME_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.key_version: Optional[str] = None
+        self.entries: "OrderedDict[Union[str, bytes], bytearray]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key_version: str, encrypted_name: Union[str, bytes]) -> Optional[str]:
+        with self.lock:
+            if key_version != self.key_version:
+                return None
+            name = self.entries.get(encrypted_name)
+            if name is None:
+                return None
+            self.entries.move_to_end(encrypted_name)
+            return name.decode("utf-8")
+
+    def put(self, key_version: str, encrypted_name: Union[str, bytes], name: str):
+        with self.lock:
+            if key_version != self.key_version:
+                self._clear()
+                self.key_version = key_version
+            self.entries[encrypted_name] = bytearray(name.encode("utf-8"))
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                evicted[:] = bytes(len(evicted))
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _clear(self):
+        for name in self.entries.values():
+            name[:] = bytes(len(name))
+        self.entries.clear()
+        self.key_version = None
+
+
+_name_cache: Optional[DecryptedNameCache] = None
+
+
+def enable_name_cache(max_entries: int = DEFAULT_NAME_CACHE_SIZE):
+    """
+    Turns on caching of decrypted names for decrypt_name and decrypt_names. Off by default.
+    """
+    global _name_cache
+    disable_name_cache()
+    _name_cache = DecryptedNameCache(max_entries)
+
+
+def disable_name_cache():
+    """
+    Turns off caching of decrypted names, wiping the names cached so far
+    """
+    global _name_cache
+    name_cache, _name_cache = _name_cache, None
+    if name_cache is not None:
+        name_cache.clear()
+
+
+def clear_name_cache():
+    """
+    Wipes every cached name, e.g. right after the name key was rotated
+    """
+    if _name_cache is not None:
+        _name_cache.clear()
 
 
 class MinimalVoter:
@@ -80,6 +255,8 @@ class MinimalVoter:
     Our representation of a voter, with the national id obfuscated (but still unique).
     This is the class that we want to be using in the majority of our codebase.
     """
+    __slots__ = ("obfuscated_national_id", "obfuscated_first_name", "obfuscated_last_name")
+
     def __init__(self, obfuscated_first_name: str, obfuscated_last_name: str, obfuscated_national_id: str):
         self.obfuscated_national_id = obfuscated_national_id
         self.obfuscated_first_name = obfuscated_first_name
@@ -92,6 +269,8 @@ class Voter:
     This class should only be used in the initial stages when requests come in; in the rest of the
     codebase, we should be using the ObfuscatedVoter class
     """
+    __slots__ = ("national_id", "first_name", "last_name")
+
     def __init__(self, first_name: str, last_name: str, national_id: str):
         self.national_id = national_id
         self.first_name = first_name
@@ -128,3 +307,13 @@ class BallotStatus(Enum):
     BALLOT_COUNTED = "ballot counted"
 
 
+class DeRegistrationStatus(Enum):
+    """
+    An enum that represents what a bulk de-registration did for one national ID.
+    """
+    DE_REGISTERED = "de-registered"
+    ERASED = "de-registered, and erased from the registry"
+    FRAUD_COMMITTED = "fraud committed: the voter cannot be de-registered"
+    NOT_REGISTERED = "voter not registered"
+
+
@@ -0,0 +1,79 @@
+#
+# This file contains the Bloom filters that let the store reject national IDs and ballot numbers it has never seen
+# without running a query.
+#
+
+import math
+import os
+import threading
+from hashlib import blake2b
+
+from backend.main.monitoring import metrics
+
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 1024
+
+BLOOM_FILTER_ITEMS = "voting_bloom_filter_items"
+BLOOM_FILTER_BYTES = "voting_bloom_filter_bytes"
+BLOOM_FILTER_FALSE_POSITIVE_RATE = "voting_bloom_filter_false_positive_rate"
+BLOOM_FILTER_REJECTIONS = "voting_bloom_filter_rejections_total"
+
+metrics.HELP.update({
+    BLOOM_FILTER_ITEMS: "Values added to each Bloom filter",
+    BLOOM_FILTER_BYTES: "Memory used by the bits of each Bloom filter",
+    BLOOM_FILTER_FALSE_POSITIVE_RATE: "Expected false positive rate of each Bloom filter at its current fill",
+    BLOOM_FILTER_REJECTIONS: "Lookups answered by a Bloom filter without touching the database",
+})
+
+
+class BloomFilter:
+    """
+    A Bloom filter over strings. It never forgets a value it was given, but may claim to have seen a value it hasn't,
+    at roughly the false positive rate it was sized for.
+
+    Values are hashed with a key that is random per filter, so that nobody can craft values that collide on purpose.
+    """
+    def __init__(self, name: str, capacity: int, false_positive_rate: float = FALSE_POSITIVE_RATE):
+        self.name = name
+        self.capacity = max(capacity, MIN_CAPACITY)
+        self.bit_count = int(math.ceil(-self.capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.bit_count / self.capacity * math.log(2))))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+        self.key = os.urandom(16)
+        self.lock = threading.Lock()
+
+    def _positions(self, value: str):
+        digest = blake2b(value.encode("utf-8"), digest_size=16, key=self.key).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, value: str):
+        positions = self._positions(value)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def might_contain(self, value: str) -> bool:
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def publish(self):
+        """
+        Reports the size and expected false positive rate of the filter as metrics
+        """
+        if metrics.enabled():
+            metrics.set_gauge(BLOOM_FILTER_ITEMS, self.count, filter=self.name)
+            metrics.set_gauge(BLOOM_FILTER_BYTES, len(self.bits), filter=self.name)
+            metrics.set_gauge(BLOOM_FILTER_FALSE_POSITIVE_RATE, self.false_positive_rate(), filter=self.name)
@@ -6,17 +6,37 @@ import sqlite3
 
 from sqlite3 import Connection, Cursor, Row
 
-from typing import List
-from backend.main.objects.voter import Voter, VoterStatus,BallotStatus
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from backend.main.objects.voter import Voter, VoterStatus,BallotStatus, DeRegistrationStatus, decrypt_names, \
+    encrypt_name_envelopes
+from backend.main.objects.ballot import ballot_owner_key, ballot_owner_keys
 from backend.main.objects.candidate import Candidate
 from backend.main.objects.voter import VoterStatus
 from backend.main.detection.pii_detection import redact_free_text
-import os, traceback
+from backend.main.monitoring import metrics
+from backend.main.store.bloom_filter import BloomFilter, BLOOM_FILTER_REJECTIONS
+from backend.main.store.memory_store import MemoryVotingStore
+from backend.main.store.snapshot_reader import DEFAULT_MAX_STALENESS_SECONDS, SnapshotReader
+from backend.main.store.storage import DEFAULT_PAGE_SIZE, MEMORY_BACKEND, VotingStorage, check_page_size, \
+    configured_backend
+import os, threading, traceback
 
+# How stale, in seconds, the data behind get_comments, get_winner and fraudulent_voters may be. 0 copies the database
+# for every aggregate that follows a write; "off" runs them on the write connection instead of a snapshot.
+AGGREGATE_MAX_STALENESS_ENV = "AGGREGATE_MAX_STALENESS_SECONDS"
 
-class VotingStore:
+
+def _aggregate_max_staleness() -> Optional[float]:
+    staleness = os.getenv(AGGREGATE_MAX_STALENESS_ENV, str(DEFAULT_MAX_STALENESS_SECONDS))
+    return None if staleness.lower() == "off" else float(staleness)
+
+
+@metrics.instrument_methods("store")
+class VotingStore(VotingStorage):
     """
-    A singleton class that encapsulates the interface between the stores and the databases.
+    A singleton class that encapsulates the interface between the stores and the databases. This is the sqlite
+    backend; if the memory backend is configured, VotingStore() makes a MemoryVotingStore instead.
 
     To use, simply do:
 
@@ -26,6 +46,26 @@ class VotingStore:
 
     voting_store_instance = None
 
+    # Names are kept as encrypted envelopes
+    encrypts_names = True
+
+    # Bloom filters over every registered national ID and every issued ballot number. They are built from the
+    # database on first use, and kept up to date by the methods that add voters and ballots.
+    filter_lock = threading.RLock()
+    voter_filter: Optional[BloomFilter] = None
+    ballot_filter: Optional[BloomFilter] = None
+
+    # Aggregates read from a copy of the database, so their scans neither see half-applied changes nor hold up writers
+    aggregate_max_staleness: Optional[float] = _aggregate_max_staleness()
+    _aggregate_snapshot: Optional[SnapshotReader] = None
+
+    def __new__(cls):
+        # The configured backend decides what VotingStore() builds, so get_instance and refresh_instance work the
+        # same for every backend
+        if cls is VotingStore and configured_backend() == MEMORY_BACKEND:
+            return MemoryVotingStore()
+        return super().__new__(cls)
+
     @staticmethod
     def get_instance():
         if not VotingStore.voting_store_instance:
@@ -60,10 +100,122 @@ class VotingStore:
         return sqlite3.connect(":memory:", check_same_thread=False)
      
 
+    def snapshot(self, path: str):
+        """
+        Copies the whole database into the sqlite file at the given path, overwriting whatever the file held before.
+        Uses the sqlite online backup API, so it is safe to call while the store is in use.
+
+        :param: path The file to write the snapshot to
+        """
+        self.connection.commit()
+        destination = sqlite3.connect(path)
+        try:
+            self.connection.backup(destination)
+        finally:
+            destination.close()
+
+    def restore(self, path: str):
+        """
+        Replaces the contents of this store with a snapshot previously written by VotingStore.snapshot. The snapshot
+        file itself is left untouched, so it can be restored any number of times.
+
+        :param: path The snapshot file to restore from
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        source = sqlite3.connect(path)
+        try:
+            source.backup(self.connection)
+        finally:
+            source.close()
+        self.rebuild_filters()
+        # Results counted before the restore may not hold for the restored ballots
+        self._recent_count_results = None
+        if self._aggregate_snapshot is not None:
+            self._aggregate_snapshot.invalidate()
+
+    @contextmanager
+    def _aggregate_reader(self) -> Iterator[Connection]:
+        """
+        The connection aggregate queries run on: a read-only snapshot of the database, no older than
+        aggregate_max_staleness seconds, or the write connection itself if snapshots are off. A snapshot stays the
+        same until the with block ends, so queries spanning several pages all read the same data.
+        """
+        if self.aggregate_max_staleness is None:
+            yield self.connection
+            return
+        if self._aggregate_snapshot is None:
+            with VotingStore.cache_lock:
+                if self._aggregate_snapshot is None:
+                    self._aggregate_snapshot = SnapshotReader(self.aggregate_max_staleness)
+        with self._aggregate_snapshot.reading(self.connection, VotingStore.write_lock) as connection:
+            yield connection
+
+    def rebuild_filters(self):
+        """
+        Rebuilds the Bloom filters from the voter and ballot tables, sized for twice the rows they hold now
+        """
+        with VotingStore.filter_lock:
+            self.voter_filter = self._build_filter("voters", "SELECT national_id FROM voter")
+            self.ballot_filter = self._build_filter("ballots", "SELECT ballot_id FROM ballot")
+
+    def _build_filter(self, name: str, query: str) -> BloomFilter:
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT count(*) FROM (" + query + ")")
+        bloom_filter = BloomFilter(name, 2 * cursor.fetchone()[0])
+        for (value,) in cursor.execute(query):
+            bloom_filter.add(value)
+        bloom_filter.publish()
+        return bloom_filter
+
+    def _remember(self, voter_national_ids: Iterable[str] = (), ballot_numbers: Iterable[str] = ()):
+        """
+        Adds newly stored national IDs and ballot numbers to the Bloom filters, growing them when they fill up
+        """
+        with VotingStore.filter_lock:
+            if self.voter_filter is None:
+                self.rebuild_filters()
+                return
+            for national_id in voter_national_ids:
+                self.voter_filter.add(national_id)
+            for ballot_number in ballot_numbers:
+                self.ballot_filter.add(ballot_number)
+            if self.voter_filter.is_full() or self.ballot_filter.is_full():
+                self.rebuild_filters()
+            else:
+                self.voter_filter.publish()
+                self.ballot_filter.publish()
+
+    def might_have_voter(self, national_id: str) -> bool:
+        """
+        Checks the Bloom filter for a national ID. Boolean FALSE means the voter was never registered; Boolean TRUE
+        means they probably were, and the database has to be asked.
+        """
+        if self.voter_filter is None:
+            self.rebuild_filters()
+        if self.voter_filter.might_contain(national_id.replace("-", "").replace(" ", "").strip()):
+            return True
+        metrics.increment(BLOOM_FILTER_REJECTIONS, filter="voters")
+        return False
+
+    def might_have_ballot(self, ballot_number: str) -> bool:
+        """
+        Checks the Bloom filter for a ballot number. Boolean FALSE means the ballot was never issued; Boolean TRUE
+        means it probably was, and the database has to be asked.
+        """
+        if self.ballot_filter is None:
+            self.rebuild_filters()
+        if self.ballot_filter.might_contain(ballot_number):
+            return True
+        metrics.increment(BLOOM_FILTER_REJECTIONS, filter="ballots")
+        return False
+
     def create_tables(self):
         """
         Creates Tables
         """
+        # Lets erasures hand the pages they free back, see de_register_voters
+        self.connection.execute('''PRAGMA auto_vacuum = INCREMENTAL''')
         self.connection.execute(
             '''
             CREATE TABLE candidates (
@@ -77,13 +229,16 @@ class VotingStore:
             CREATE TABLE voter (
                 voter_id integer primary key autoincrement,
                 national_id text,
-                first_name text,
-                last_name text,
+                first_name blob,
+                last_name blob,
                 status text,
                 del_flag text
                 );
                 '''
                 )
+        # Keeps the fraud report from scanning every voter, and lookups by national ID from doing the same
+        self.connection.execute('''CREATE INDEX voter_status ON voter (status)''')
+        self.connection.execute('''CREATE INDEX voter_national_id ON voter (national_id)''')
         self.connection.execute(
             '''CREATE TABLE ballot (
                 ballot_id text,
@@ -91,9 +246,14 @@ class VotingStore:
                 candidate_id integer,
                 vote text,
                 national_id text,
-                del_flag boolean 
+                del_flag boolean,
+                owner_key text
                 );
                 ''')
+        # Finds every ballot of a voter in a given status without storing which voter in the index
+        self.connection.execute('''CREATE INDEX ballot_owner_key ON ballot (owner_key, status)''')
+        # Lets the comment pages seek straight to their first counted ballot
+        self.connection.execute('''CREATE INDEX ballot_status ON ballot (status)''')
         self.connection.commit()
 
     def add_candidate(self, candidate_name: str):
@@ -119,13 +279,12 @@ class VotingStore:
         """
         Gets ALL the candidates from the database
         """
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT * FROM candidates""")
-        all_candidate_rows = cursor.fetchall()
-        all_candidates = [Candidate(str(candidate_row[0]), candidate_row[1]) for candidate_row in all_candidate_rows]
-        self.connection.commit()
+        return [Candidate(*candidate_row) for candidate_row in self.iter_candidate_rows()]
 
-        return all_candidates
+    def iter_candidate_rows(self) -> Iterator[Tuple[str, str]]:
+        cursor = self.connection.cursor()
+        cursor.execute("""SELECT CAST(candidate_id AS text), name FROM candidates""")
+        return iter(cursor.fetchall())
     
     def add_Vote(self,voter:Voter) ->bool:
         #minimal_voter=Voter.get_minimal_voter(voter)
@@ -145,8 +304,9 @@ class VotingStore:
                             first_name,
                             last_name,
                             status
-                            ) VALUES (?,?,?,?)''', (voter.national_id,voter.first_name,voter.last_name,str(VoterStatus.REGISTERED_NOT_VOTED.value)))
+                            ) VALUES (?,?,?,?)''', (voter.national_id,*encrypt_name_envelopes((voter.first_name,voter.last_name)),str(VoterStatus.REGISTERED_NOT_VOTED.value)))
                     self.connection.commit()
+                    self._remember(voter_national_ids=(voter.national_id,))
         
                     
                     
@@ -160,17 +320,42 @@ class VotingStore:
             return False
         
     def get_vote(self,national_id:str) :
+        names = self.get_voter_names(national_id)
+        if names:
+            voter=Voter(*names,national_id)
+            return(voter)
+        else:
+            return(None)
+
+    def get_voter_names(self, national_id: str) -> Optional[Tuple[str, str]]:
         sanitized_national_id = national_id.replace("-", "").replace(" ", "").strip()
         cursor = self.connection.cursor()
         cursor.execute("""SELECT first_name,last_name FROM voter WHERE national_id=?""", (sanitized_national_id,))
         voterobject = cursor.fetchone()
-        self.connection.commit()
-        if voterobject:
-            voter=Voter(voterobject[0],voterobject[1],national_id)
-            return(voter)
-        else:
-            return(None)
+        return tuple(decrypt_names(voterobject)) if voterobject else None
         
+    def iter_voter_rows(self, page_size: int = DEFAULT_PAGE_SIZE,
+                        decrypt: bool = True) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields (national_id, first_name, last_name) for every registered voter, reading one page at a time by key and
+        decrypting the names of a page in one batch. Every page is read from the same snapshot.
+        """
+        check_page_size(page_size)
+        with self._aggregate_reader() as connection:
+            after = 0
+            while True:
+                rows = connection.execute(
+                    """SELECT voter_id, national_id, first_name, last_name FROM voter WHERE voter_id>?
+                       ORDER BY voter_id LIMIT ?""", (after, page_size)).fetchall()
+                names = (name for row in rows for name in row[2:])
+                if decrypt:
+                    names = decrypt_names(names)
+                for row in rows:
+                    yield row[1], next(names), next(names)
+                if len(rows) < page_size:
+                    return
+                after = rows[-1][0]
+
     def get_vote_status(self,national_id:str) :
         sanitized_national_id = national_id.replace("-", "").replace(" ", "").strip()
         cursor = self.connection.cursor()
@@ -191,6 +376,55 @@ class VotingStore:
             self.connection.commit()
             return True
 
+    def de_register_voters(self, national_ids: List[str], erase: bool = False) -> Dict[str, DeRegistrationStatus]:
+        with VotingStore.write_lock:
+            cursor = self.connection.cursor()
+            cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS erasure_batch (national_id text primary key,
+                                                                            owner_key text)""")
+            cursor.execute("""DELETE FROM erasure_batch""")
+            cursor.executemany("""INSERT OR IGNORE INTO erasure_batch VALUES (?,?)""",
+                               zip(national_ids, ballot_owner_keys(national_ids)))
+            batch_national_ids = """(SELECT national_id FROM erasure_batch)"""
+            batch_owner_keys = """(SELECT owner_key FROM erasure_batch)"""
+            statuses = dict(cursor.execute(
+                """SELECT national_id, status FROM voter WHERE national_id IN """ + batch_national_ids).fetchall())
+
+            # From here on the batch only holds the voters that may go
+            cursor.execute("""DELETE FROM erasure_batch WHERE national_id NOT IN
+                              (SELECT national_id FROM voter WHERE status!=? AND national_id IN """ +
+                           batch_national_ids + ")", (str(VoterStatus.FRAUD_COMMITTED.value),))
+            # Ballots are found through the owner key index, so each chunk only touches its voters' ballots
+            cursor.execute("""UPDATE ballot SET status=? WHERE status=? AND owner_key IN """ + batch_owner_keys,
+                           (str(BallotStatus.INVALID_BALLOT.value), str(BallotStatus.VOTER_NOT_REGISTERED.value)))
+            if erase:
+                counted = (str(BallotStatus.BALLOT_COUNTED.value), str(BallotStatus.FRAUD_COMMITTED.value))
+                cursor.execute("""DELETE FROM ballot WHERE status NOT IN (?,?) AND owner_key IN """ + batch_owner_keys,
+                               counted)
+                cursor.execute("""UPDATE ballot SET national_id=NULL, owner_key=NULL WHERE owner_key IN """ +
+                               batch_owner_keys)
+                cursor.execute("""DELETE FROM voter WHERE national_id IN """ + batch_national_ids)
+            else:
+                cursor.execute("""UPDATE voter SET status=?, del_flag=? WHERE national_id IN """ + batch_national_ids,
+                               (str(VoterStatus.NOT_REGISTERED.value), False))
+            cursor.execute("""DELETE FROM erasure_batch""")
+            self.connection.commit()
+            if erase:
+                # Erased rows leave free pages behind; give them back rather than letting the database keep its size.
+                # Run as a script, since a plain execute only steps the pragma once and frees a single page.
+                self.connection.executescript("""PRAGMA incremental_vacuum;""")
+
+        done = DeRegistrationStatus.ERASED if erase else DeRegistrationStatus.DE_REGISTERED
+        report = {}
+        for national_id in national_ids:
+            status = statuses.get(national_id)
+            if status is None:
+                report[national_id] = DeRegistrationStatus.NOT_REGISTERED
+            elif VoterStatus(status) == VoterStatus.FRAUD_COMMITTED:
+                report[national_id] = DeRegistrationStatus.FRAUD_COMMITTED
+            else:
+                report[national_id] = done
+        return report
+
         
     def check_specifically_and_valid(self,national_id,ballot_number):
         cursor = self.connection.cursor()
@@ -213,11 +447,16 @@ class VotingStore:
             return(None)
     
     
-    def registory_ballot(self,ballot,status,national_id,voter:Voter):        
+    def registory_ballot(self,ballot,status,national_id,voter:Optional[Voter]=None):
+        # Names are only decrypted when there is a comment to redact them from
+        comment = ballot.voter_comments
+        if comment:
+            first_name, last_name = (voter.first_name, voter.last_name) if voter else self.get_voter_names(national_id)
+            comment = redact_free_text(comment,first_name,last_name)
         cursor = self.connection.cursor()
         cursor.execute("""update ballot 
                        set status=?,candidate_id=?,vote=?,national_id=?,del_flag=? WHERE ballot_id=? """,
-                       (status,ballot.chosen_candidate_id,redact_free_text(ballot.voter_comments,voter.first_name,voter.last_name),national_id,False,ballot.ballot_number))
+                       (status,ballot.chosen_candidate_id,comment,national_id,False,ballot.ballot_number))
         #cursor.execute("""insert into ballot 
         #               (ballot_id,status,candidate_id,vote,national_id,del_flag) values(?,?,?,?,?,?)""",
                        
@@ -225,8 +464,46 @@ class VotingStore:
         return(True)
 
     def new_ballot(self, national_id, ballot_number):
-        self.connection.execute("""insert into ballot (ballot_id, national_id,status) VALUES (?, ?,?)""", (ballot_number,national_id,str(BallotStatus.VOTER_NOT_REGISTERED.value)))
+        self.connection.execute("""insert into ballot (ballot_id, national_id,status,owner_key) VALUES (?, ?,?,?)""", (ballot_number,national_id,str(BallotStatus.VOTER_NOT_REGISTERED.value),ballot_owner_key(national_id)))
         self.connection.commit()
+        self._remember(ballot_numbers=(ballot_number,))
+
+    def add_voters(self, voter_rows: Iterable[Tuple[str, str, str, str]]):
+        """
+        Bulk path for loading many voters at once, e.g. from the synthetic election generator. Unlike add_Vote this
+        does not check for duplicates, so the caller is responsible for the national IDs being unique.
+
+        :param: voter_rows (national_id, first_name, last_name, status) tuples, with the names in plaintext
+        """
+        voter_rows = list(voter_rows)
+        encrypted_names = encrypt_name_envelopes(name for row in voter_rows for name in (row[1], row[2]))
+        self.connection.executemany(
+            """INSERT INTO voter (national_id, first_name, last_name, status) VALUES (?,?,?,?)""",
+            ((row[0], next(encrypted_names), next(encrypted_names), row[3]) for row in voter_rows))
+        self.connection.commit()
+        self._remember(voter_national_ids=(row[0] for row in voter_rows))
+
+    def add_ballots(self, ballot_rows: Iterable[Tuple[str, str, Optional[str], Optional[str], str]]):
+        """
+        Bulk path for loading many ballots at once. Comments are stored as given, so they must already be redacted.
+
+        :param: ballot_rows (ballot_id, status, candidate_id, vote, national_id) tuples
+        """
+        ballot_rows = list(ballot_rows)
+        owner_keys = ballot_owner_keys(row[4] for row in ballot_rows)
+        self.connection.executemany(
+            """INSERT INTO ballot (ballot_id, status, candidate_id, vote, national_id, del_flag, owner_key)
+               VALUES (?,?,?,?,?,0,?)""", ((*row, next(owner_keys)) for row in ballot_rows))
+        self.connection.commit()
+        self._remember(ballot_numbers=(row[0] for row in ballot_rows))
+
+    def invalidate_outstanding_ballots(self, national_id: str, except_ballot: Optional[str] = None) -> int:
+        cursor = self.connection.cursor()
+        cursor.execute("""UPDATE ballot SET status=? WHERE owner_key=? AND status=? AND ballot_id IS NOT ?""",
+                       (str(BallotStatus.INVALID_BALLOT.value), ballot_owner_key(national_id),
+                        str(BallotStatus.VOTER_NOT_REGISTERED.value), except_ballot))
+        self.connection.commit()
+        return cursor.rowcount
 
     def update_ballot_status(self,ballot_id,status):        
         cursor = self.connection.cursor()
@@ -243,34 +520,104 @@ class VotingStore:
     
         
     def get_comments(self) -> List[str]:
-        cursor = self.connection.cursor()
-        cursor.execute("""SELECT vote FROM ballot WHERE status=?""",(str(BallotStatus.BALLOT_COUNTED.value),) )
-        all_comments = cursor.fetchall()
+        with self._aggregate_reader() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""SELECT vote FROM ballot WHERE status=?""",(str(BallotStatus.BALLOT_COUNTED.value),) )
+            all_comments = cursor.fetchall()
         all_comment = [ str(comment_row[0]) for comment_row in all_comments]
-        self.connection.commit()
 
         return (all_comment)   
     
     
+    def get_comments_page(self, after: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        """
+        Returns one page of the comments of counted ballots, in the order they were issued. Pages are found by key
+        rather than offset, so every page costs the same however deep into the results it is.
+
+        :param: after The cursor returned with the previous page, or 0 for the first page
+        :param: limit The most comments to return
+        :returns: The comments, and the cursor of the next page, or None if this was the last one
+        """
+        with self._aggregate_reader() as connection:
+            return self._comments_page(connection, after, limit)
+
+    def iter_comments(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """
+        Yields the comments of every counted ballot, holding only one page in memory at a time. Every page is read
+        from the same snapshot, so the comments are consistent with each other even while ballots are being counted.
+        """
+        with self._aggregate_reader() as connection:
+            after: Optional[int] = 0
+            while after is not None:
+                comments, after = self._comments_page(connection, after, page_size)
+                yield from comments
+
+    def _comments_page(self, connection: Connection, after: int, limit: int) -> Tuple[List[str], Optional[int]]:
+        check_page_size(limit)
+        rows = connection.execute(
+            """SELECT rowid, vote FROM ballot WHERE status=? AND rowid>? ORDER BY rowid LIMIT ?""",
+            (str(BallotStatus.BALLOT_COUNTED.value), after, limit)).fetchall()
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return [str(comment_row[1]) for comment_row in rows], next_cursor
+
     def get_winner(self) :
-        cursor = self.connection.cursor()
-        cursor.execute("""select candidate_id,max(cnt) from (SELECT candidate_id, count(*) as cnt FROM ballot GROUP BY candidate_id )""", )
-        candidate_id = cursor.fetchone()
-  
-        
-        cursor.execute("""select name from  candidates  WHERE candidate_id=?""",(str(candidate_id[0])) )
-        candidate_name = cursor.fetchone()   
+        with self._aggregate_reader() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""select candidate_id,max(cnt) from (SELECT candidate_id, count(*) as cnt FROM ballot WHERE status=? GROUP BY candidate_id )""",
+                           (str(BallotStatus.BALLOT_COUNTED.value),))
+            candidate_id = cursor.fetchone()
+            if candidate_id[1] is None:
+                return None
+
+            cursor.execute("""select name from  candidates  WHERE candidate_id=?""",(str(candidate_id[0]),) )
+            candidate_name = cursor.fetchone()
       
         
         return(Candidate(str(candidate_id[0]),candidate_name[0])) 
     
     
     def fraudulent_voters(self):
-        cursor = self.connection.cursor()    
-        cursor.execute("""SELECT first_name, last_name FROM voter WHERE status=?""",(str(VoterStatus.FRAUD_COMMITTED.value),) )
-        votername = cursor.fetchall()
-        
-        fraudulent_voters_list = [ str(row[0])+ " "+ str(row[1]) for row in votername]
+        with self._aggregate_reader() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""SELECT first_name, last_name FROM voter WHERE status=?""",(str(VoterStatus.FRAUD_COMMITTED.value),) )
+            votername = cursor.fetchall()
+
+        # Both names of every row are decrypted in one batch, then paired up again
+        names = decrypt_names(name for row in votername for name in row)
+        fraudulent_voters_list = [ first_name+ " "+ last_name for first_name, last_name in zip(names, names)]
         return fraudulent_voters_list
-        self.connection.commit()
-        
+
+    def fraudulent_voters_page(self, after: int = 0,
+                               limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        """
+        Returns one page of the names of voters who committed fraud, in registration order, found by key like
+        get_comments_page.
+
+        :param: after The cursor returned with the previous page, or 0 for the first page
+        :param: limit The most names to return
+        :returns: The names, and the cursor of the next page, or None if this was the last one
+        """
+        with self._aggregate_reader() as connection:
+            return self._fraudulent_voters_page(connection, after, limit)
+
+    def iter_fraudulent_voters(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """
+        Yields the names of every voter who committed fraud, holding and decrypting one page at a time. Every page
+        is read from the same snapshot.
+        """
+        with self._aggregate_reader() as connection:
+            after: Optional[int] = 0
+            while after is not None:
+                names, after = self._fraudulent_voters_page(connection, after, page_size)
+                yield from names
+
+    def _fraudulent_voters_page(self, connection: Connection, after: int,
+                                limit: int) -> Tuple[List[str], Optional[int]]:
+        check_page_size(limit)
+        rows = connection.execute(
+            """SELECT voter_id, first_name, last_name FROM voter WHERE status=? AND voter_id>?
+               ORDER BY voter_id LIMIT ?""",
+            (str(VoterStatus.FRAUD_COMMITTED.value), after, limit)).fetchall()
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        names = decrypt_names(name for row in rows for name in row[1:])
+        return [first_name + " " + last_name for first_name, last_name in zip(names, names)], next_cursor
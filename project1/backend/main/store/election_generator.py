@@ -0,0 +1,255 @@
+#
+# This file generates synthetic elections for load and scale testing. Everything is derived from a seed, so the same
+# configuration always produces the same election.
+#
+# To write an election to csv files, run the following from the project1/ directory
+#
+# $ python -m backend.main.store.election_generator --voters 1000000 --seed 7 --out /tmp/election
+#
+
+import argparse
+import csv
+import os
+import random
+from base64 import b64encode
+from typing import Iterator, List, Optional, Tuple
+
+from backend.main.detection.pii_detection import redact_free_text
+from backend.main.objects.voter import VoterStatus, BallotStatus
+from backend.main.store.data_registry import VotingStore
+
+FIRST_NAMES = [
+    "Adam", "Thien", "Neel", "Linda", "Shoujit", "Kathryn", "Aditya", "Rina", "Joseph", "Rose", "Yeong", "Karthik",
+    "Courtney", "Hugo", "Maia", "Arnav", "Daniel", "Amara", "Tomas", "Keiko", "Farah", "Olu", "Ines", "Mateo",
+]
+LAST_NAMES = [
+    "Smith", "Huynh", "Banerjee", "Qi", "Gande", "Collins", "Guha", "Harvey", "Klimek", "Hervey", "Yu", "Jennings",
+    "Kift", "Arora", "Salt", "Okafor", "Novak", "Tanaka", "Haddad", "Adeyemi", "Silva", "Garcia", "Moreau", "Kowalski",
+]
+CANDIDATE_NAMES = [
+    "Joseph Klimek", "Rose Hervey", "Yeong Qi", "Karthik Banerjee", "Courtney Yu", "Hugo Jennings", "Maia Kift",
+    "Arnav Arora",
+]
+COMMENT_WORDS = (
+    "we need better public transportation schools roads and clean water for every district of atlantis please "
+    "invest in housing healthcare jobs parks libraries safety and fair taxes for all citizens thank you"
+).split()
+
+# Multiplying by a number that is coprime with 10^9 is a permutation of the 9 digit national IDs, so consecutive
+# voters get unique but unordered IDs without keeping a set of the ones already handed out.
+NATIONAL_ID_SPACE = 10 ** 9
+NATIONAL_ID_STRIDE = 387_420_489
+
+UNUSED_BALLOT = str(BallotStatus.VOTER_NOT_REGISTERED.value)
+
+VoterRow = Tuple[str, str, str, str]
+BallotRow = Tuple[str, str, Optional[str], Optional[str], str]
+
+
+class ElectionConfig:
+    """
+    The shape of a synthetic election. Rates are probabilities per voter (or per ballot for invalidation), and
+    comment lengths are drawn from a log-normal distribution over the number of words.
+    """
+    def __init__(self,
+                 voter_count: int = 1000,
+                 candidate_count: int = len(CANDIDATE_NAMES),
+                 seed: int = 0,
+                 turnout_rate: float = 0.7,
+                 reissue_rate: float = 0.05,
+                 max_reissues: int = 3,
+                 invalidation_rate: float = 0.5,
+                 fraud_rate: float = 0.01,
+                 comment_rate: float = 0.3,
+                 comment_words_mu: float = 2.5,
+                 comment_words_sigma: float = 0.8,
+                 email_rate: float = 0.05,
+                 phone_rate: float = 0.05,
+                 national_id_rate: float = 0.02,
+                 name_rate: float = 0.05):
+        self.voter_count = voter_count
+        self.candidate_count = candidate_count
+        self.seed = seed
+        self.turnout_rate = turnout_rate
+        self.reissue_rate = reissue_rate
+        self.max_reissues = max_reissues
+        self.invalidation_rate = invalidation_rate
+        self.fraud_rate = fraud_rate
+        self.comment_rate = comment_rate
+        self.comment_words_mu = comment_words_mu
+        self.comment_words_sigma = comment_words_sigma
+        self.email_rate = email_rate
+        self.phone_rate = phone_rate
+        self.national_id_rate = national_id_rate
+        self.name_rate = name_rate
+
+
+def synthetic_national_id(index: int, seed: int = 0) -> str:
+    """
+    The national ID of the index-th generated voter. Unique for every index below 10^9.
+    """
+    return "{0:09d}".format((index * NATIONAL_ID_STRIDE + seed) % NATIONAL_ID_SPACE)
+
+
+def synthetic_ballot_number(rng: random.Random) -> str:
+    """
+    A ballot number with the same shape as generate_ballot_number (nonce-tag-ciphertext, base64 encoded), drawn from
+    the seeded generator instead of being encrypted. These can't be decrypted, but don't need to be: nothing in the
+    store decrypts ballot numbers.
+    """
+    return b64encode(rng.getrandbits(128).to_bytes(16, "big")).decode("utf-8") + "-" + \
+        b64encode(rng.getrandbits(128).to_bytes(16, "big")).decode("utf-8") + "-" + \
+        b64encode(rng.getrandbits(72).to_bytes(9, "big")).decode("utf-8")
+
+
+def _comment(rng: random.Random, config: ElectionConfig, first_name: str, last_name: str, national_id: str) -> str:
+    if rng.random() >= config.comment_rate:
+        return ""
+    word_count = max(1, int(rng.lognormvariate(config.comment_words_mu, config.comment_words_sigma)))
+    words = rng.choices(COMMENT_WORDS, k=word_count)
+    if rng.random() < config.email_rate:
+        words.insert(rng.randrange(len(words) + 1), "{0}.{1}@atlantisnet.co.atlantis".format(
+            first_name.lower(), last_name.lower()))
+    if rng.random() < config.phone_rate:
+        words.insert(rng.randrange(len(words) + 1), "({0:03d}) {1:03d}-{2:04d}".format(
+            rng.randrange(200, 1000), rng.randrange(1000), rng.randrange(10000)))
+    if rng.random() < config.national_id_rate:
+        words.insert(rng.randrange(len(words) + 1), national_id[:3] + "-" + national_id[3:5] + "-" + national_id[5:])
+    if rng.random() < config.name_rate:
+        words.insert(rng.randrange(len(words) + 1), first_name + " " + last_name)
+    return " ".join(words)
+
+
+def generate_election(config: ElectionConfig) -> Iterator[Tuple[VoterRow, List[BallotRow]]]:
+    """
+    Lazily generates the voters of an election together with the ballots issued to each of them, in the shape the
+    store keeps them. Comments in the ballot rows are the raw comments, as submitted by the voter.
+
+    The generated election follows the same rules as balloting.count_ballot: a voter casts their latest ballot, older
+    ballots may have been invalidated, and a fraudulent voter casts a second ballot after their first was counted.
+
+    :param: config The shape of the election to generate
+    :returns: An iterator of (voter row, ballot rows) pairs, one per voter
+    """
+    rng = random.Random(config.seed)
+    candidate_ids = [str(candidate_id) for candidate_id in range(1, config.candidate_count + 1)]
+    popularity = [rng.random() for _ in candidate_ids]
+
+    for index in range(config.voter_count):
+        national_id = synthetic_national_id(index, config.seed)
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+
+        ballot_count = 1
+        if rng.random() < config.reissue_rate:
+            ballot_count += rng.randint(1, config.max_reissues)
+        ballot_numbers = [synthetic_ballot_number(rng) for _ in range(ballot_count)]
+
+        ballots = []
+        for ballot_number in ballot_numbers[:-1]:
+            if rng.random() < config.invalidation_rate:
+                ballots.append((ballot_number, str(BallotStatus.INVALID_BALLOT.value), None, None, national_id))
+            else:
+                ballots.append((ballot_number, UNUSED_BALLOT, None, None, national_id))
+
+        voter_status = VoterStatus.REGISTERED_NOT_VOTED
+        if rng.random() < config.turnout_rate:
+            voter_status = VoterStatus.BALLOT_COUNTED
+            ballots.append((ballot_numbers[-1], str(BallotStatus.BALLOT_COUNTED.value),
+                            rng.choices(candidate_ids, popularity)[0],
+                            _comment(rng, config, first_name, last_name, national_id), national_id))
+
+            if rng.random() < config.fraud_rate:
+                voter_status = VoterStatus.FRAUD_COMMITTED
+                ballots.append((synthetic_ballot_number(rng), str(BallotStatus.FRAUD_COMMITTED.value),
+                                rng.choices(candidate_ids, popularity)[0],
+                                _comment(rng, config, first_name, last_name, national_id), national_id))
+        else:
+            ballots.append((ballot_numbers[-1], UNUSED_BALLOT, None, None, national_id))
+
+        yield (national_id, first_name, last_name, str(voter_status.value)), ballots
+
+
+def write_election_files(config: ElectionConfig, directory: str):
+    """
+    Streams a generated election into candidates.csv, voters.csv and ballots.csv in the given directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "candidates.csv"), "w", newline="") as candidates_file:
+        writer = csv.writer(candidates_file)
+        writer.writerow(("candidate_id", "name"))
+        for candidate_id in range(1, config.candidate_count + 1):
+            writer.writerow((candidate_id, _candidate_name(candidate_id)))
+
+    with open(os.path.join(directory, "voters.csv"), "w", newline="") as voters_file, \
+            open(os.path.join(directory, "ballots.csv"), "w", newline="") as ballots_file:
+        voter_writer = csv.writer(voters_file)
+        ballot_writer = csv.writer(ballots_file)
+        voter_writer.writerow(("national_id", "first_name", "last_name", "status"))
+        ballot_writer.writerow(("ballot_id", "status", "candidate_id", "comment", "national_id"))
+        for voter_row, ballot_rows in generate_election(config):
+            voter_writer.writerow(voter_row)
+            ballot_writer.writerows(ballot_rows)
+
+
+def load_election(config: ElectionConfig, store: VotingStore, chunk_size: int = 50_000):
+    """
+    Generates an election straight into a store through its bulk paths, one transaction per chunk of voters. Cast
+    ballot comments are redacted on the way in, the same way balloting.count_ballot would have stored them.
+
+    The store is expected to hold no candidates yet, so that the generated candidate ids line up.
+    """
+    for candidate_id in range(1, config.candidate_count + 1):
+        store.add_candidate(_candidate_name(candidate_id))
+
+    voter_rows = []
+    ballot_rows = []
+    for voter_row, ballots in generate_election(config):
+        voter_rows.append(voter_row)
+        for ballot_id, status, candidate_id, comment, national_id in ballots:
+            if comment:
+                comment = redact_free_text(comment, voter_row[1], voter_row[2])
+            ballot_rows.append((ballot_id, status, candidate_id, comment, national_id))
+
+        if len(voter_rows) >= chunk_size:
+            store.add_voters(voter_rows)
+            store.add_ballots(ballot_rows)
+            voter_rows = []
+            ballot_rows = []
+
+    store.add_voters(voter_rows)
+    store.add_ballots(ballot_rows)
+
+
+def _candidate_name(candidate_id: int) -> str:
+    name = CANDIDATE_NAMES[(candidate_id - 1) % len(CANDIDATE_NAMES)]
+    if candidate_id > len(CANDIDATE_NAMES):
+        name += " " + str((candidate_id - 1) // len(CANDIDATE_NAMES) + 1)
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic election as csv files")
+    parser.add_argument("--out", required=True, help="directory to write candidates.csv, voters.csv and ballots.csv")
+    parser.add_argument("--voters", type=int, default=1000)
+    parser.add_argument("--candidates", type=int, default=len(CANDIDATE_NAMES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--turnout-rate", type=float, default=0.7)
+    parser.add_argument("--reissue-rate", type=float, default=0.05)
+    parser.add_argument("--invalidation-rate", type=float, default=0.5)
+    parser.add_argument("--fraud-rate", type=float, default=0.01)
+    parser.add_argument("--comment-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    write_election_files(ElectionConfig(voter_count=args.voters,
+                                        candidate_count=args.candidates,
+                                        seed=args.seed,
+                                        turnout_rate=args.turnout_rate,
+                                        reissue_rate=args.reissue_rate,
+                                        invalidation_rate=args.invalidation_rate,
+                                        fraud_rate=args.fraud_rate,
+                                        comment_rate=args.comment_rate), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#
+# This file is the pure-memory storage backend. It keeps voters and ballots in hash indexes by national ID and ballot
+# number, and keeps a running count of the counted ballots of every candidate, so every operation the APIs use is a
+# dict lookup. Nothing is persisted: it is meant for simulations and tests, where the sqlite round trips dominate.
+#
+
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.main.detection.pii_detection import redact_free_text
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus, DeRegistrationStatus
+from backend.main.store.storage import DEFAULT_PAGE_SIZE, VotingStorage, check_page_size
+
+BALLOT_COUNTED = str(BallotStatus.BALLOT_COUNTED.value)
+BALLOT_UNUSED = str(BallotStatus.VOTER_NOT_REGISTERED.value)
+BALLOT_INVALID = str(BallotStatus.INVALID_BALLOT.value)
+FRAUD_COMMITTED = str(VoterStatus.FRAUD_COMMITTED.value)
+
+
+class _VoterRecord:
+    __slots__ = ("voter_id", "national_id", "first_name", "last_name", "status", "del_flag")
+
+    def __init__(self, voter_id: int, national_id: str, first_name: str, last_name: str, status: str):
+        self.voter_id = voter_id
+        self.national_id = national_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.status = status
+        self.del_flag = None
+
+
+class _BallotRecord:
+    __slots__ = ("rowid", "ballot_id", "status", "candidate_id", "vote", "national_id", "del_flag")
+
+    def __init__(self, rowid: int, ballot_id: str, status: str, candidate_id, vote: Optional[str], national_id: str,
+                 del_flag):
+        self.rowid = rowid
+        self.ballot_id = ballot_id
+        self.status = status
+        self.candidate_id = candidate_id
+        self.vote = vote
+        self.national_id = national_id
+        self.del_flag = del_flag
+
+
+def _sanitize(national_id: str) -> str:
+    return national_id.replace("-", "").replace(" ", "").strip()
+
+
+def _candidate_key(candidate_id):
+    # The sqlite backend keeps candidate IDs as integers, whether they arrive as "2" or 2
+    if isinstance(candidate_id, str) and candidate_id.strip().isdigit():
+        return int(candidate_id)
+    return candidate_id
+
+
+@metrics.instrument_methods("store")
+class MemoryVotingStore(VotingStorage):
+    """
+    The memory backend of the voting store. Behaves like the sqlite VotingStore for everything the balloting and
+    registry APIs do. Pages are read from the live data, so unlike the sqlite backend they aren't a snapshot.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.candidates: List[str] = []
+        self.voters: Dict[str, _VoterRecord] = {}
+        self.voter_list: List[Optional[_VoterRecord]] = []
+        self.ballots: Dict[str, _BallotRecord] = {}
+        self.ballot_list: List[_BallotRecord] = []
+        self.ballots_by_voter: Dict[str, List[_BallotRecord]] = {}
+        self.counted_ballots: Counter = Counter()
+        # Kept sorted, so that pages of fraudulent voters are found by bisecting
+        self.fraud_voter_ids: List[int] = []
+
+    @property
+    def connection(self) -> "MemoryVotingStore":
+        """
+        VotingStore.refresh_instance releases the old store by closing its connection. There is none here, so the
+        store stands in for it.
+        """
+        return self
+
+    def close(self):
+        with self.lock:
+            self.__init__()
+
+    #
+    # Candidates
+    #
+
+    def add_candidate(self, candidate_name: str):
+        with self.lock:
+            self.candidates.append(candidate_name)
+
+    def get_candidate(self, candidate_id: str) -> Optional[Candidate]:
+        candidate_key = _candidate_key(candidate_id)
+        if isinstance(candidate_key, int) and 0 < candidate_key <= len(self.candidates):
+            return Candidate(candidate_id, self.candidates[candidate_key - 1])
+        return None
+
+    def get_all_candidates(self) -> List[Candidate]:
+        return [Candidate(*candidate_row) for candidate_row in self.iter_candidate_rows()]
+
+    def iter_candidate_rows(self) -> Iterator[Tuple[str, str]]:
+        return ((str(index + 1), name) for index, name in enumerate(self.candidates))
+
+    #
+    # Voters
+    #
+
+    def add_Vote(self, voter: Voter) -> bool:
+        with self.lock:
+            if voter.national_id in self.voters:
+                return False
+            self._add_voter(voter.national_id, voter.first_name, voter.last_name,
+                            str(VoterStatus.REGISTERED_NOT_VOTED.value))
+            return True
+
+    def add_voters(self, voter_rows: Iterable[Tuple[str, str, str, str]]):
+        with self.lock:
+            for national_id, first_name, last_name, status in voter_rows:
+                self._add_voter(national_id, first_name, last_name, status)
+
+    def _add_voter(self, national_id: str, first_name: str, last_name: str, status: str):
+        record = _VoterRecord(len(self.voter_list) + 1, national_id, first_name, last_name, status)
+        self.voters.setdefault(national_id, record)
+        self.voter_list.append(record)
+        if status == FRAUD_COMMITTED:
+            self._flag_fraud(record.voter_id)
+
+    def get_vote(self, national_id: str) -> Optional[Voter]:
+        record = self.voters.get(_sanitize(national_id))
+        return Voter(record.first_name, record.last_name, national_id) if record else None
+
+    def get_voter_names(self, national_id: str) -> Optional[Tuple[str, str]]:
+        record = self.voters.get(_sanitize(national_id))
+        return (record.first_name, record.last_name) if record else None
+
+    def iter_voter_rows(self, page_size: int = DEFAULT_PAGE_SIZE,
+                        decrypt: bool = True) -> Iterator[Tuple[str, str, str]]:
+        # Voters are only ever appended, and erased ones are left as None, so the list can be walked as it grows
+        for index in range(len(self.voter_list)):
+            record = self.voter_list[index]
+            if record is not None:
+                yield record.national_id, record.first_name, record.last_name
+
+    def get_vote_status(self, national_id: str) -> Optional[str]:
+        record = self.voters.get(_sanitize(national_id))
+        return record.status if record else None
+
+    def update_vote_status(self, national_id: str, status: str) -> bool:
+        with self.lock:
+            record = self.voters.get(national_id)
+            if record is not None:
+                record.status = status
+                if status == FRAUD_COMMITTED:
+                    self._flag_fraud(record.voter_id)
+                else:
+                    self._unflag_fraud(record.voter_id)
+        return True
+
+    def delete_Vote(self, national_id: str) -> bool:
+        if VoterStatus(self.get_vote_status(national_id)) == VoterStatus.FRAUD_COMMITTED:
+            return False
+        with self.lock:
+            self.voters[national_id].del_flag = False
+        return True
+
+    def de_register_voters(self, national_ids: List[str], erase: bool = False) -> Dict[str, DeRegistrationStatus]:
+        report = {}
+        with self.lock:
+            leaving = set()
+            for national_id in national_ids:
+                record = self.voters.get(national_id)
+                if record is None:
+                    report[national_id] = DeRegistrationStatus.NOT_REGISTERED
+                elif record.status == FRAUD_COMMITTED:
+                    report[national_id] = DeRegistrationStatus.FRAUD_COMMITTED
+                else:
+                    report[national_id] = DeRegistrationStatus.ERASED if erase else DeRegistrationStatus.DE_REGISTERED
+                    leaving.add(national_id)
+                    if erase:
+                        del self.voters[national_id]
+                        self.voter_list[record.voter_id - 1] = None
+                    else:
+                        record.status = str(VoterStatus.NOT_REGISTERED.value)
+                        record.del_flag = False
+
+            for national_id in leaving:
+                for record in self.ballots_by_voter.get(national_id, ()):
+                    if record.status == BALLOT_UNUSED:
+                        record.status = BALLOT_INVALID
+                    if erase:
+                        # Records stay in the list, so the rowids page cursors point at don't move
+                        if record.status in (BALLOT_INVALID, BALLOT_UNUSED):
+                            self.ballots.pop(record.ballot_id, None)
+                            record.vote = None
+                        record.national_id = None
+                if erase:
+                    self.ballots_by_voter.pop(national_id, None)
+        return report
+
+    def might_have_voter(self, national_id: str) -> bool:
+        return _sanitize(national_id) in self.voters
+
+    #
+    # Ballots
+    #
+
+    def new_ballot(self, national_id: str, ballot_number: str):
+        with self.lock:
+            self._add_ballot(ballot_number, BALLOT_UNUSED, None, None, national_id, None)
+
+    def add_ballots(self, ballot_rows: Iterable[Tuple[str, str, Optional[str], Optional[str], str]]):
+        with self.lock:
+            for ballot_id, status, candidate_id, vote, national_id in ballot_rows:
+                self._add_ballot(ballot_id, status, candidate_id, vote, national_id, 0)
+
+    def _add_ballot(self, ballot_id: str, status: str, candidate_id, vote: Optional[str], national_id: str, del_flag):
+        record = _BallotRecord(len(self.ballot_list) + 1, ballot_id, status, _candidate_key(candidate_id), vote,
+                               national_id, del_flag)
+        self.ballots.setdefault(ballot_id, record)
+        self.ballot_list.append(record)
+        self.ballots_by_voter.setdefault(_sanitize(national_id), []).append(record)
+        if status == BALLOT_COUNTED:
+            self.counted_ballots[record.candidate_id] += 1
+
+    def get_ballot(self, ballot_number: str) -> Optional[str]:
+        record = self.ballots.get(ballot_number)
+        return record.status if record else None
+
+    def check_specifically_and_valid(self, national_id: str, ballot_number: str) -> int:
+        record = self.ballots.get(ballot_number)
+        return 1 if record is not None and record.national_id == national_id else 0
+
+    def registory_ballot(self, ballot: Ballot, status: str, national_id: str, voter: Optional[Voter] = None) -> bool:
+        comment = ballot.voter_comments
+        if comment:
+            first_name, last_name = (voter.first_name, voter.last_name) if voter else self.get_voter_names(national_id)
+            comment = redact_free_text(comment, first_name, last_name)
+        with self.lock:
+            record = self.ballots.get(ballot.ballot_number)
+            if record is not None:
+                self._set_ballot_status(record, status, _candidate_key(ballot.chosen_candidate_id))
+                record.vote = comment
+                record.national_id = national_id
+                record.del_flag = False
+        return True
+
+    def invalidate_outstanding_ballots(self, national_id: str, except_ballot: Optional[str] = None) -> int:
+        invalidated = 0
+        with self.lock:
+            for record in self.ballots_by_voter.get(_sanitize(national_id), ()):
+                if record.status == BALLOT_UNUSED and record.ballot_id != except_ballot:
+                    record.status = BALLOT_INVALID
+                    invalidated += 1
+        return invalidated
+
+    def update_ballot_status(self, ballot_id: str, status: str) -> bool:
+        with self.lock:
+            record = self.ballots.get(ballot_id)
+            if record is not None:
+                self._set_ballot_status(record, status, record.candidate_id)
+        return True
+
+    def _set_ballot_status(self, record: _BallotRecord, status: str, candidate_id):
+        # Keeps the per-candidate counts in step with every ballot that moves into or out of being counted
+        if record.status == BALLOT_COUNTED:
+            self.counted_ballots[record.candidate_id] -= 1
+        record.status = status
+        record.candidate_id = candidate_id
+        if status == BALLOT_COUNTED:
+            self.counted_ballots[candidate_id] += 1
+
+    def might_have_ballot(self, ballot_number: str) -> bool:
+        return ballot_number in self.ballots
+
+    #
+    # Aggregates
+    #
+
+    def get_comments(self) -> List[str]:
+        return [str(record.vote) for record in self.ballot_list if record.status == BALLOT_COUNTED]
+
+    def get_comments_page(self, after: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        check_page_size(limit)
+        comments = []
+        ballot_list = self.ballot_list
+        for index in range(after, len(ballot_list)):
+            record = ballot_list[index]
+            if record.status == BALLOT_COUNTED:
+                comments.append(str(record.vote))
+                if len(comments) == limit:
+                    return comments, record.rowid
+        return comments, None
+
+    def iter_comments(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        after: Optional[int] = 0
+        while after is not None:
+            comments, after = self.get_comments_page(after, page_size)
+            yield from comments
+
+    def get_winner(self) -> Optional[Candidate]:
+        winner, most_votes = None, 0
+        # Ties go to the lowest candidate ID, as they do on sqlite
+        for candidate_id in sorted(self.counted_ballots, key=lambda key: (key is not None, str(key).zfill(20))):
+            if self.counted_ballots[candidate_id] > most_votes:
+                winner, most_votes = candidate_id, self.counted_ballots[candidate_id]
+        if winner is None:
+            return None
+        candidate = self.get_candidate(winner)
+        return Candidate(str(winner), candidate.name if candidate else None)
+
+    def fraudulent_voters(self) -> List[str]:
+        with self.lock:
+            voter_ids = list(self.fraud_voter_ids)
+        return [self._full_name(voter_id) for voter_id in voter_ids]
+
+    def fraudulent_voters_page(self, after: int = 0,
+                               limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        check_page_size(limit)
+        with self.lock:
+            voter_ids = self.fraud_voter_ids
+            start = bisect_right(voter_ids, after)
+            page = voter_ids[start:start + limit]
+        next_cursor = page[-1] if len(page) == limit else None
+        return [self._full_name(voter_id) for voter_id in page], next_cursor
+
+    def iter_fraudulent_voters(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        after: Optional[int] = 0
+        while after is not None:
+            names, after = self.fraudulent_voters_page(after, page_size)
+            yield from names
+
+    def _flag_fraud(self, voter_id: int):
+        index = bisect_left(self.fraud_voter_ids, voter_id)
+        if index == len(self.fraud_voter_ids) or self.fraud_voter_ids[index] != voter_id:
+            self.fraud_voter_ids.insert(index, voter_id)
+
+    def _unflag_fraud(self, voter_id: int):
+        index = bisect_left(self.fraud_voter_ids, voter_id)
+        if index < len(self.fraud_voter_ids) and self.fraud_voter_ids[index] == voter_id:
+            del self.fraud_voter_ids[index]
+
+    def _full_name(self, voter_id: int) -> str:
+        record = self.voter_list[voter_id - 1]
+        return record.first_name + " " + record.last_name
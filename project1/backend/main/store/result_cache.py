@@ -0,0 +1,103 @@
+#
+# This file contains the cache that makes retried requests cheap: the result of a request is remembered for a while,
+# keyed by a digest of the request, and handed back when the same request comes in again.
+#
+
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from backend.main.monitoring import metrics
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_TTL_SECONDS = 600.0
+
+RESULT_CACHE_LOOKUPS = "voting_result_cache_lookups_total"
+RESULT_CACHE_ENTRIES = "voting_result_cache_entries"
+
+metrics.HELP.update({
+    RESULT_CACHE_LOOKUPS: "Lookups in the recent-result caches, per cache and outcome",
+    RESULT_CACHE_ENTRIES: "Results currently held by the recent-result caches",
+})
+
+
+def request_digest(*fields: Optional[str]) -> str:
+    """
+    Digests the fields of a request into a cache key, so that the cache never holds national IDs or ballot numbers
+    """
+    digest = sha256()
+    for field in fields:
+        encoded = ("" if field is None else str(field)).encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class RecentResultCache:
+    """
+    A bounded cache of recent results, evicting the least recently used entry when full and expiring entries after
+    a time to live. Safe to share between threads: while a result is being computed, identical requests wait for it
+    instead of computing it again.
+    """
+    def __init__(self, name: str, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.pending: Dict[str, threading.Event] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            return self._get(key, time.monotonic())
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], should_cache: Callable[[Any], bool]) -> Any:
+        """
+        Returns the cached result for the key, or computes it. Results are only kept if should_cache accepts them.
+        """
+        while True:
+            with self.lock:
+                result = self._get(key, time.monotonic())
+                if result is not None:
+                    metrics.increment(RESULT_CACHE_LOOKUPS, cache=self.name, result="hit")
+                    return result
+                pending = self.pending.get(key)
+                if pending is None:
+                    self.pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        metrics.increment(RESULT_CACHE_LOOKUPS, cache=self.name, result="miss")
+        try:
+            result = compute()
+            if should_cache(result):
+                with self.lock:
+                    self.entries[key] = (time.monotonic() + self.ttl_seconds, result)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                    metrics.set_gauge(RESULT_CACHE_ENTRIES, len(self.entries), cache=self.name)
+            return result
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get(self, key: str, now: float) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return result
@@ -0,0 +1,160 @@
+#
+# This file keeps a read-only copy of the store's database for aggregate queries, so that long scans never run on,
+# or wait for, the connection ballots are being written through.
+#
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from sqlite3 import Connection
+from typing import Dict, Iterator, Optional
+
+from backend.main.monitoring import metrics
+
+DEFAULT_MAX_STALENESS_SECONDS = 1.0
+
+# Pages copied per backup step: 1 MiB with sqlite's default page size. Writers are only held up for the last step.
+DEFAULT_PAGES_PER_STEP = 256
+
+# How often a copy may be restarted by writes landing in the middle of it before it is taken in a single step
+MAX_COPY_RESTARTS = 8
+
+# Seconds to wait before retrying a step that found a write transaction open on the source
+COPY_RETRY_SLEEP_SECONDS = 0.001
+
+SNAPSHOT_REFRESH_DURATION = "voting_aggregate_snapshot_refresh_seconds"
+SNAPSHOT_SINGLE_STEP_COPIES = "voting_aggregate_snapshot_single_step_copies_total"
+
+metrics.HELP.update({
+    SNAPSHOT_REFRESH_DURATION: "Time spent copying the database into the read-only aggregate snapshot",
+    SNAPSHOT_SINGLE_STEP_COPIES: "Snapshot copies restarted so often by writes that they were finished in one step",
+})
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class SnapshotReader:
+    """
+    A read-only, in-memory copy of a database, refreshed with the sqlite backup API.
+
+    A refresh only happens when the database changed since the last copy, and at most once per max_staleness seconds,
+    so aggregates may lag the writer by up to that much. With max_staleness at 0 every aggregate sees every change.
+
+    The copy is made pages_per_step pages at a time without the writers' lock, which is only taken for the last step,
+    so a snapshot never contains half of a change that spans several commits. The copy overwrites the current
+    snapshot in place, unless a reading started on it is still going on: then it goes to the snapshot that was retired
+    last, or to a new one if that one is busy too, and readers keep the copy they started on.
+    """
+    def __init__(self, max_staleness: float = DEFAULT_MAX_STALENESS_SECONDS,
+                 pages_per_step: int = DEFAULT_PAGES_PER_STEP):
+        self.max_staleness = max_staleness
+        self.pages_per_step = pages_per_step
+        self.lock = threading.Lock()
+        self.reader: Optional[Connection] = None
+        self.spare: Optional[Connection] = None
+        self.readings: Dict[Connection, int] = {}
+        self.refreshed_at = 0.0
+        self.source_changes: Optional[int] = None
+
+    @contextmanager
+    def reading(self, source: Connection, source_lock) -> Iterator[Connection]:
+        """
+        Hands out the current read-only copy of the source database, refreshing it first if it is out of date. The
+        copy stays the same for the whole with block, however many refreshes happen in the meantime.
+
+        :param: source The connection that writes go through
+        :param: source_lock The lock writers hold while applying a change that spans several commits
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.reader is None or \
+                    (source.total_changes != self.source_changes and now - self.refreshed_at >= self.max_staleness):
+                self._refresh(source, source_lock)
+                self.refreshed_at = now
+            reader = self.reader
+            self.readings[reader] = self.readings.get(reader, 0) + 1
+        try:
+            yield reader
+        finally:
+            with self.lock:
+                self.readings[reader] -= 1
+                if not self.readings[reader]:
+                    del self.readings[reader]
+                    if reader is not self.reader:
+                        self._retire(reader)
+
+    def invalidate(self):
+        """
+        Forces the next aggregate to take a fresh copy, e.g. after the whole database was replaced
+        """
+        with self.lock:
+            self.source_changes = None
+            self.refreshed_at = float("-inf")
+
+    def _refresh(self, source: Connection, source_lock):
+        if self.reader is not None and self.reader not in self.readings:
+            target = self.reader
+        elif self.spare is not None:
+            target, self.spare = self.spare, None
+        else:
+            target = sqlite3.connect(":memory:", check_same_thread=False)
+            target.execute("PRAGMA query_only = ON")
+
+        start = time.perf_counter()
+        self.source_changes = self._copy(source, source_lock, target)
+        metrics.observe(SNAPSHOT_REFRESH_DURATION, time.perf_counter() - start)
+
+        # A snapshot that isn't the target is still being read, and is retired once its last reading ends
+        self.reader = target
+
+    def _retire(self, reader: Connection):
+        if self.spare is None:
+            self.spare = reader
+        else:
+            reader.close()
+
+    def _copy(self, source: Connection, source_lock, target: Connection) -> int:
+        """
+        Copies the source database into the target, and returns the source's change count as of the start of the last
+        step. Changes landing during that step may or may not be in the copy, so they are copied again next time.
+        """
+        locked = False
+        last_remaining: Optional[int] = None
+        restarts = 0
+        changes = source.total_changes
+
+        def progress(status: int, remaining: int, total: int):
+            nonlocal locked, last_remaining, restarts, changes
+            if status == sqlite3.SQLITE_DONE:
+                return
+            # Writes through the source connection restart the copy of an in-memory database
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+                if restarts > MAX_COPY_RESTARTS:
+                    raise _TooManyRestarts()
+            last_remaining = remaining
+            if not locked and remaining <= self.pages_per_step:
+                source_lock.acquire()
+                locked = True
+            changes = source.total_changes
+
+        try:
+            if source.execute("PRAGMA page_count").fetchone()[0] <= self.pages_per_step:
+                source_lock.acquire()
+                locked = True
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=progress, sleep=COPY_RETRY_SLEEP_SECONDS)
+            except _TooManyRestarts:
+                metrics.increment(SNAPSHOT_SINGLE_STEP_COPIES)
+                if not locked:
+                    source_lock.acquire()
+                    locked = True
+                changes = source.total_changes
+                source.backup(target)
+            return changes
+        finally:
+            if locked:
+                source_lock.release()
@@ -0,0 +1,301 @@
+#
+# This file is the interface every storage backend of the voting store implements, and the configuration that picks
+# one. The balloting and registry APIs only use the methods below, so they run unchanged on any backend.
+#
+# The backend is chosen with the VOTING_STORE_BACKEND environment variable:
+#
+#   sqlite  (default) VotingStore in data_registry.py, the database the election is run on
+#   memory  MemoryVotingStore in memory_store.py, dicts and lists for fast simulations and tests; nothing persists
+#
+# To run the test suite against the memory backend, run the following from the /backend directory
+#
+# $ VOTING_STORE_BACKEND=memory python -m pytest
+#
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.candidate import Candidate
+from backend.main.objects.voter import DeRegistrationStatus, Voter
+from backend.main.store.result_cache import RecentResultCache
+
+STORAGE_BACKEND_ENV = "VOTING_STORE_BACKEND"
+SQLITE_BACKEND = "sqlite"
+MEMORY_BACKEND = "memory"
+STORAGE_BACKENDS = (SQLITE_BACKEND, MEMORY_BACKEND)
+
+# Rows fetched per query by the paginated and streaming aggregates
+DEFAULT_PAGE_SIZE = 1000
+
+
+def configured_backend() -> str:
+    """
+    :returns: The name of the storage backend new stores are created with
+    """
+    backend = os.getenv(STORAGE_BACKEND_ENV, SQLITE_BACKEND).strip().lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError("{0} must be one of {1}, not {2!r}".format(STORAGE_BACKEND_ENV, STORAGE_BACKENDS, backend))
+    return backend
+
+
+def check_page_size(page_size: int):
+    """
+    Pages are found by the key of the last row of the previous page, so every page has to hold at least one row
+    """
+    if page_size < 1:
+        raise ValueError("A page must hold at least one row, not {0}".format(page_size))
+
+
+class VotingStorage(ABC):
+    """
+    Everything the balloting and registry APIs need from a store. Statuses are stored and returned as the .value of
+    VoterStatus and BallotStatus.
+    """
+
+    # Held by changes that take several steps, e.g. counting a ballot, so that no reader sees them half-applied
+    write_lock = threading.RLock()
+
+    # Whether names are kept encrypted at rest, and so come out of iter_voter_rows(decrypt=False) as ciphertexts
+    encrypts_names = False
+
+    # Results of recently counted ballots, so that client retries get the original answer
+    cache_lock = threading.Lock()
+    _recent_count_results: Optional[RecentResultCache] = None
+
+    @property
+    def recent_count_results(self) -> RecentResultCache:
+        """
+        The recent-result cache of count_ballot. It belongs to this store, so refreshing the store empties it.
+        """
+        if self._recent_count_results is None:
+            with VotingStorage.cache_lock:
+                if self._recent_count_results is None:
+                    self._recent_count_results = RecentResultCache("count_ballot")
+        return self._recent_count_results
+
+    #
+    # Candidates
+    #
+
+    @abstractmethod
+    def add_candidate(self, candidate_name: str):
+        """
+        Registers a candidate, giving them the next candidate ID
+        """
+
+    @abstractmethod
+    def get_candidate(self, candidate_id: str) -> Optional[Candidate]:
+        """
+        Returns the candidate specified, if that candidate is registered. Otherwise returns None.
+        """
+
+    @abstractmethod
+    def get_all_candidates(self) -> List[Candidate]:
+        """
+        Returns every registered candidate, in the order they were registered
+        """
+
+    @abstractmethod
+    def iter_candidate_rows(self) -> Iterator[Tuple[str, str]]:
+        """
+        Row path of get_all_candidates: yields (candidate_id, name) tuples instead of Candidate objects
+        """
+
+    #
+    # Voters
+    #
+
+    @abstractmethod
+    def add_Vote(self, voter: Voter) -> bool:
+        """
+        Registers a voter
+
+        :returns: Boolean TRUE if the voter was added. Boolean FALSE if their national ID was already registered.
+        """
+
+    @abstractmethod
+    def add_voters(self, voter_rows: Iterable[Tuple[str, str, str, str]]):
+        """
+        Bulk path for loading many voters at once, without checking for duplicates
+
+        :param: voter_rows (national_id, first_name, last_name, status) tuples, with the names in plaintext
+        """
+
+    @abstractmethod
+    def get_vote(self, national_id: str) -> Optional[Voter]:
+        """
+        Returns the registered voter with the national ID, names included, or None
+        """
+
+    @abstractmethod
+    def get_voter_names(self, national_id: str) -> Optional[Tuple[str, str]]:
+        """
+        Row path of get_vote: returns the (first_name, last_name) of the voter with the national ID, or None
+        """
+
+    @abstractmethod
+    def iter_voter_rows(self, page_size: int = DEFAULT_PAGE_SIZE,
+                        decrypt: bool = True) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields (national_id, first_name, last_name) for every registered voter, in registration order, holding only
+        one page in memory at a time.
+
+        :param: decrypt Whether to yield the names in plaintext. Otherwise they are yielded as kept at rest, which for
+                a backend that encrypts_names means ciphertexts for decrypt_names, e.g. to decrypt them on a pool of
+                worker processes
+        """
+
+    @abstractmethod
+    def get_vote_status(self, national_id: str) -> Optional[str]:
+        """
+        Returns the VoterStatus value of the voter with the national ID, or None if they were never registered
+        """
+
+    @abstractmethod
+    def update_vote_status(self, national_id: str, status: str) -> bool:
+        """
+        Sets the VoterStatus value of the voter with the national ID
+        """
+
+    @abstractmethod
+    def delete_Vote(self, national_id: str) -> bool:
+        """
+        Flags a voter as deleted, unless they committed fraud
+
+        :returns: Boolean TRUE if the voter was flagged. Boolean FALSE if they committed fraud.
+        """
+
+    @abstractmethod
+    def de_register_voters(self, national_ids: List[str], erase: bool = False) -> Dict[str, DeRegistrationStatus]:
+        """
+        De-registers a chunk of voters at once, applying the same rule as delete_Vote: voters who committed fraud
+        stay. The unused ballots of every de-registered voter become invalid.
+
+        :param: national_ids Sanitized national IDs
+        :param: erase Also delete the voters and their uncounted ballots, and unlink their counted ballots from them
+        :returns: What happened to every national ID
+        """
+
+    @abstractmethod
+    def might_have_voter(self, national_id: str) -> bool:
+        """
+        Boolean FALSE means the voter was never registered; Boolean TRUE means they may have been, and the other
+        methods have to be asked.
+        """
+
+    #
+    # Ballots
+    #
+
+    @abstractmethod
+    def new_ballot(self, national_id: str, ballot_number: str):
+        """
+        Records a newly issued, unused ballot for the voter
+        """
+
+    @abstractmethod
+    def add_ballots(self, ballot_rows: Iterable[Tuple[str, str, Optional[str], Optional[str], str]]):
+        """
+        Bulk path for loading many ballots at once. Comments are stored as given, so they must already be redacted.
+
+        :param: ballot_rows (ballot_id, status, candidate_id, vote, national_id) tuples
+        """
+
+    @abstractmethod
+    def get_ballot(self, ballot_number: str) -> Optional[str]:
+        """
+        Returns the BallotStatus value of the ballot, or None if it was never issued
+        """
+
+    @abstractmethod
+    def check_specifically_and_valid(self, national_id: str, ballot_number: str) -> int:
+        """
+        Returns how many ballots with the ballot number were issued to the voter with the national ID
+        """
+
+    @abstractmethod
+    def registory_ballot(self, ballot: Ballot, status: str, national_id: str, voter: Optional[Voter] = None) -> bool:
+        """
+        Records the choice and the redacted comment of a cast ballot
+
+        :param: voter The voter casting the ballot, if the caller already has them, for redacting their names
+        """
+
+    @abstractmethod
+    def invalidate_outstanding_ballots(self, national_id: str, except_ballot: Optional[str] = None) -> int:
+        """
+        Invalidates every unused ballot issued to the voter, apart from the one given
+
+        :returns: The number of ballots invalidated
+        """
+
+    @abstractmethod
+    def update_ballot_status(self, ballot_id: str, status: str) -> bool:
+        """
+        Sets the BallotStatus value of the ballot
+        """
+
+    @abstractmethod
+    def might_have_ballot(self, ballot_number: str) -> bool:
+        """
+        Boolean FALSE means the ballot was never issued; Boolean TRUE means it may have been, and the other methods
+        have to be asked.
+        """
+
+    #
+    # Aggregates
+    #
+
+    @abstractmethod
+    def get_comments(self) -> List[str]:
+        """
+        Returns the comments of every counted ballot
+        """
+
+    @abstractmethod
+    def get_comments_page(self, after: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        """
+        Returns one page of the comments of counted ballots, in the order they were issued
+
+        :param: after The cursor returned with the previous page, or 0 for the first page
+        :param: limit The most comments to return
+        :returns: The comments, and the cursor of the next page, or None if this was the last one
+        """
+
+    @abstractmethod
+    def iter_comments(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """
+        Yields the comments of every counted ballot, holding only one page in memory at a time
+        """
+
+    @abstractmethod
+    def get_winner(self) -> Optional[Candidate]:
+        """
+        Returns the candidate with the most counted ballots, or None if no ballot was counted yet
+        """
+
+    @abstractmethod
+    def fraudulent_voters(self) -> List[str]:
+        """
+        Returns "first last" for every voter who committed fraud
+        """
+
+    @abstractmethod
+    def fraudulent_voters_page(self, after: int = 0,
+                               limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[str], Optional[int]]:
+        """
+        Returns one page of the names of voters who committed fraud, in registration order
+
+        :param: after The cursor returned with the previous page, or 0 for the first page
+        :param: limit The most names to return
+        :returns: The names, and the cursor of the next page, or None if this was the last one
+        """
+
+    @abstractmethod
+    def iter_fraudulent_voters(self, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """
+        Yields the names of every voter who committed fraud, holding only one page in memory at a time
+        """
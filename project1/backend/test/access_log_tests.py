@@ -0,0 +1,81 @@
+from collections import Counter
+
+from backend.main.dataset.access_log import ACCESS_LOG, TRUNCATE, hour_of, parse_log, plan_log_chunks, \
+    redact_client, redact_url
+from backend.main.dataset.deidentification import pseudonym
+
+LOG = (
+    '10.1.2.3 - - [02/Sep/2021:14:38:45 -0400] "GET /patients?email=adam%40example.com&appID=7 HTTP/1.0" 200 10 '
+    '"http://portal/search?q=999-76-6866" "Mozilla/5.0"\n'
+    '10.1.2.4 - alice [02/Sep/2021:15:01:00 -0400] "POST /users/adam@example.com HTTP/1.0" 404 - "-" "curl"\n'
+    'not a request line\n'
+    '2001:db8::1 - - [02/Sep/2021:15:59:59 -0400] "GET /patients HTTP/1.1" 200 20\n'
+)
+
+
+class TestAccessLog:
+    def test_chunks_end_at_line_breaks(self):
+        """
+        Checks that the chunks of a log cover all of it, each ending at a line break
+        """
+        chunks = list(plan_log_chunks(ACCESS_LOG, 64 * 1024))
+        with open(ACCESS_LOG, "rb") as log:
+            data = log.read()
+        assert chunks[0][1] == 0 and chunks[-1][2] == len(data)
+        assert all(end == next_start for (_, _, end), (_, next_start, _) in zip(chunks, chunks[1:]))
+        assert all(data[end - 1:end] == b"\n" for _, _, end in chunks)
+
+    def test_redact_url(self):
+        """
+        Checks that PII is redacted from paths, and from query parameters by their names and values
+        """
+        found = Counter()
+        assert redact_url("/patients?email=adam%40example.com&appID=7", found) == \
+            "/patients?email=%5BREDACTED%5D&appID=7"
+        assert redact_url("/search?q=999-76-6866", found) == "/search?q=%5BREDACTED+SSN%5D"
+        assert redact_url("/users/adam@example.com/profile", found) == "/users/%5BREDACTED%20EMAIL%5D/profile"
+        assert redact_url("/apps/cart.jsp?appID=1612", found) == "/apps/cart.jsp?appID=1612"
+        assert found == {"query_parameter": 1, "ssn": 1, "email": 1}
+
+    def test_redact_client(self):
+        """
+        Checks that client IPs are pseudonymized, or truncated to their network
+        """
+        assert redact_client("96.172.175.66") == pseudonym("96.172.175.66")
+        assert redact_client("96.172.175.66", TRUNCATE) == "96.172.175.0"
+        assert redact_client("2001:db8:1:2::1", TRUNCATE) == "2001:db8:1::"
+        assert hour_of("02/Sep/2021:14:38:45 -0400") == "2021-09-02T14-0400"
+
+    def test_web_portal_log(self):
+        """
+        Checks the aggregates of the web portal's log, and that parsing it in parallel chunks counts the same
+        """
+        report = parse_log(workers=1, top_paths=None)
+        assert report["lines"] == report["requests"] == 10000
+        assert sum(report["by_status"].values()) == sum(report["by_path"].values()) == 10000
+        assert sum(report["by_hour"].values()) == sum(report["by_method"].values()) == 10000
+
+        chunked = parse_log(workers=2, chunk_bytes=64 * 1024, top_paths=None)
+        for key in ("requests", "bytes_sent", "by_path", "by_status", "by_method", "by_hour"):
+            assert chunked[key] == report[key]
+
+    def test_redacted_log(self, tmp_path):
+        """
+        Checks that the redacted copy of a log keeps its requests and loses its IPs, users and PII
+        """
+        source = tmp_path / "access.log"
+        source.write_text(LOG)
+        redacted_path = str(tmp_path / "redacted.log")
+        report = parse_log(str(source), workers=1, redacted_path=redacted_path, ip_redaction=TRUNCATE)
+        assert (report["lines"], report["requests"], report["malformed"]) == (4, 3, 1)
+        assert report["by_path"] == {"/patients": 2, "/users/%5BREDACTED%20EMAIL%5D": 1}
+        assert report["by_hour"] == {"2021-09-02T14-0400": 1, "2021-09-02T15-0400": 2}
+        assert report["redactions"] == {"email": 1, "query_parameter": 1, "ssn": 1}
+
+        with open(redacted_path) as redacted:
+            lines = redacted.read().splitlines()
+        assert lines[0] == '10.1.2.0 - - [02/Sep/2021:14:38:45 -0400] "GET /patients?email=%5BREDACTED%5D&appID=7 ' \
+                           'HTTP/1.0" 200 10 "http://portal/search?q=%5BREDACTED+SSN%5D" "Mozilla/5.0"'
+        assert lines[1].startswith('10.1.2.0 - {0} ['.format(pseudonym("alice")))
+        assert lines[2].startswith("2001:db8:: - - [")
+        assert len(lines) == 3
@@ -0,0 +1,114 @@
+import time
+from base64 import b64decode, b64encode
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import BALLOT_NUMBER_KEY, ballot_number_key, generate_ballot_number
+from backend.main.objects.ballot_number_pool import BALLOT_NUMBER_POOL_ISSUED, BallotNumberPool
+from backend.main.objects.voter import Voter
+from backend.main.store.data_registry import VotingStore
+
+
+def _open(ballot_number: str, key: bytes) -> str:
+    """
+    Decrypts a ballot number with the AES-SIV of the crypto library, which also checks its tag
+    """
+    nonce, tag, ciphertext = (b64decode(part) for part in ballot_number.split("-"))
+    return AES.new(key, AES.MODE_SIV, nonce=nonce).decrypt_and_verify(ciphertext, tag).decode("utf-8")
+
+
+def _wait_for(condition, seconds: float = 10.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestBallotNumberPool:
+    def test_pooled_nonces_are_encoded_ahead(self):
+        """
+        Checks that every pooled nonce is kept with its base64 encoding, which is the first part of its ballot number
+        """
+        pool = BallotNumberPool(low_watermark=0, high_watermark=10)
+        pool.refill()
+        nonce, encoded_nonce = pool._pooled_key.entries[0]
+        assert len(nonce) == 16 and encoded_nonce == b64encode(nonce).decode("utf-8")
+        assert pool.ballot_number("123456789").split("-")[0] == encoded_nonce
+
+    def test_ballot_numbers_keep_their_format(self):
+        """
+        Checks that pooled ballot numbers look like and open like the ones of generate_ballot_number, whether the
+        pool had a nonce ready or not
+        """
+        pool = BallotNumberPool(low_watermark=0, high_watermark=10)
+        cold = pool.ballot_number("123-45-6789")
+        pool.refill()
+        warm = pool.ballot_number("123 45 6789")
+        generated = generate_ballot_number("123456789")
+        for ballot_number in (cold, warm):
+            assert [len(part) for part in ballot_number.split("-")] == [len(part) for part in generated.split("-")]
+            assert _open(ballot_number, ballot_number_key()) == "123456789"
+        assert cold != warm
+        assert pool.stats()["misses"] >= 1 and pool.stats()["hits"] >= 1
+
+    def test_nonces_are_never_reused(self):
+        """
+        Checks that every ballot number gets its own nonce, across refills
+        """
+        pool = BallotNumberPool(low_watermark=5, high_watermark=20)
+        pool.refill()
+        nonces = [pool.ballot_number("123456789").split("-")[0] for _ in range(200)]
+        assert len(set(nonces)) == len(nonces)
+
+    def test_pool_is_refilled_in_the_background(self):
+        """
+        Checks that the pool is refilled up to its high watermark once it drops to its low watermark
+        """
+        pool = BallotNumberPool(low_watermark=10, high_watermark=50)
+        assert pool.refill() == 50 and len(pool) == 50
+        for _ in range(39):
+            pool.ballot_number("123456789")
+        assert pool.stats()["refills"] == 1
+
+        pool.ballot_number("123456789")
+        _wait_for(lambda: pool.stats()["refills"] == 2 and len(pool) == 50)
+        assert pool.stats()["hits"] == 40
+
+    def test_pool_starts_over_when_the_key_changes(self, monkeypatch):
+        """
+        Checks that nonces pooled under a key are thrown away once the key is rotated, or the process forked
+        """
+        pool = BallotNumberPool(low_watermark=0, high_watermark=10)
+        pool.refill()
+        new_key = get_random_bytes(32)
+        monkeypatch.setenv(BALLOT_NUMBER_KEY, b64encode(new_key).decode("utf-8"))
+        assert _open(pool.ballot_number("123456789"), new_key) == "123456789"
+        assert pool.stats()["discarded"] == 10
+
+        pool.refill()
+        monkeypatch.setattr(pool, "_pid", -1)
+        pool.ballot_number("123456789")
+        assert pool.stats()["discarded"] == 20
+
+    def test_issue_ballot_uses_the_pool(self):
+        """
+        Checks that issued ballots are counted as issued from the pool, and open to the voter's national ID
+        """
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        voter = Voter("Adam", "Smith", "111-11-1111")
+        assert registry.register_voter(voter)
+        metrics.REGISTRY.reset()
+        metrics.enable()
+        try:
+            ballot_number = balloting.issue_ballot(voter.national_id)
+            rendered = metrics.render()
+        finally:
+            metrics.disable()
+        assert _open(ballot_number, ballot_number_key()) == "111111111"
+        assert BALLOT_NUMBER_POOL_ISSUED in rendered
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 import backend.main.api.balloting as balloting
@@ -5,6 +7,7 @@ import backend.main.api.registry as registry
 from backend.main.objects.ballot import Ballot
 from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
 from backend.main.store.data_registry import VotingStore
+from backend.test.conftest import sqlite_only
 
 all_voters = [
     Voter("Adam", "Smith", "111111111"),
@@ -254,6 +257,47 @@ class TestBalloting:
         # The ballot cannot be invalidated after being cast - it should still be counted
         assert len(balloting.get_all_ballot_comments()) == 1
 
+    def test_invalidate_outstanding_ballots(self):
+        """
+        Ensures that all of a voter's unused ballots but the replacement are invalidated, and no one else's
+        """
+        voter, other_voter = all_voters[0:2]
+        ballot_numbers = [balloting.issue_ballot(voter.national_id) for _ in range(4)]
+        other_ballot_number = balloting.issue_ballot(other_voter.national_id)
+        candidate_id = registry.get_all_candidates()[0].candidate_id
+
+        assert balloting.invalidate_outstanding_ballots("111-11-1111", except_ballot=ballot_numbers[3]) == 3
+        assert balloting.invalidate_outstanding_ballots(voter.national_id, except_ballot=ballot_numbers[3]) == 0
+        assert balloting.invalidate_outstanding_ballots("999999999") == 0
+
+        for ballot_number in ballot_numbers[:3]:
+            assert balloting.count_ballot(Ballot(ballot_number, candidate_id, ""), voter.national_id) == \
+                BallotStatus.INVALID_BALLOT
+        assert balloting.count_ballot(Ballot(ballot_numbers[3], candidate_id, ""), voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(Ballot(other_ballot_number, candidate_id, ""), other_voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+        # Cast ballots are never invalidated
+        assert balloting.invalidate_outstanding_ballots(voter.national_id) == 0
+        assert balloting.compute_election_winner().candidate_id == candidate_id
+
+    @sqlite_only
+    def test_outstanding_ballots_are_found_by_index(self):
+        """
+        Ensures that ballots are found through the owner key index, which doesn't hold national IDs
+        """
+        voter = all_voters[0]
+        balloting.issue_ballot(voter.national_id)
+        connection = VotingStore.get_instance().connection
+
+        owner_keys = [row[0] for row in connection.execute("SELECT owner_key FROM ballot")]
+        assert len(owner_keys) == 1 and voter.national_id not in owner_keys[0]
+        plan = " ".join(str(row) for row in connection.execute(
+            "EXPLAIN QUERY PLAN UPDATE ballot SET status=? WHERE owner_key=? AND status=? AND ballot_id IS NOT ?",
+            ("", "", "", "")))
+        assert "ballot_owner_key" in plan
+
     def test_count_ballot_mismatch(self):
         """
         If the wrong voter issues a ballot, the count_ballot endpoint should say so. The ballot should still remain
@@ -342,3 +386,88 @@ class TestBalloting:
                 voter.first_name, voter.last_name)
 
         yield
+
+
+class TestAggregatePages:
+    def _load(self, count: int):
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        store.add_voters((str(100000000 + index), "First" + str(index), "Last" + str(index),
+                          str(VoterStatus.FRAUD_COMMITTED.value if index % 3 == 0 else VoterStatus.BALLOT_COUNTED.value))
+                         for index in range(count))
+        store.add_ballots(("ballot" + str(index),
+                           str(BallotStatus.BALLOT_COUNTED.value if index % 2 == 0 else BallotStatus.INVALID_BALLOT.value),
+                           "1", "comment " + str(index), str(100000000 + index))
+                          for index in range(count))
+
+    def test_comment_pages(self):
+        """
+        Ensures that paging through the comments returns each of them once, and the same ones as the full list
+        """
+        self._load(25)
+        comments, after = [], 0
+        while after is not None:
+            page, after = balloting.get_ballot_comments_page(after, 4)
+            assert len(page) <= 4
+            comments.extend(page)
+
+        assert comments == balloting.get_all_ballot_comments()
+        assert comments == ["comment " + str(index) for index in range(0, 25, 2)]
+        assert list(balloting.iter_ballot_comments(page_size=3)) == comments
+
+    def test_fraudulent_voter_pages(self):
+        """
+        Ensures that paging through the fraudulent voters returns each of them once, with their names decrypted
+        """
+        self._load(20)
+        names, after = [], 0
+        while after is not None:
+            page, after = balloting.get_fraudulent_voters_page(after, 3)
+            names.extend(page)
+
+        assert names == balloting.get_all_fraudulent_voters()
+        assert names == ["First{0} Last{0}".format(index) for index in range(0, 20, 3)]
+        assert list(balloting.iter_fraudulent_voters(page_size=2)) == names
+
+    def test_empty_pages_are_refused(self):
+        """
+        Ensures that asking for pages of no rows is refused rather than failing on the cursor of the next page
+        """
+        self._load(5)
+        for page_size in (0, -1):
+            with pytest.raises(ValueError):
+                balloting.get_ballot_comments_page(0, page_size)
+            with pytest.raises(ValueError):
+                balloting.get_fraudulent_voters_page(0, page_size)
+            with pytest.raises(ValueError):
+                list(balloting.iter_ballot_comments(page_size))
+            with pytest.raises(ValueError):
+                list(balloting.iter_fraudulent_voters(page_size))
+
+    def test_fraud_flags_keep_registration_order(self):
+        """
+        Ensures that voters flagged and cleared out of order still page out in registration order
+        """
+        self._load(20)
+        store = VotingStore.get_instance()
+        store.update_vote_status("100000004", str(VoterStatus.FRAUD_COMMITTED.value))
+        store.update_vote_status("100000004", str(VoterStatus.FRAUD_COMMITTED.value))
+        store.update_vote_status("100000003", str(VoterStatus.BALLOT_COUNTED.value))
+        store.update_vote_status("100000001", str(VoterStatus.FRAUD_COMMITTED.value))
+
+        expected = ["First{0} Last{0}".format(index) for index in (0, 1, 4, 6, 9, 12, 15, 18)]
+        assert balloting.get_all_fraudulent_voters() == expected
+        assert list(balloting.iter_fraudulent_voters(page_size=3)) == expected
+
+    def test_streaming_endpoint(self):
+        """
+        Ensures that the comments endpoint streams every comment as a line of json
+        """
+        from backend.main.api.backend_rest_api import app
+        self._load(10)
+
+        response = app.test_client().get("/api/ballot_comments")
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == \
+            ["comment " + str(index) for index in range(0, 10, 2)]
@@ -0,0 +1,46 @@
+from backend.benchmark.benchmarks import BENCHMARKS, compare, compare_backends, measure_voter_memory, run_benchmarks
+from backend.main.store.storage import STORAGE_BACKENDS
+
+
+class TestBenchmarks:
+    def test_all_benchmarks_run(self):
+        """
+        Runs every benchmark on a tiny registry, so that the suite doesn't silently rot between releases
+        """
+        results = run_benchmarks(list(BENCHMARKS), [50], 3)
+        assert {result["name"] for result in results["results"]} == set(BENCHMARKS)
+        for result in results["results"]:
+            assert result["iterations"] > 0
+            assert result["min_s"] <= result["median_s"] <= result["max_s"]
+
+    def test_compare_flags_regressions(self):
+        """
+        Checks that only benchmarks slower than the threshold are reported
+        """
+        baseline = {"commit": "abc", "results": [{"name": "a", "size": 1, "median_s": 1.0},
+                                                 {"name": "b", "size": 1, "median_s": 1.0}]}
+        current = {"commit": "def", "results": [{"name": "a", "size": 1, "median_s": 1.1},
+                                                {"name": "b", "size": 1, "median_s": 2.0},
+                                                {"name": "c", "size": 1, "median_s": 5.0}]}
+        regressions = compare(baseline, current, threshold=1.2)
+        assert len(regressions) == 1
+        assert regressions[0].startswith("b ")
+
+    def test_compare_backends(self):
+        """
+        Runs the store benchmarks on every backend, and checks that each run really used its backend
+        """
+        runs = compare_backends(["count_ballot", "compute_election_winner"], [50], 3)
+        assert set(runs) == set(STORAGE_BACKENDS)
+        for backend, run in runs.items():
+            assert run["backend"] == backend
+            assert len(run["results"]) == 2
+
+    def test_slots_save_memory(self):
+        """
+        Checks that __slots__ voters and row tuples take less memory than dict-backed objects
+        """
+        result = measure_voter_memory(20_000)
+        sizes = result["bytes_per_record"]
+        assert sizes["slots object"] < sizes["dict object"]
+        assert sizes["row tuple"] < sizes["dict object"]
@@ -0,0 +1,91 @@
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
+from backend.main.store.bloom_filter import BloomFilter, MIN_CAPACITY
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.election_generator import ElectionConfig, generate_election, load_election
+from backend.test.conftest import sqlite_only
+
+
+class TestBloomFilter:
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        """
+        Checks that every added value is found, and that unseen values are rarely reported as present
+        """
+        bloom_filter = BloomFilter("test", 10000, false_positive_rate=0.01)
+        for index in range(10000):
+            bloom_filter.add("seen-{0}".format(index))
+
+        assert all(bloom_filter.might_contain("seen-{0}".format(index)) for index in range(10000))
+        false_positives = sum(bloom_filter.might_contain("unseen-{0}".format(index)) for index in range(10000))
+        assert false_positives < 300
+        assert bloom_filter.false_positive_rate() == pytest.approx(0.01, rel=0.2)
+
+    @sqlite_only
+    def test_unknown_voters_and_ballots_are_rejected(self):
+        """
+        Checks that never registered voters and never issued ballots get the documented answers
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+
+        metrics.enable()
+        try:
+            assert balloting.issue_ballot("999999999") is None
+            assert registry.get_voter_status("999-99-9999") == VoterStatus.NOT_REGISTERED
+            assert balloting.count_ballot(Ballot(ballot_number, "1", ""), "999999999") == \
+                BallotStatus.VOTER_NOT_REGISTERED
+            assert balloting.count_ballot(Ballot("not a ballot", "1", ""), voter.national_id) == \
+                BallotStatus.INVALID_BALLOT
+            assert balloting.invalidate_ballot("not a ballot") is False
+
+            rendered = metrics.render()
+            assert 'voting_bloom_filter_rejections_total{filter="voters"} 3' in rendered
+            assert 'voting_bloom_filter_rejections_total{filter="ballots"} 2' in rendered
+            assert 'operation="get_vote"' not in rendered
+            assert 'operation="get_ballot"' not in rendered
+        finally:
+            metrics.disable()
+            metrics.REGISTRY.reset()
+
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+    @sqlite_only
+    def test_filters_grow_with_the_registry(self):
+        """
+        Checks that bulk loads past the initial capacity keep every voter findable
+        """
+        config = ElectionConfig(voter_count=3 * MIN_CAPACITY, seed=9)
+        load_election(config, VotingStore.get_instance(), chunk_size=500)
+
+        store = VotingStore.get_instance()
+        assert store.voter_filter.capacity >= config.voter_count
+        for (national_id, _, _, status), _ in generate_election(config):
+            assert store.might_have_voter(national_id)
+            assert registry.get_voter_status(national_id) == VoterStatus(status)
+
+    @sqlite_only
+    def test_filters_follow_restore(self, tmp_path):
+        """
+        Checks that restoring a snapshot brings the voters in the snapshot into the filters
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        path = str(tmp_path / "snapshot.db")
+        VotingStore.get_instance().snapshot(path)
+
+        VotingStore.refresh_instance()
+        assert not VotingStore.get_instance().might_have_voter(voter.national_id)
+        VotingStore.get_instance().restore(path)
+        assert VotingStore.get_instance().might_have_voter(voter.national_id)
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
+
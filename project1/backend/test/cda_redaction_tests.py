@@ -0,0 +1,80 @@
+import glob
+import os
+import xml.etree.ElementTree as ET
+
+from backend.main.dataset.cda_redaction import CDA_NAMESPACE, redact_document, redact_documents, redacted_name
+from backend.main.dataset.deidentification import pseudonym
+from backend.main.dataset.tables import DATA_REQUEST_DIR
+
+DOCUMENTS = sorted(glob.glob(os.path.join(DATA_REQUEST_DIR, "*.xml")))
+
+SMALL_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns:sdtc="urn:hl7-org:sdtc">
+  <!-- Patient: Adam123 Smith456 -->
+  <title>Record of Adam123 Smith456 &amp; family</title>
+  <patientRole>
+    <id extension="1d604da9-9a81-4ba9-80c2-de3375d59b40" root="2.16"/>
+    <telecom use="HP" value="tel:555-123-4567"/>
+    <addr><streetAddressLine>12 Main Street</streetAddressLine><postalCode>02108</postalCode></addr>
+    <patient><name><given>Adam123</given> <family>Smith456</family></name><birthTime value="19880601115509"/></patient>
+  </patientRole>
+  <text>Call <b>555-123-4567</b> or mail adam@example.com<br/>later</text>
+  <sdtc:raceCode code="2106-3"/>
+</ClinicalDocument>
+"""
+
+
+def _tags(path):
+    return [element.tag for element in ET.parse(path).iter()]
+
+
+class TestCdaRedaction:
+    def test_small_document(self, tmp_path):
+        """
+        Checks every rule on a small document, and that the text around child elements stays where it was
+        """
+        source = tmp_path / "Adam123_Smith456_1d604da9-9a81-4ba9-80c2-de3375d59b40.xml"
+        source.write_text(SMALL_DOCUMENT)
+        out_path = str(tmp_path / redacted_name(str(source)))
+        report = redact_document(str(source), out_path)
+        assert os.path.basename(out_path) == pseudonym("1d604da9-9a81-4ba9-80c2-de3375d59b40") + ".xml"
+        assert report["redactions"] == {"address": 1, "birth_time": 1, "email": 1, "id": 1, "name": 6, "phone": 1,
+                                        "telecom": 1, "zip": 1}
+
+        with open(out_path) as out:
+            redacted = out.read()
+        for value in ("Adam123", "Smith456", "1d604da9", "555-123", "Main Street", "02108", "19880601"):
+            assert value not in redacted
+        assert "<!-- Patient: [REDACTED NAME] [REDACTED NAME] -->" in redacted
+        assert "<title>Record of [REDACTED NAME] [REDACTED NAME] &amp; family</title>" in redacted
+        assert "<text>Call <b>[REDACTED PHONE]</b> or mail [REDACTED EMAIL]<br/>later</text>" in redacted
+        assert "<given>[REDACTED NAME]</given> <family>[REDACTED NAME]</family>" in redacted
+        assert '<birthTime value="1988"/>' in redacted
+        assert "<postalCode>021</postalCode>" in redacted
+        assert '<sdtc:raceCode code="2106-3"/>' in redacted
+        assert _tags(out_path) == _tags(str(source))
+
+    def test_data_request_output(self, tmp_path):
+        """
+        Checks that the documents of the dataset keep their structure, and lose their patients' names and ids
+        """
+        report = redact_documents(DOCUMENTS, str(tmp_path), workers=2)
+        assert len(report["documents"]) == len(DOCUMENTS)
+        assert report["redactions"]["name"] >= 4 * len(DOCUMENTS)
+        for path in DOCUMENTS:
+            given, family, patient = os.path.splitext(os.path.basename(path))[0].split("_")
+            out_path = report["documents"][redacted_name(path)]["path"]
+            with open(out_path) as out:
+                redacted = out.read()
+            assert given not in redacted and family not in redacted and patient not in redacted
+            assert _tags(out_path) == _tags(path)
+            assert _tags(out_path)[0] == "{{{0}}}ClinicalDocument".format(CDA_NAMESPACE)
+
+    def test_inspection_matches_redaction(self, tmp_path):
+        """
+        Checks that only inspecting the documents finds what redacting them does
+        """
+        inspected = redact_documents(DOCUMENTS[:2], workers=1)
+        redacted = redact_documents(DOCUMENTS[:2], str(tmp_path), workers=1)
+        assert inspected["redactions"] == redacted["redactions"]
+        assert all(report["path"] is None for report in inspected["documents"].values())
@@ -0,0 +1,80 @@
+import os
+
+from backend.main.dataset.column_classifier import ClassificationCache, ColumnClass, classify_and_scan, \
+    classify_column
+from backend.main.dataset.tables import PATIENT_RECORDS_DIR
+
+PATIENTS_CSV = os.path.join(PATIENT_RECORDS_DIR, "patients.csv")
+
+
+def _classes(report, table):
+    return {column["column"]: column["class"] for column in report["tables"][table]["columns"]}
+
+
+class TestColumnClassifier:
+    def test_classify_column(self):
+        """
+        Checks the class and confidence of columns that are clearly PII, clearly clean, and in between
+        """
+        ssns = classify_column("TAXPAYER", ["999-76-{0:04d}".format(index) for index in range(100)])
+        assert ssns["class"] == ColumnClass.DEFINITELY_PII.value and ssns["confidence"] == 1.0
+        assert ssns["kinds"] == {"ssn": 1.0}
+
+        costs = classify_column("COST", ["{0}.16".format(index) for index in range(100)])
+        assert costs["class"] == ColumnClass.CLEAN.value and costs["confidence"] == 0.97
+
+        notes = classify_column("NOTE", ["ok"] * 90 + ["mail me at adam@example.com"] * 10)
+        assert notes["class"] == ColumnClass.MAYBE_PII.value and notes["kinds"] == {"email": 0.1}
+
+        # Only the card numbers with a valid check digit count
+        cards = classify_column("PAYMENT", ["4111-1111-1111-1111", "4111 1111 1111 1112"] * 50)
+        assert cards["class"] == ColumnClass.MAYBE_PII.value and cards["kinds"] == {"payment_card": 0.5}
+
+        assert classify_column("COST", ["1.5"] * 10)["class"] == ColumnClass.MAYBE_PII.value
+        assert classify_column("SSN", [])["class"] == ColumnClass.DEFINITELY_PII.value
+
+    def test_patients_table(self):
+        """
+        Checks that the identifying columns of the patient table are PII and its measurements are clean
+        """
+        classes = _classes(classify_and_scan([PATIENTS_CSV], workers=1), "patients")
+        for column in ("SSN", "DRIVERS", "PASSPORT", "FIRST", "LAST", "ADDRESS"):
+            assert classes[column] == ColumnClass.DEFINITELY_PII.value
+        for column in ("LAT", "LON", "HEALTHCARE_EXPENSES", "HEALTHCARE_COVERAGE", "GENDER"):
+            assert classes[column] == ColumnClass.CLEAN.value
+
+    def test_only_maybe_columns_are_scanned(self, tmp_path):
+        """
+        Checks that only the maybe columns are scanned, and that the ones with no PII in them turn out clean
+        """
+        path = tmp_path / "visits.csv"
+        rows = ["{0},{1}.5,{2}".format(index, index, "call 555-123-4567" if index % 10 == 0 else "fine")
+                for index in range(200)]
+        path.write_text("\n".join(["Id,COST,NOTE"] + rows) + "\n")
+        path = str(path)
+
+        table = classify_and_scan([path], workers=1)["tables"]["visits"]
+        columns = {column["column"]: column for column in table["columns"]}
+        assert "findings" not in columns["Id"] and "findings" not in columns["COST"]
+        assert columns["NOTE"]["class"] == ColumnClass.MAYBE_PII.value
+        assert columns["NOTE"]["findings"]["phone"]["count"] == 20
+
+        path_without_pii = tmp_path / "quiet.csv"
+        path_without_pii.write_text("Id,NOTE\n" + "\n".join("{0},fine".format(index) for index in range(10)) + "\n")
+        columns = classify_and_scan([str(path_without_pii)], workers=1)["tables"]["quiet"]["columns"]
+        assert columns[1]["findings"] == {} and columns[1]["class"] == ColumnClass.CLEAN.value
+
+    def test_classes_are_cached_by_schema(self, tmp_path):
+        """
+        Checks that a table with a layout classified before, in this run or an earlier one, isn't sampled again
+        """
+        cache_path = str(tmp_path / "classes.json")
+        first = classify_and_scan([PATIENTS_CSV], ClassificationCache(cache_path), workers=1)
+        assert not first["tables"]["patients"]["cached"]
+
+        new_export = tmp_path / "patients-2.csv"
+        with open(PATIENTS_CSV, "rb") as patients:
+            new_export.write_bytes(patients.readline())
+        second = classify_and_scan([str(new_export)], ClassificationCache(cache_path), workers=1)
+        assert second["tables"]["patients-2"]["cached"]
+        assert _classes(second, "patients-2") == _classes(first, "patients")
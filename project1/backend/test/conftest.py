@@ -0,0 +1,58 @@
+import pytest
+
+import backend.main.api.registry as registry
+from backend.main.objects.voter import Voter
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.storage import SQLITE_BACKEND, configured_backend
+
+POPULATED_CANDIDATE_NAMES = ["Kathryn Collins", "Aditya Guha", "Rina Harvey"]
+POPULATED_VOTER_COUNT = 1000
+
+# Marks tests of the sqlite backend itself (its tables, filters and snapshots), which other backends don't have
+sqlite_only = pytest.mark.skipif(configured_backend() != SQLITE_BACKEND, reason="tests the sqlite backend itself")
+
+
+@pytest.fixture(autouse=True)
+def aggregates_see_every_change():
+    """
+    Tests read back what they just wrote, so aggregates aren't allowed to lag the writes unless a test says otherwise
+    """
+    staleness = VotingStore.aggregate_max_staleness
+    VotingStore.aggregate_max_staleness = 0.0
+    yield
+    VotingStore.aggregate_max_staleness = staleness
+
+
+def populated_voter(index: int) -> Voter:
+    """
+    The voter registered at the given position of the populated store
+    """
+    return Voter("Voter", "Number{0}".format(index), "{0:09d}".format(index))
+
+
+@pytest.fixture(scope="session")
+def populated_store_snapshot(tmp_path_factory) -> str:
+    """
+    Registers the candidates and voters through the regular APIs once per test session, and snapshots the result to
+    disk so that tests can clone it instead of re-registering everyone.
+    """
+    VotingStore.refresh_instance()
+    for candidate_name in POPULATED_CANDIDATE_NAMES:
+        registry.register_candidate(candidate_name)
+    for index in range(POPULATED_VOTER_COUNT):
+        registry.register_voter(populated_voter(index))
+
+    path = str(tmp_path_factory.mktemp("voting_store") / "populated.db")
+    VotingStore.get_instance().snapshot(path)
+    return path
+
+
+@pytest.fixture
+def populated_store(populated_store_snapshot) -> VotingStore:
+    """
+    A fresh store holding a copy of the populated snapshot. Changes made by a test are not seen by the next one.
+    """
+    VotingStore.refresh_instance()
+    store = VotingStore.get_instance()
+    store.restore(populated_store_snapshot)
+    return store
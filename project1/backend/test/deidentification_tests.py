@@ -0,0 +1,104 @@
+import csv
+import os
+
+from Crypto.Random import get_random_bytes
+
+from backend.main.dataset.deidentification import DROP, REDACT, deidentify_tables, generalize_year, \
+    generalize_zip, pseudonym, pseudonym_key, set_pseudonym_key
+from backend.main.dataset.tables import PATIENT_RECORDS_DIR
+
+PATIENTS_CSV = os.path.join(PATIENT_RECORDS_DIR, "patients.csv")
+CONDITIONS_CSV = os.path.join(PATIENT_RECORDS_DIR, "conditions.csv")
+
+
+def _read(path):
+    with open(path, newline="") as table:
+        return list(csv.DictReader(table))
+
+
+class TestTransforms:
+    def test_generalizations(self):
+        """
+        Checks that dates become years and ZIP codes their 3 digit area, with sparse areas merged into 000
+        """
+        assert generalize_year("1989-05-25") == "1989"
+        assert generalize_year("2001-07-04T08:42:44Z") == "2001"
+        assert generalize_year("10/25/82") == "82"
+        assert generalize_year("") == ""
+        assert generalize_zip("01013") == "010"
+        assert generalize_zip("03601") == "000"
+        assert generalize_zip("") == ""
+
+    def test_pseudonyms_are_consistent(self):
+        """
+        Checks that a value always gets the same pseudonym, which doesn't give the value away
+        """
+        patient = "1d604da9-9a81-4ba9-80c2-de3375d59b40"
+        assert pseudonym(patient) == pseudonym(patient.upper()) != patient
+        assert pseudonym(patient) != pseudonym("034e9e3b-2def-4559-bb2a-7850888ae060")
+        assert len(pseudonym(patient)) == len(patient)
+
+    def test_pseudonyms_follow_the_key(self):
+        """
+        Checks that setting the key changes the pseudonyms, even of values pseudonymized under the previous key
+        """
+        patient = "1d604da9-9a81-4ba9-80c2-de3375d59b40"
+        key = pseudonym_key()
+        before = pseudonym(patient)
+
+        set_pseudonym_key(get_random_bytes(32))
+        assert pseudonym(patient) != before
+        set_pseudonym_key(key)
+        assert pseudonym(patient) == before
+
+
+class TestDeidentification:
+    def test_tables_are_deidentified(self, tmp_path):
+        """
+        Checks that identifying columns are dropped, and that patients can still be joined across tables
+        """
+        manifest = deidentify_tables([PATIENTS_CSV, CONDITIONS_CSV], str(tmp_path), workers=1)
+        patients = _read(manifest["tables"]["patients"]["path"])
+        conditions = _read(manifest["tables"]["conditions"]["path"])
+        assert len(patients) == manifest["tables"]["patients"]["records"] == 1171
+        assert len(conditions) == manifest["tables"]["conditions"]["records"]
+
+        for column in ("SSN", "DRIVERS", "PASSPORT", "FIRST", "LAST", "ADDRESS", "LAT", "LON"):
+            assert column not in patients[0]
+        assert "FIRST NAME" not in conditions[0]
+        assert all(len(patient["BIRTHDATE"]) == 4 and len(patient["ZIP"]) in (0, 3) for patient in patients)
+
+        with open(PATIENTS_CSV, newline="", encoding="utf-8-sig") as source:
+            source_ids = {patient["Id"] for patient in csv.DictReader(source)}
+        pseudonyms = {patient["Id"] for patient in patients}
+        assert not pseudonyms & source_ids
+        assert {condition["PATIENT"] for condition in conditions} <= pseudonyms
+
+    def test_parallel_run_matches_serial_run(self, tmp_path):
+        """
+        Checks that de-identifying in small chunks on a pool writes exactly what one serial pass writes
+        """
+        serial = deidentify_tables([PATIENTS_CSV], str(tmp_path / "serial"), workers=1)
+        parallel = deidentify_tables([PATIENTS_CSV], str(tmp_path / "parallel"), workers=2, chunk_bytes=16 * 1024)
+        with open(serial["tables"]["patients"]["path"]) as serial_file, \
+                open(parallel["tables"]["patients"]["path"]) as parallel_file:
+            assert serial_file.read() == parallel_file.read()
+
+    def test_unruled_pii_columns_are_dropped(self, tmp_path):
+        """
+        Checks that a column with no rule is dropped if it is PII, redacted and listed for review if it may be, and
+        that free text is redacted
+        """
+        source = tmp_path / "source" / "contacts.csv"
+        source.parent.mkdir()
+        rows = ["{0},adam{0}@example.com,call 555-123-{0:04d} today,{1}".format(
+                    index, "or 555-987-{0:04d}".format(index) if index % 5 == 0 else "no answer") for index in range(100)]
+        source.write_text("\n".join(["Id,CONTACT,NOTE,MEMO"] + rows) + "\n")
+
+        manifest = deidentify_tables([str(source)], str(tmp_path / "out"), rules={"NOTE": REDACT}, workers=1)
+        assert manifest["tables"]["contacts"]["columns"] == {"Id": "keep", "CONTACT": DROP, "NOTE": REDACT,
+                                                             "MEMO": REDACT}
+        assert manifest["tables"]["contacts"]["review"] == ["MEMO"]
+        contacts = _read(manifest["tables"]["contacts"]["path"])
+        assert contacts[7] == {"Id": "7", "NOTE": "call [REDACTED PHONE] today", "MEMO": "no answer"}
+        assert contacts[10]["MEMO"] == "or [REDACTED PHONE]"
@@ -0,0 +1,117 @@
+from backend.main.detection.duplicate_registrations import find_duplicate_registrations, id_distance, jaro_winkler, \
+    soundex
+from backend.main.objects.voter import decrypt_names
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.election_generator import ElectionConfig, generate_election
+from backend.test.conftest import POPULATED_VOTER_COUNT, populated_voter
+
+VOTER_COUNT = 2000
+
+
+def _load_voters(extra_rows):
+    """
+    Registers the voters of a synthetic election, then the extra (national_id, first_name, last_name) rows
+    """
+    VotingStore.refresh_instance()
+    store = VotingStore.get_instance()
+    store.add_voters(voter_row for voter_row, _ in generate_election(ElectionConfig(voter_count=VOTER_COUNT, seed=5)))
+    store.add_voters((national_id, first_name, last_name, "1") for national_id, first_name, last_name in extra_rows)
+    return store
+
+
+class TestSimilarity:
+    def test_soundex(self):
+        """
+        Checks soundex codes against the ones of the original rules
+        """
+        assert soundex("Robert") == soundex("Rupert") == "R163"
+        assert soundex("Ashcraft") == "A261"
+        assert soundex("Tymczak") == "T522"
+        assert soundex("Pfister") == "P236"
+        assert soundex("Lee") == "L000"
+        assert soundex("Ó'Brien") == soundex("OBrien") == "O165"
+
+    def test_jaro_winkler(self):
+        """
+        Checks Jaro-Winkler similarities against the published examples
+        """
+        assert round(jaro_winkler("martha", "marhta"), 4) == 0.9611
+        assert round(jaro_winkler("dwayne", "duane"), 4) == 0.84
+        assert round(jaro_winkler("dixon", "dicksonx"), 4) == 0.8133
+        assert jaro_winkler("adam", "adam") == 1.0 and jaro_winkler("adam", "") == 0.0
+
+    def test_id_distance(self):
+        """
+        Checks that a mistyped, swapped, missing or extra digit is one edit, and that distances stop at the bound
+        """
+        assert id_distance("123456789", "123456789") == 0
+        assert id_distance("123456789", "123456780") == 1
+        assert id_distance("123456789", "124356789") == 1
+        assert id_distance("123456789", "12345678") == 1
+        assert id_distance("123456789", "1234567890") == 1
+        assert id_distance("123456789", "987654321") == 3
+        assert id_distance("123456789", "987654321", bound=9) == 8
+
+
+class TestDuplicateRegistrations:
+    def test_voter_rows(self):
+        """
+        Checks that every voter is streamed across pages, with the names in plaintext unless asked otherwise
+        """
+        store = _load_voters([])
+        voters = [voter_row[:3] for voter_row, _ in generate_election(ElectionConfig(voter_count=VOTER_COUNT, seed=5))]
+        assert list(store.iter_voter_rows(page_size=300)) == voters
+
+        rows = list(store.iter_voter_rows(page_size=300, decrypt=False))
+        names = [name for row in rows for name in row[1:]]
+        if store.encrypts_names:
+            names = list(decrypt_names(names))
+        assert names == [name for voter in voters for name in voter[1:]]
+
+    def test_mistyped_registrations_are_found(self):
+        """
+        Checks that registrations differing by a typo in the national ID or a name are reported, best first, and that
+        registrations with a near national ID but another name aren't
+        """
+        voters = [voter_row[:3] for voter_row, _ in generate_election(ElectionConfig(voter_count=3, seed=5))]
+        (first_id, first_name, last_name), (second_id, second_first, second_last), (third_id, third_first, third_last) = voters
+        swapped_id = first_id[:7] + first_id[8] + first_id[7]
+        # Swapping the digits either side of the prefix must not change the suffix too
+        middle_swapped_id = second_id[:3] + second_id[4] + second_id[3] + second_id[5:]
+        mistyped_id = first_id[:2] + str((int(first_id[2]) + 1) % 10) + first_id[3:]
+        near_id = second_id[:8] + str((int(second_id[8]) + 1) % 10)
+        assert swapped_id != first_id and middle_swapped_id != second_id
+        store = _load_voters([
+            (swapped_id, first_name, last_name),
+            (middle_swapped_id, second_first, second_last),
+            (mistyped_id, first_name.upper(), last_name + "e"),
+            (near_id, "Zelda", "Zimmermann"),
+            (third_id[:-1], third_first, third_last),
+        ])
+
+        report = find_duplicate_registrations(store, workers=2)
+        assert report["voters"] == VOTER_COUNT + 5
+        assert report["candidate_pairs"] < report["all_pairs"] / 100
+        suspects = [suspect["national_ids"] for suspect in report["suspects"]]
+        assert sorted((first_id, swapped_id)) in suspects
+        assert sorted((first_id, mistyped_id)) in suspects
+        assert sorted((second_id, middle_swapped_id)) in suspects
+        assert sorted((third_id, third_id[:-1])) in suspects
+        assert not any(near_id in pair for pair in suspects)
+        scores = [suspect["score"] for suspect in report["suspects"]]
+        assert scores == sorted(scores, reverse=True)
+
+    def test_oversized_blocks_are_skipped(self):
+        """
+        Checks that a block too large to be compared pair by pair is skipped and reported
+        """
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        # Voter Number<i> all have the same name once normalized, and national IDs all starting with 0000
+        voters = [populated_voter(index) for index in range(POPULATED_VOTER_COUNT)]
+        store.add_voters((voter.national_id, voter.first_name, voter.last_name, "1") for voter in voters)
+
+        report = find_duplicate_registrations(store, workers=1, max_block_size=100)
+        assert report["voters"] == POPULATED_VOTER_COUNT
+        assert (report["skipped_blocks"], report["skipped_voters"]) == (1, POPULATED_VOTER_COUNT)
+        assert report["candidate_pairs"] == 0 and report["suspects"] == []
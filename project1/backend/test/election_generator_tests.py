@@ -0,0 +1,67 @@
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.voter import VoterStatus, BallotStatus
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.election_generator import ElectionConfig, generate_election, load_election, \
+    write_election_files
+
+
+class TestElectionGenerator:
+    def test_deterministic_from_seed(self):
+        """
+        Checks that the same seed always generates the same election, and a different seed a different one
+        """
+        config = ElectionConfig(voter_count=200, seed=42)
+        assert list(generate_election(config)) == list(generate_election(config))
+        assert list(generate_election(config)) != list(generate_election(ElectionConfig(voter_count=200, seed=43)))
+
+    def test_election_follows_balloting_rules(self):
+        """
+        Checks that every voter's ballots are consistent with their status
+        """
+        config = ElectionConfig(voter_count=2000, seed=1, fraud_rate=0.1, reissue_rate=0.3)
+        national_ids = set()
+        for (national_id, _, _, status), ballots in generate_election(config):
+            national_ids.add(national_id)
+            statuses = [BallotStatus(ballot[1]) for ballot in ballots]
+            counted = statuses.count(BallotStatus.BALLOT_COUNTED)
+            if VoterStatus(status) == VoterStatus.REGISTERED_NOT_VOTED:
+                assert counted == 0
+            elif VoterStatus(status) == VoterStatus.BALLOT_COUNTED:
+                assert counted == 1 and BallotStatus.FRAUD_COMMITTED not in statuses
+            else:
+                assert counted == 1 and statuses[-1] == BallotStatus.FRAUD_COMMITTED
+            assert all(ballot[4] == national_id for ballot in ballots)
+
+        assert len(national_ids) == config.voter_count
+
+    def test_load_election(self):
+        """
+        Checks that a loaded election can be used through the regular APIs
+        """
+        VotingStore.refresh_instance()
+        config = ElectionConfig(voter_count=500, seed=3, fraud_rate=0.05, comment_rate=1.0, name_rate=1.0)
+        load_election(config, VotingStore.get_instance(), chunk_size=64)
+
+        expected_fraudsters = []
+        for (national_id, first_name, last_name, status), _ in generate_election(config):
+            assert registry.get_voter_status(national_id) == VoterStatus(status)
+            if VoterStatus(status) == VoterStatus.FRAUD_COMMITTED:
+                expected_fraudsters.append(first_name + " " + last_name)
+
+        assert sorted(balloting.get_all_fraudulent_voters()) == sorted(expected_fraudsters)
+        assert len(registry.get_all_candidates()) == config.candidate_count
+        assert all("[REDACTED NAME]" in comment for comment in balloting.get_all_ballot_comments())
+
+    def test_write_election_files(self, tmp_path):
+        """
+        Checks that the files hold one line per voter and per ballot, plus their headers
+        """
+        config = ElectionConfig(voter_count=300, seed=5)
+        write_election_files(config, str(tmp_path))
+
+        election = list(generate_election(config))
+        with open(tmp_path / "voters.csv") as voters_file:
+            assert sum(1 for _ in voters_file) == len(election) + 1
+        with open(tmp_path / "ballots.csv") as ballots_file:
+            assert sum(1 for _ in ballots_file) == sum(len(ballots) for _, ballots in election) + 1
@@ -0,0 +1,83 @@
+import csv
+import os
+from collections import Counter
+
+from backend.main.dataset.k_anonymity import QUASI_IDENTIFIERS, GeneralizationLattice, anonymize, class_report, \
+    count_classes, find_generalization, information_loss
+from backend.main.dataset.tables import PATIENT_RECORDS_DIR
+
+PATIENTS_CSV = os.path.join(PATIENT_RECORDS_DIR, "patients.csv")
+
+
+class TestKAnonymity:
+    def test_class_report(self):
+        """
+        Checks the equivalence classes reported for a table that is 2-anonymous apart from one record
+        """
+        counts = Counter({("1989", "M"): 3, ("1990", "F"): 2, ("1991", "F"): 1})
+        assert class_report(counts, 2) == {
+            "records": 6,
+            "classes": 3,
+            "smallest_class": 1,
+            "records_below_k": 1,
+            "records_below_k_by_class_size": {1: 1},
+        }
+
+    def test_generalize(self):
+        """
+        Checks every level of the birth date and ZIP code hierarchies
+        """
+        lattice = GeneralizationLattice(Counter({("1989-05-25", "01013"): 1}), ("BIRTHDATE", "ZIP"))
+        assert [lattice.generalize(0, "1989-05-25", level) for level in range(6)] == \
+            ["1989-05-25", "1989-05", "1989", "1985-1989", "1980-1989", "*"]
+        assert [lattice.generalize(1, "01013", level) for level in range(6)] == \
+            ["01013", "0101*", "010**", "01***", "0****", "*****"]
+
+    def test_generalizations_are_rolled_up(self):
+        """
+        Checks that the classes rolled up from a memoized specialization are the ones counted from the table's classes
+        """
+        counts = count_classes(PATIENTS_CSV, workers=1)
+        lattice = GeneralizationLattice(counts)
+        for node in lattice.nodes():
+            lattice.counts_at(node)
+        assert lattice.rollups > 0
+
+        recounted = GeneralizationLattice(counts, max_memoized=0)
+        for node in lattice.nodes()[::7]:
+            assert recounted.counts_at(node) == lattice.counts_at(node)
+        assert recounted.rollups == 0
+
+    def test_search_finds_the_best_generalization(self):
+        """
+        Checks that the pruned search finds the same generalization as evaluating every one of them
+        """
+        counts = count_classes(PATIENTS_CSV, workers=1)
+        assert count_classes(PATIENTS_CSV, workers=2, chunk_bytes=16 * 1024) == counts
+        for k, max_suppression in ((5, 0.0), (5, 0.02), (20, 0.05)):
+            lattice = GeneralizationLattice(counts)
+            node, search = find_generalization(lattice, k, max_suppression)
+            assert search["evaluated"] < search["lattice_size"]
+
+            everything = GeneralizationLattice(counts)
+            allowed = int(max_suppression * everything.records)
+            anonymous = [candidate for candidate in everything.nodes()
+                         if information_loss(everything, candidate, k)["suppressed_records"] <= allowed]
+            best = min(anonymous, key=lambda candidate: (everything.precision_loss(candidate),
+                                                         information_loss(everything, candidate, k)["discernibility"]))
+            assert node == best
+
+    def test_generalized_table_is_k_anonymous(self, tmp_path):
+        """
+        Checks that the written table is k-anonymous, with only the allowed share of records left out
+        """
+        out_path = str(tmp_path / "patients.csv")
+        report = anonymize(PATIENTS_CSV, 5, max_suppression=0.02, out_path=out_path, workers=1)
+        assert report["as_is"]["records_below_k"] > 0
+
+        with open(out_path, newline="") as generalized:
+            records = list(csv.DictReader(generalized))
+        assert len(records) == report["generalization"]["written_records"]
+        assert len(records) >= report["as_is"]["records"] * 0.98
+        classes = Counter(tuple(record[column] for column in QUASI_IDENTIFIERS) for record in records)
+        assert min(classes.values()) >= 5
@@ -0,0 +1,94 @@
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, BallotStatus
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.memory_store import MemoryVotingStore
+from backend.main.store.storage import MEMORY_BACKEND, STORAGE_BACKEND_ENV, STORAGE_BACKENDS, configured_backend
+
+
+def run_election():
+    """
+    Runs a small election through the APIs, touching every store method they use
+
+    :returns: Everything the APIs answered along the way
+    """
+    VotingStore.refresh_instance()
+    for candidate_name in ("Kathryn Collins", "Aditya Guha", "Rina Harvey"):
+        registry.register_candidate(candidate_name)
+    voters = [Voter("Adam", "Smith", "111-111-111"), Voter("Thien", "Huynh", "222222222"),
+              Voter("Neel", "Banerjee", "333333333"), Voter("Linda", "Qi", "444444444")]
+    answers = [registry.register_voter(voter) for voter in voters]
+    answers.append(registry.register_voter(Voter("Adam", "Smith", "111111111")))
+
+    ballots = {voter.national_id: [balloting.issue_ballot(voter.national_id) for _ in range(2)] for voter in voters}
+    answers.append(balloting.issue_ballot("999999999"))
+    answers.append(balloting.invalidate_ballot(ballots["444444444"][1]))
+
+    for index, voter in enumerate(voters[:3]):
+        ballot = Ballot(ballots[voter.national_id][0], str(1 + index % 2), "I am " + voter.first_name)
+        answers.append(balloting.count_ballot(ballot, voter.national_id))
+    answers.append(balloting.count_ballot(Ballot(ballots["111111111"][1], "3", ""), "111111111"))
+    answers.append(balloting.count_ballot(Ballot(ballots["444444444"][1], "3", ""), "444444444"))
+    answers.append(balloting.count_ballot(Ballot(ballots["222222222"][1], "3", ""), "444444444"))
+    answers.append(registry.de_register_voter("111111111"))
+    answers.append(registry.de_register_voter("333333333"))
+
+    winner = balloting.compute_election_winner()
+    answers += [registry.get_voter_status(voter.national_id) for voter in voters]
+    answers += [(winner.candidate_id, winner.name), sorted(balloting.get_all_ballot_comments()),
+                balloting.get_all_fraudulent_voters(), list(balloting.iter_ballot_comments(page_size=1)),
+                [(candidate.candidate_id, candidate.name) for candidate in registry.get_all_candidates()]]
+    return answers
+
+
+class TestMemoryStore:
+    def test_backend_is_configurable(self, monkeypatch):
+        """
+        Checks that VotingStore() builds the configured backend, and that refreshing it starts from scratch
+        """
+        monkeypatch.setenv(STORAGE_BACKEND_ENV, MEMORY_BACKEND)
+        VotingStore.refresh_instance()
+        assert isinstance(VotingStore.get_instance(), MemoryVotingStore)
+        registry.register_candidate("Kathryn Collins")
+        VotingStore.refresh_instance()
+        assert registry.get_all_candidates() == []
+
+        monkeypatch.setenv(STORAGE_BACKEND_ENV, "oracle")
+        with pytest.raises(ValueError):
+            configured_backend()
+
+    def test_backends_agree(self, monkeypatch):
+        """
+        Checks that an election run on every backend gets exactly the same answers
+        """
+        answers = {}
+        for backend in STORAGE_BACKENDS:
+            monkeypatch.setenv(STORAGE_BACKEND_ENV, backend)
+            answers[backend] = run_election()
+
+        assert BallotStatus.FRAUD_COMMITTED in answers[MEMORY_BACKEND]
+        for backend in STORAGE_BACKENDS:
+            assert answers[backend] == answers[MEMORY_BACKEND]
+
+    def test_counts_follow_status_changes(self, monkeypatch):
+        """
+        Checks that the per-candidate counts drop a ballot that stops being counted
+        """
+        monkeypatch.setenv(STORAGE_BACKEND_ENV, MEMORY_BACKEND)
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        assert store.get_winner() is None
+        store.add_ballots([("a", str(BallotStatus.BALLOT_COUNTED.value), "1", "", "1"),
+                           ("b", str(BallotStatus.BALLOT_COUNTED.value), "2", "", "2"),
+                           ("c", str(BallotStatus.BALLOT_COUNTED.value), "2", "", "3")])
+        assert store.get_winner().candidate_id == "2"
+        store.update_ballot_status("c", str(BallotStatus.FRAUD_COMMITTED.value))
+        assert store.get_winner().candidate_id == "1"
+
+    @pytest.fixture(autouse=True)
+    def refresh_store_after_test(self):
+        yield
+        VotingStore.refresh_instance()
@@ -0,0 +1,76 @@
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter
+from backend.main.store.data_registry import VotingStore
+
+
+class TestMetrics:
+    def test_operations_are_recorded(self):
+        """
+        Checks that store methods, API functions and ballot outcomes show up in the rendered metrics
+        """
+        metrics.enable()
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        balloting.count_ballot(Ballot(ballot_number, "1", "first"), voter.national_id)
+        balloting.count_ballot(Ballot(ballot_number, "1", "second"), voter.national_id)
+
+        rendered = metrics.render()
+        assert '# TYPE voting_operation_duration_seconds histogram' in rendered
+        assert 'voting_operation_duration_seconds_count{layer="store",operation="get_ballot"} 2' in rendered
+        assert 'voting_operation_duration_seconds_count{layer="balloting",operation="count_ballot"} 2' in rendered
+        assert 'voting_operation_duration_seconds_count{layer="registry",operation="register_voter"} 1' in rendered
+        assert 'voting_ballot_outcomes_total{status="BALLOT_COUNTED"} 1' in rendered
+        assert 'voting_ballot_outcomes_total{status="FRAUD_COMMITTED"} 1' in rendered
+        assert 'le="+Inf"' in rendered
+
+    def test_nothing_recorded_when_disabled(self):
+        """
+        Checks that instrumented calls leave no trace while metrics are disabled
+        """
+        registry.register_voter(Voter("Adam", "Smith", "111111111"))
+        assert metrics.render() == "\n"
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Checks that each bucket counts every observation at or below its bound
+        """
+        registry = metrics.MetricsRegistry()
+        for value in (0.0001, 0.003, 0.003, 10.0):
+            registry.observe("latency", value, operation="a")
+
+        rendered = registry.render()
+        assert 'latency_bucket{operation="a",le="0.0001"} 1' in rendered
+        assert 'latency_bucket{operation="a",le="0.005"} 3' in rendered
+        assert 'latency_bucket{operation="a",le="5.0"} 3' in rendered
+        assert 'latency_bucket{operation="a",le="+Inf"} 4' in rendered
+        assert 'latency_count{operation="a"} 4' in rendered
+
+    def test_metrics_endpoint(self):
+        """
+        Checks that HTTP routes are recorded and served at /metrics, and that /metrics is hidden while disabled
+        """
+        from backend.main.api.backend_rest_api import app
+        client = app.test_client()
+        assert client.get("/metrics").status_code == 404
+
+        metrics.enable()
+        assert client.get("/").status_code == 200
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain")
+        assert 'voting_http_requests_total{method="GET",route="/",status="200"} 1' in response.get_data(as_text=True)
+
+    @pytest.fixture(autouse=True)
+    def reset_metrics(self):
+        VotingStore.refresh_instance()
+        metrics.disable()
+        metrics.REGISTRY.reset()
+        yield
+        metrics.disable()
+        metrics.REGISTRY.reset()
@@ -1,4 +1,10 @@
-from backend.main.objects.voter import Voter, decrypt_name
+from Crypto.Random import get_random_bytes
+
+import backend.main.api.balloting as balloting
+from backend.main.objects import voter as voter_module
+from backend.main.objects.voter import Voter, decrypt_name, decrypt_names, encrypt_name
+from backend.main.store import secret_registry
+from backend.main.store.data_registry import VotingStore
 
 
 class TestMinimization:
@@ -48,4 +54,39 @@ class TestMinimization:
             assert voter.first_name == decrypted_first_name
             assert voter.last_name == decrypted_last_name
 
+    def test_batched_name_decryption(self):
+        """
+        Checks that batched decryption returns every name, in order
+        """
+        names = ["Adam", "Thien", "Neel", "Linda", "Shoujit"] * 20
+        assert list(decrypt_names(encrypt_name(name) for name in names)) == names
+
+    def test_empty_batch_needs_no_key(self, monkeypatch):
+        """
+        Checks that decrypting no names, e.g. the fraudulent voters of a fresh store, works before any name key exists
+        """
+        monkeypatch.delenv(voter_module.NAME_ENCRYPTION_KEY, raising=False)
+        assert list(decrypt_names([])) == []
+
+        VotingStore.refresh_instance()
+        assert balloting.get_all_fraudulent_voters() == []
+        assert list(balloting.iter_fraudulent_voters()) == []
+
+    def test_name_cache_follows_key_rotation(self):
+        """
+        Checks that cached names are served while the key stays the same, and wiped as soon as the key changes
+        """
+        voter_module.enable_name_cache(max_entries=2)
+        try:
+            encrypted_names = [encrypt_name(name) for name in ("Adam", "Smith", "Linda")]
+            assert list(decrypt_names(encrypted_names)) == ["Adam", "Smith", "Linda"]
+            assert len(voter_module._name_cache) == 2
+            assert decrypt_name(encrypted_names[2]) == "Linda"
 
+            cached = voter_module._name_cache.entries[encrypted_names[2]]
+            secret_registry.overwrite_secret_bytes(voter_module.NAME_ENCRYPTION_KEY, get_random_bytes(64))
+            assert decrypt_name(encrypt_name("Rina")) == "Rina"
+            assert cached == bytearray(len("Linda"))
+            assert len(voter_module._name_cache) == 1
+        finally:
+            voter_module.disable_name_cache()
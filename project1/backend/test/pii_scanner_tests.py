@@ -0,0 +1,69 @@
+import os
+
+from backend.main.dataset.pii_scanner import scan_tables
+from backend.main.dataset.tables import PATIENT_RECORDS_DIR, plan_chunks, read_chunk, read_header
+
+PATIENTS_CSV = os.path.join(PATIENT_RECORDS_DIR, "patients.csv")
+
+
+def _write_table(path, lines):
+    with open(path, "wb") as table:
+        table.write("﻿".encode() + "\n".join(lines).encode() + b"\n")
+    return str(path)
+
+
+class TestTables:
+    def test_chunks_hold_whole_records(self, tmp_path):
+        """
+        Checks that however small the chunks, every record is read exactly once, at its own offset, even when a quoted
+        field spans several lines
+        """
+        lines = ["Id,NOTE"] + ['{0},"line one\nline two, {0}"'.format(index) for index in range(50)]
+        path = _write_table(tmp_path / "notes.csv", lines)
+        columns, _ = read_header(path)
+        assert columns == ["Id", "NOTE"]
+
+        for chunk_bytes in (1, 7, 64, 1 << 20):
+            records = [record for chunk in plan_chunks(path, chunk_bytes) for record in read_chunk(*chunk)]
+            assert [row for _, row in records] == \
+                [[str(index), "line one\nline two, {0}".format(index)] for index in range(50)]
+            with open(path, "rb") as table:
+                for offset, row in records:
+                    table.seek(offset)
+                    assert table.readline().decode().startswith(row[0] + ",")
+
+
+class TestPiiScanner:
+    def test_findings_per_column(self, tmp_path):
+        """
+        Checks that cells are counted per column and kind of PII, with the offsets of the records they are in
+        """
+        lines = [
+            "Id,FIRST,SSN,CONTACT,COST",
+            "1,Adam,999-76-6866,adam@example.com,129.16",
+            "2,Linda,,(555) 123-4567,1133705.1400000001",
+            "3,,999-73-5361,,",
+        ]
+        path = _write_table(tmp_path / "people.csv", lines)
+        first, second, third = [open(path, "rb").read().index(line.encode()) for line in lines[1:]]
+
+        findings = scan_tables([path], workers=1)["tables"]["people"]
+        assert findings["records"] == 3
+        assert findings["columns"] == {
+            "FIRST": {"name": {"count": 2, "samples": [first, second]}},
+            "SSN": {"ssn": {"count": 2, "samples": [first, third]}},
+            "CONTACT": {"email": {"count": 1, "samples": [first]}, "phone": {"count": 1, "samples": [second]}},
+        }
+
+    def test_parallel_scan_matches_serial_scan(self):
+        """
+        Checks that scanning the patient table in small chunks on a pool finds exactly what one serial pass finds
+        """
+        serial = scan_tables([PATIENTS_CSV], workers=1)["tables"]
+        parallel = scan_tables([PATIENTS_CSV], workers=2, chunk_bytes=16 * 1024)["tables"]
+        assert parallel == serial
+
+        columns = serial["patients"]["columns"]
+        assert columns["SSN"]["ssn"]["count"] == serial["patients"]["records"]
+        assert "passport" in columns["PASSPORT"] and "drivers_license" in columns["DRIVERS"]
+        assert "LAT" not in columns and "HEALTHCARE_EXPENSES" not in columns
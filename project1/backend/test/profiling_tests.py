@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+import backend.main.api.registry as registry
+from backend.main.monitoring import profiling
+from backend.main.objects.voter import Voter
+from backend.main.store import secret_registry
+from backend.main.store.data_registry import VotingStore
+from backend.test.conftest import sqlite_only
+
+
+class TestProfiling:
+    @sqlite_only
+    def test_capture_samples_busy_threads_and_times_statements(self):
+        """
+        Checks that a capture sees what other threads are running, and every statement the store ran meanwhile
+        """
+        stop = threading.Event()
+
+        def register_voters():
+            index = 0
+            while not stop.is_set():
+                registry.register_voter(Voter("Adam", "Smith", "{0:09d}".format(index)))
+                index += 1
+
+        worker = threading.Thread(target=register_voters)
+        worker.start()
+        try:
+            result = profiling.capture(0.3)
+        finally:
+            stop.set()
+            worker.join()
+
+        assert result["samples"] > 0
+        assert "register_voters" in {function["function"] for function in result["functions"]}
+        statements = {timing["statement"]: timing for timing in result["statements"]}
+        assert "SELECT count(*) FROM voter WHERE national_id=?" in statements
+        assert statements["SELECT count(*) FROM voter WHERE national_id=?"]["count"] > 0
+
+        # The store is back on its own connection once the capture is over
+        assert not isinstance(VotingStore.get_instance().connection, profiling.TimedConnection)
+
+    def test_only_one_capture_at_a_time(self):
+        """
+        Checks that a capture started while another is running is refused
+        """
+        first = threading.Thread(target=profiling.capture, args=(0.3,))
+        first.start()
+        time.sleep(0.05)
+        assert profiling.capture(0.1) is None
+        first.join()
+
+    def test_profile_endpoint_requires_admin_token(self):
+        """
+        Checks that the endpoint is hidden without a configured token, and refuses requests with the wrong token
+        """
+        from backend.main.api.backend_rest_api import app
+        client = app.test_client()
+        assert client.post("/admin/profile?seconds=0").status_code == 404
+
+        secret_registry.overwrite_secret_str(profiling.ADMIN_TOKEN_SECRET, "let me in")
+        assert client.post("/admin/profile?seconds=0", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert client.post("/admin/profile?seconds=0", headers={"X-Admin-Token": "let me in"},
+                           environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 404
+
+        response = client.post("/admin/profile?seconds=0.1", headers={"X-Admin-Token": "let me in"})
+        assert response.status_code == 200
+        assert response.get_json()["seconds"] == 0.1
+
+    @pytest.fixture(autouse=True)
+    def clear_admin_token(self):
+        VotingStore.refresh_instance()
+        secret_registry.overwrite_secret_str(profiling.ADMIN_TOKEN_SECRET, "")
+        yield
+        secret_registry.overwrite_secret_str(profiling.ADMIN_TOKEN_SECRET, "")
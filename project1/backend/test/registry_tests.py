@@ -1,8 +1,11 @@
 import pytest
 
+import backend.main.api.balloting as balloting
 import backend.main.api.registry as registry
-from backend.main.objects.voter import Voter, VoterStatus
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus, DeRegistrationStatus
 from backend.main.store.data_registry import VotingStore
+from backend.test.conftest import sqlite_only
 
 
 class TestRegistry:
@@ -68,3 +71,80 @@ class TestRegistry:
     @pytest.fixture(autouse=True)
     def clear_store_between_tests(self):
         VotingStore.refresh_instance()
+
+
+class TestBulkDeRegistration:
+    def _election(self):
+        """
+        Registers three voters with two ballots each. The first voter votes, the second commits fraud and the third
+        never votes.
+
+        :returns: The voters, and the ballot numbers issued to each of them
+        """
+        registry.register_candidate("Kathryn Collins")
+        candidate_id = registry.get_all_candidates()[0].candidate_id
+        voters = [Voter("Adam", "Smith", "111111111"), Voter("Thien", "Huynh", "222222222"),
+                  Voter("Neel", "Banerjee", "333333333")]
+        ballots = {}
+        for voter in voters:
+            registry.register_voter(voter)
+            ballots[voter.national_id] = [balloting.issue_ballot(voter.national_id) for _ in range(2)]
+        balloting.count_ballot(Ballot(ballots["111111111"][0], candidate_id, "hello"), "111111111")
+        balloting.count_ballot(Ballot(ballots["222222222"][0], candidate_id, ""), "222222222")
+        balloting.count_ballot(Ballot(ballots["222222222"][1], candidate_id, ""), "222222222")
+        return voters, ballots
+
+    def test_fraud_exclusion_and_report(self):
+        """
+        Checks that every voter but the fraudster is de-registered, and that their unused ballots can't be used
+        """
+        voters, ballots = self._election()
+        report = registry.de_register_voters(["111-11-1111", "222222222", "333333333", "999999999"], chunk_size=2)
+
+        assert report == {"111-11-1111": DeRegistrationStatus.DE_REGISTERED,
+                          "222222222": DeRegistrationStatus.FRAUD_COMMITTED,
+                          "333333333": DeRegistrationStatus.DE_REGISTERED,
+                          "999999999": DeRegistrationStatus.NOT_REGISTERED}
+        assert [registry.get_voter_status(voter.national_id) for voter in voters] == \
+            [VoterStatus.NOT_REGISTERED, VoterStatus.FRAUD_COMMITTED, VoterStatus.NOT_REGISTERED]
+
+        store = VotingStore.get_instance()
+        assert store.get_ballot(ballots["111111111"][0]) == BallotStatus.BALLOT_COUNTED.value
+        for ballot_number in (ballots["111111111"][1], *ballots["333333333"]):
+            assert store.get_ballot(ballot_number) == BallotStatus.INVALID_BALLOT.value
+        assert balloting.get_all_fraudulent_voters() == ["Thien Huynh"]
+
+    def test_erasure(self):
+        """
+        Checks that erased voters and their uncounted ballots are gone, while their counted ballots still count
+        """
+        voters, ballots = self._election()
+        report = registry.de_register_voters(["111111111", "333333333"], erase=True)
+
+        assert set(report.values()) == {DeRegistrationStatus.ERASED}
+        store = VotingStore.get_instance()
+        for national_id in report:
+            assert store.get_vote(national_id) is None
+            assert registry.get_voter_status(national_id) == VoterStatus.NOT_REGISTERED
+        for ballot_number in (ballots["111111111"][1], *ballots["333333333"]):
+            assert store.get_ballot(ballot_number) is None
+        assert store.get_ballot(ballots["111111111"][0]) == BallotStatus.BALLOT_COUNTED.value
+        assert sorted(balloting.get_all_ballot_comments()) == ["", "hello"]
+        assert balloting.compute_election_winner().name == "Kathryn Collins"
+
+    @sqlite_only
+    def test_erasure_gives_pages_back(self):
+        """
+        Checks that erasing voters leaves no free pages behind in the database
+        """
+        store = VotingStore.get_instance()
+        store.add_voters((str(100000000 + index), "Voter", "Number" + str(index),
+                          str(VoterStatus.REGISTERED_NOT_VOTED.value)) for index in range(5000))
+        registry.de_register_voters((str(100000000 + index) for index in range(5000)), erase=True, chunk_size=1000)
+
+        assert store.connection.execute("SELECT count(*) FROM voter").fetchone()[0] == 0
+        assert store.connection.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
+from backend.main.store.data_registry import VotingStore
+from backend.main.store.result_cache import RecentResultCache
+from backend.test.conftest import sqlite_only
+
+
+class TestResultCache:
+    def test_retried_ballot_is_not_fraud(self):
+        """
+        Checks that submitting the same ballot again returns the original status without flagging the voter
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot = Ballot(balloting.issue_ballot(voter.national_id), "1", "my comment")
+
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(ballot, "111-11-1111") == BallotStatus.BALLOT_COUNTED
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.BALLOT_COUNTED
+        assert balloting.get_all_fraudulent_voters() == []
+
+    def test_idempotency_key(self):
+        """
+        Checks that requests sharing an idempotency key get the first answer, and other requests are still checked
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+
+        assert balloting.count_ballot(Ballot(ballot_number, "1", "first"), voter.national_id, "retry-me") == \
+            BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(Ballot(ballot_number, "1", "resent"), voter.national_id, "retry-me") == \
+            BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(Ballot(ballot_number, "1", "resent"), voter.national_id, "new-request") == \
+            BallotStatus.FRAUD_COMMITTED
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.FRAUD_COMMITTED
+
+    def test_rejections_are_not_cached(self):
+        """
+        Checks that a ballot that was rejected is checked again when resubmitted
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        ballot = Ballot("not issued yet", "1", "")
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.VOTER_NOT_REGISTERED
+
+        registry.register_voter(voter)
+        ballot.ballot_number = balloting.issue_ballot(voter.national_id)
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+    def test_retries_are_not_counted_as_outcomes(self):
+        """
+        Checks that a retry answered from the recent results leaves the ballot outcome counts alone
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot = Ballot(balloting.issue_ballot(voter.national_id), "1", "")
+        metrics.REGISTRY.reset()
+        metrics.enable()
+        try:
+            for _ in range(3):
+                assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+            rendered = metrics.render()
+        finally:
+            metrics.disable()
+        assert 'voting_ballot_outcomes_total{status="BALLOT_COUNTED"} 1' in rendered
+        assert 'voting_operation_duration_seconds_count{layer="balloting",operation="count_ballot"} 3' in rendered
+
+    @sqlite_only
+    def test_restore_forgets_recent_results(self, tmp_path):
+        """
+        Checks that a ballot counted before a restore is counted again against the restored data, not answered from
+        the recent results
+        """
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot = Ballot(balloting.issue_ballot(voter.national_id), "1", "")
+        path = str(tmp_path / "snapshot.db")
+        VotingStore.get_instance().snapshot(path)
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+
+        VotingStore.get_instance().restore(path)
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.REGISTERED_NOT_VOTED
+        assert balloting.count_ballot(ballot, voter.national_id) == BallotStatus.BALLOT_COUNTED
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.BALLOT_COUNTED
+
+    def test_eviction_and_expiry(self):
+        """
+        Checks that the cache stays within its bounds, evicting the least recently used entries first
+        """
+        cache = RecentResultCache("test", max_entries=2, ttl_seconds=0.2)
+        for key in ("a", "b"):
+            cache.get_or_compute(key, lambda: key, lambda result: True)
+        cache.get("a")
+        cache.get_or_compute("c", lambda: "c", lambda result: True)
+
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == "a"
+
+        time.sleep(0.25)
+        assert cache.get("a") is None
+
+    def test_concurrent_identical_requests_compute_once(self):
+        """
+        Checks that identical requests arriving together wait for the first one instead of computing again
+        """
+        cache = RecentResultCache("test")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute,
+                                                                                     lambda result: True)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == ["result"] * 8
+
+    @pytest.fixture(autouse=True)
+    def clear_store_between_tests(self):
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
@@ -0,0 +1,93 @@
+import os
+import shutil
+
+from backend.main.dataset.sar_index import APPENDED, INDEXED, UNCHANGED, SarIndex, patient_column
+from backend.main.dataset.tables import PATIENT_RECORDS_DIR, list_tables, plan_chunks, read_chunk, read_header, \
+    table_name
+
+PATIENT = "71ba0469-f0cc-4177-ac70-ea07cb01c8b8"
+TABLES = ["conditions.csv", "encounters.csv", "immunizations.csv", "patients.csv", "organizations.csv"]
+
+
+def _scan(paths, patient):
+    """
+    :returns: The records of the patient in every table, found by reading the tables in full
+    """
+    tables = {}
+    for path in paths:
+        columns, first_record = read_header(path)
+        column = patient_column(path, columns)
+        if column is None:
+            continue
+        for _, start, end in plan_chunks(path, start=first_record):
+            for _, row in read_chunk(path, start, end):
+                if row[column].strip() == patient:
+                    tables.setdefault(table_name(path), []).append(row)
+    return tables
+
+
+def _copy_tables(tmp_path):
+    tables = tmp_path / "tables"
+    tables.mkdir()
+    for table in TABLES:
+        shutil.copy(os.path.join(PATIENT_RECORDS_DIR, table), tables / table)
+    return [str(tables / table) for table in TABLES]
+
+
+class TestSarIndex:
+    def test_export_matches_full_scan(self, tmp_path):
+        """
+        Checks that the records exported through the index are the ones a full scan of the tables finds
+        """
+        paths = list_tables(PATIENT_RECORDS_DIR)
+        with SarIndex(str(tmp_path / "sar.sqlite3")) as index:
+            report = index.update(paths, workers=2, chunk_bytes=16 * 1024)
+            assert "organizations" not in report["tables"]
+            assert all(table["action"] == INDEXED for table in report["tables"].values())
+
+            export = index.export(PATIENT)
+            assert {table: records["records"] for table, records in export["tables"].items()} == \
+                _scan(paths, PATIENT)
+            assert export["tables"]["patients"]["columns"][0] == "Id"
+            assert index.export("not a patient")["records"] == 0
+
+    def test_appended_records_are_indexed_incrementally(self, tmp_path):
+        """
+        Checks that only the bytes appended to a table are indexed, and that they are exported
+        """
+        paths = _copy_tables(tmp_path)
+        conditions = paths[0]
+        with SarIndex(str(tmp_path / "sar.sqlite3")) as index:
+            index.update(paths, workers=1)
+            before = index.export(PATIENT)["tables"]["conditions"]["records"]
+
+            size = os.path.getsize(conditions)
+            with open(conditions, "a", newline="") as table:
+                table.write("\n1/1/20,,{0},e1,38341003,Hypertension,Carmelia328,Konopelski743\n".format(PATIENT))
+                table.write("1/2/20,,someone-else,e2,38341003,Hypertension,Adam123,Smith456\n")
+            report = index.update(paths, workers=1)
+            assert report["tables"]["conditions"]["action"] == APPENDED
+            assert report["tables"]["conditions"]["bytes"] == os.path.getsize(conditions) - size
+            assert report["tables"]["encounters"]["action"] == UNCHANGED
+
+            after = index.export(PATIENT, refresh=False)["tables"]["conditions"]["records"]
+            assert after == before + [["1/1/20", "", PATIENT, "e1", "38341003", "Hypertension", "Carmelia328",
+                                       "Konopelski743"]]
+            assert after == _scan([conditions], PATIENT)["conditions"]
+
+    def test_rewritten_table_is_indexed_again(self, tmp_path):
+        """
+        Checks that a table that was changed other than by appending to it is indexed from scratch
+        """
+        paths = _copy_tables(tmp_path)
+        immunizations = paths[2]
+        with SarIndex(str(tmp_path / "sar.sqlite3")) as index:
+            index.update(paths, workers=1)
+            with open(immunizations, encoding="utf-8-sig") as table:
+                lines = table.read().splitlines()
+            with open(immunizations, "w") as table:
+                table.write("\n".join(lines[:1] + lines[1:][::-1]) + "\n")
+
+            export = index.export(PATIENT)
+            assert export["tables"]["immunizations"]["records"] == _scan([immunizations], PATIENT)["immunizations"]
+            assert index.update(paths, workers=1)["tables"]["immunizations"]["action"] == UNCHANGED
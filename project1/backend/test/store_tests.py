@@ -0,0 +1,284 @@
+import sqlite3
+
+import pytest
+
+import backend.main.api.balloting as balloting
+import backend.main.api.registry as registry
+from backend.main.monitoring import metrics
+from backend.main.objects.ballot import Ballot
+from backend.main.objects.voter import Voter, VoterStatus, BallotStatus
+from backend.main.store.data_registry import AGGREGATE_MAX_STALENESS_ENV, VotingStore, _aggregate_max_staleness
+from backend.main.store.snapshot_reader import SNAPSHOT_SINGLE_STEP_COPIES, SnapshotReader
+from backend.test.conftest import POPULATED_CANDIDATE_NAMES, POPULATED_VOTER_COUNT, populated_voter, sqlite_only
+
+
+@sqlite_only
+class TestSnapshot:
+    def test_snapshot_restore_round_trip(self, tmp_path):
+        """
+        Checks that everything written before a snapshot is visible again after restoring it into a new store
+        """
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        voter = Voter("Adam", "Smith", "111111111")
+        assert registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+
+        path = str(tmp_path / "snapshot.db")
+        VotingStore.get_instance().snapshot(path)
+
+        VotingStore.refresh_instance()
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.NOT_REGISTERED
+
+        VotingStore.get_instance().restore(path)
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.REGISTERED_NOT_VOTED
+        assert [candidate.name for candidate in registry.get_all_candidates()] == ["Kathryn Collins"]
+        assert balloting.verify_ballot(voter.national_id, ballot_number)
+
+    def test_populated_store(self, populated_store):
+        """
+        Checks that the populated fixture holds every candidate and voter
+        """
+        all_candidates = registry.get_all_candidates()
+        assert sorted(candidate.name for candidate in all_candidates) == sorted(POPULATED_CANDIDATE_NAMES)
+        for index in (0, POPULATED_VOTER_COUNT // 2, POPULATED_VOTER_COUNT - 1):
+            voter = populated_voter(index)
+            assert registry.get_voter_status(voter.national_id) == VoterStatus.REGISTERED_NOT_VOTED
+
+    def test_populated_store_is_isolated(self, populated_store, populated_store_snapshot):
+        """
+        Checks that changes made on one copy of the populated store don't leak into the next copy
+        """
+        voter = populated_voter(0)
+        assert registry.de_register_voter(voter.national_id)
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.NOT_REGISTERED
+
+        VotingStore.refresh_instance()
+        VotingStore.get_instance().restore(populated_store_snapshot)
+        assert registry.get_voter_status(voter.national_id) == VoterStatus.REGISTERED_NOT_VOTED
+
+
+class TestEncryptionAtRest:
+    @sqlite_only
+    def test_names_are_not_stored_in_plaintext(self):
+        """
+        Checks that the voter table holds name envelopes, and that the names still come back through the APIs
+        """
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+
+        rows = VotingStore.get_instance().connection.execute("SELECT first_name, last_name FROM voter").fetchall()
+        assert len(rows) == 1
+        for encrypted_name in rows[0]:
+            assert isinstance(encrypted_name, bytes)
+            assert b"Adam" not in encrypted_name and b"Smith" not in encrypted_name
+
+        assert VotingStore.get_instance().get_vote(voter.national_id).first_name == "Adam"
+
+        ballot_numbers = [balloting.issue_ballot(voter.national_id) for _ in range(2)]
+        all_candidates = registry.get_all_candidates()
+        assert balloting.count_ballot(Ballot(ballot_numbers[0], all_candidates[0].candidate_id, "I am Adam Smith"),
+                                      voter.national_id) == BallotStatus.BALLOT_COUNTED
+        assert balloting.count_ballot(Ballot(ballot_numbers[1], all_candidates[0].candidate_id, ""),
+                                      voter.national_id) == BallotStatus.FRAUD_COMMITTED
+        assert balloting.get_all_ballot_comments() == ["I am [REDACTED NAME] [REDACTED NAME]"]
+        assert balloting.get_all_fraudulent_voters() == ["Adam Smith"]
+
+    def test_de_registered_voter_cannot_vote(self):
+        """
+        Checks that a voter who de-registered after getting a ballot is told they aren't registered
+        """
+        VotingStore.refresh_instance()
+        voter = Voter("Adam", "Smith", "111111111")
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        assert registry.de_register_voter(voter.national_id)
+
+        assert balloting.count_ballot(Ballot(ballot_number, "1", ""), voter.national_id) == \
+            BallotStatus.VOTER_NOT_REGISTERED
+
+
+class SteppingConnection(sqlite3.Connection):
+    """
+    A connection that records the pages left after every step of a backup, and can write in between steps
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.steps = []
+        self.on_step = None
+
+    def backup(self, target, *, progress=None, **kwargs):
+        def record(status, remaining, total):
+            self.steps.append(remaining)
+            if self.on_step is not None and status != sqlite3.SQLITE_DONE:
+                self.on_step()
+            if progress is not None:
+                progress(status, remaining, total)
+        return super().backup(target, progress=record, **kwargs)
+
+
+class RecordingLock:
+    """
+    A lock that remembers after which backup steps it was taken
+    """
+    def __init__(self, steps):
+        self.steps = steps
+        self.acquired_at = []
+        self.held = False
+
+    def acquire(self):
+        self.acquired_at.append(len(self.steps))
+        self.held = True
+
+    def release(self):
+        self.held = False
+
+
+class TestAggregateSnapshot:
+    def _count_one_ballot(self, national_id: str, comment: str):
+        voter = Voter("Adam", "Smith", national_id)
+        registry.register_voter(voter)
+        ballot_number = balloting.issue_ballot(voter.national_id)
+        candidate = registry.get_all_candidates()[0]
+        assert balloting.count_ballot(Ballot(ballot_number, candidate.candidate_id, comment), voter.national_id) == \
+            BallotStatus.BALLOT_COUNTED
+
+    def test_aggregates_may_lag_by_default(self, monkeypatch):
+        """
+        Checks that unless configured otherwise, aggregates are allowed to lag the writes for a little while
+        """
+        monkeypatch.delenv(AGGREGATE_MAX_STALENESS_ENV, raising=False)
+        assert _aggregate_max_staleness() > 0
+        monkeypatch.setenv(AGGREGATE_MAX_STALENESS_ENV, "off")
+        assert _aggregate_max_staleness() is None
+
+    def test_aggregates_see_every_change_without_staleness(self):
+        """
+        Checks that with no staleness allowed, aggregates see a ballot counted right before them
+        """
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        self._count_one_ballot("111111111", "first")
+        assert balloting.get_all_ballot_comments() == ["first"]
+        self._count_one_ballot("222222222", "second")
+        assert sorted(balloting.get_all_ballot_comments()) == ["first", "second"]
+
+    @sqlite_only
+    def test_aggregates_may_lag_by_the_allowed_staleness(self, monkeypatch):
+        """
+        Checks that aggregates are served from the same snapshot until it is older than the allowed staleness
+        """
+        monkeypatch.setattr(VotingStore, "aggregate_max_staleness", 3600.0)
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        self._count_one_ballot("111111111", "first")
+        assert balloting.get_all_ballot_comments() == ["first"]
+
+        self._count_one_ballot("222222222", "second")
+        assert balloting.get_all_ballot_comments() == ["first"]
+
+        VotingStore.get_instance()._aggregate_snapshot.max_staleness = 0.0
+        assert sorted(balloting.get_all_ballot_comments()) == ["first", "second"]
+
+    @sqlite_only
+    def test_snapshot_is_read_only(self):
+        """
+        Checks that the aggregate snapshot refuses writes
+        """
+        VotingStore.refresh_instance()
+        with VotingStore.get_instance()._aggregate_reader() as snapshot:
+            with pytest.raises(sqlite3.OperationalError):
+                snapshot.execute("INSERT INTO candidates (name) VALUES ('Kathryn Collins')")
+
+    @sqlite_only
+    def test_snapshot_is_refreshed_in_place(self):
+        """
+        Checks that a snapshot nobody is reading is overwritten by the next refresh, and that one still being read
+        keeps its data while the refresh goes to another copy
+        """
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        registry.register_candidate("Kathryn Collins")
+        with store._aggregate_reader() as first:
+            pass
+        self._count_one_ballot("111111111", "first")
+        with store._aggregate_reader() as snapshot:
+            assert snapshot is first
+
+            self._count_one_ballot("222222222", "second")
+            assert sorted(balloting.get_all_ballot_comments()) == ["first", "second"]
+            assert [row[0] for row in snapshot.execute("SELECT vote FROM ballot WHERE vote != ''")] == ["first"]
+
+        # Both copies are idle now, and are reused rather than new ones being made
+        self._count_one_ballot("333333333", "third")
+        comments = balloting.iter_ballot_comments(page_size=1)
+        assert next(comments) == "first"
+        self._count_one_ballot("444444444", "fourth")
+        assert len(balloting.get_all_ballot_comments()) == 4
+        assert list(comments) == ["second", "third"]
+        assert len(store._aggregate_snapshot.readings) == 0
+        assert store._aggregate_snapshot.spare is not None
+
+    def test_snapshot_is_copied_in_steps(self):
+        """
+        Checks that the copy is made a few pages at a time with the write lock only taken for the last step, and that
+        writes restarting the copy over and over don't keep it from finishing
+        """
+        source = sqlite3.connect(":memory:", factory=SteppingConnection, check_same_thread=False)
+        source.execute("CREATE TABLE filler (data BLOB)")
+        source.executemany("INSERT INTO filler VALUES (randomblob(4000))", [()] * 200)
+        source.commit()
+        lock = RecordingLock(source.steps)
+        reader = SnapshotReader(max_staleness=0.0, pages_per_step=16)
+
+        with reader.reading(source, lock) as snapshot:
+            assert snapshot.execute("SELECT count(*) FROM filler").fetchone()[0] == 200
+        assert len(source.steps) > 10
+        assert lock.acquired_at == [len(source.steps) - 1] and not lock.held
+
+        def write():
+            source.execute("INSERT INTO filler VALUES (randomblob(10))")
+            source.commit()
+
+        write()
+        source.on_step = write
+        metrics.REGISTRY.reset()
+        metrics.enable()
+        try:
+            with reader.reading(source, lock) as snapshot:
+                rows = snapshot.execute("SELECT count(*) FROM filler").fetchone()[0]
+            rendered = metrics.render()
+        finally:
+            metrics.disable()
+        assert 200 < rows <= source.execute("SELECT count(*) FROM filler").fetchone()[0]
+        assert SNAPSHOT_SINGLE_STEP_COPIES in rendered and not lock.held
+
+    @sqlite_only
+    def test_restore_invalidates_snapshot(self, tmp_path, monkeypatch):
+        """
+        Checks that aggregates never answer from a snapshot of the data a restore replaced
+        """
+        monkeypatch.setattr(VotingStore, "aggregate_max_staleness", 3600.0)
+        VotingStore.refresh_instance()
+        registry.register_candidate("Kathryn Collins")
+        self._count_one_ballot("111111111", "first")
+        path = str(tmp_path / "snapshot.db")
+        VotingStore.get_instance().snapshot(path)
+
+        VotingStore.refresh_instance()
+        assert balloting.get_all_ballot_comments() == []
+        VotingStore.get_instance().restore(path)
+        assert balloting.get_all_ballot_comments() == ["first"]
+
+    @sqlite_only
+    def test_snapshots_off(self, monkeypatch):
+        """
+        Checks that with snapshots off, aggregates run on the write connection
+        """
+        monkeypatch.setattr(VotingStore, "aggregate_max_staleness", None)
+        VotingStore.refresh_instance()
+        store = VotingStore.get_instance()
+        with store._aggregate_reader() as connection:
+            assert connection is store.connection
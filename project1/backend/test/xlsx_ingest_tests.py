@@ -0,0 +1,147 @@
+import os
+import shutil
+import sqlite3
+import zipfile
+
+import pytest
+
+from backend.main.dataset.column_classifier import ColumnClass
+from backend.main.dataset.tables import WEB_PORTAL_DIR
+from backend.main.dataset.xlsx_ingest import ENCRYPTED, INGESTED, SchemaMismatch, XlsxCache, group_parts, read_part, \
+    read_rows
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Worksheet" sheetId="1" r:id="rId1"/></sheets></workbook>"""
+
+RELATIONSHIPS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+ Target="worksheets/sheet1.xml"/></Relationships>"""
+
+
+def _write_workbook(path, rows):
+    """
+    Writes a minimal xlsx workbook, with every cell an inline string
+    """
+    cells = []
+    for number, row in enumerate(rows, 1):
+        cells.append('<row r="{0}">{1}</row>'.format(number, "".join(
+            '<c r="{0}{1}" t="inlineStr"><is><t>{2}</t></is></c>'.format(chr(ord("A") + index), number, value)
+            for index, value in enumerate(row) if value is not None)))
+    sheet = '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>{0}' \
+            '</sheetData></worksheet>'.format("".join(cells))
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("xl/workbook.xml", WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", RELATIONSHIPS)
+        archive.writestr("xl/worksheets/sheet1.xml", sheet)
+
+
+def _copy_parts(tmp_path, names):
+    for name in names:
+        shutil.copy(os.path.join(WEB_PORTAL_DIR, name), tmp_path / name)
+    return [str(tmp_path / name) for name in names]
+
+
+class TestXlsxIngest:
+    def test_parts_are_grouped(self):
+        """
+        Checks that the parts of a dataset are grouped together, in the order of their numbers
+        """
+        assert group_parts(["/a/billing.db-part10.xlsx", "/a/billing.db-part2.xlsx", "/a/report.xlsx"]) == {
+            "billing": ["/a/billing.db-part2.xlsx", "/a/billing.db-part10.xlsx"],
+            "report": ["/a/report.xlsx"],
+        }
+
+    def test_read_rows(self, tmp_path):
+        """
+        Checks that cells are read into the columns their references name, with empty cells left as None
+        """
+        path = str(tmp_path / "people.xlsx")
+        _write_workbook(path, [["Name", "Phone", "Note"], ["Adam", None, "x"]])
+        assert list(read_rows(path)) == [["Name", "Phone", "Note"], ["Adam", None, "x"]]
+
+    def test_web_portal_data(self, tmp_path):
+        """
+        Checks that the readable parts are merged and classified, and that encrypted parts are reported
+        """
+        paths = _copy_parts(tmp_path, ["patient-registration.db-part4.xlsx", "patient-registration.db-part5.xlsx",
+                                        "patient-billing.db-part1.xlsx"])
+        with XlsxCache(str(tmp_path / "cache.sqlite3")) as cache:
+            report = cache.ingest(paths, workers=2)
+            registration = report["datasets"]["patient-registration"]
+            assert not registration["cached"] and not registration["complete"]
+            assert [(part["part"], part["status"]) for part in registration["parts"]] == [(4, INGESTED), (5, ENCRYPTED)]
+            assert registration["records"] == 3000
+            classes = {column["column"]: column["class"] for column in registration["columns"]}
+            assert classes["SSN"] == classes["Email Address"] == ColumnClass.DEFINITELY_PII.value
+            assert classes["Blood Type"] == ColumnClass.CLEAN.value
+
+            records = list(cache.records("patient-registration"))
+            assert len(records) == 3000
+            assert records[0][:2] == ("Gavin", "Carney")
+            billing = report["datasets"]["patient-billing"]
+            assert billing["complete"]
+            billing_classes = {column["column"]: column["class"] for column in billing["columns"]}
+            sensitive = [classes["Date of Birth"], classes["Emergency Contact"],
+                         billing_classes["CCN Visa / Master Card / AMEX"], billing_classes["CVV"]]
+            assert ColumnClass.CLEAN.value not in sensitive
+
+    def test_cache_is_used_until_a_part_changes(self, tmp_path):
+        """
+        Checks that a later run uses the cache, even if a part was only touched, and reads the parts again if one of
+        them changed or was added
+        """
+        first, second = str(tmp_path / "people.db-part1.xlsx"), str(tmp_path / "people.db-part2.xlsx")
+        _write_workbook(first, [["Name", "Email"], ["Adam", "adam@example.com"]])
+        with XlsxCache(str(tmp_path / "cache.sqlite3")) as cache:
+            assert not cache.ingest([first], workers=1)["datasets"]["people"]["cached"]
+            assert cache.ingest([first], workers=1)["datasets"]["people"]["cached"]
+
+            os.utime(first, ns=(0, 0))
+            assert cache.ingest([first], workers=1)["datasets"]["people"]["cached"]
+
+            _write_workbook(second, [["Name", "Email"], ["Eve", "eve@example.com"]])
+            report = cache.ingest([first, second], workers=1)["datasets"]["people"]
+            assert not report["cached"] and report["records"] == 2
+
+            _write_workbook(first, [["Name", "Email"], ["Bob", "bob@example.com"]])
+            assert not cache.ingest([first, second], workers=1)["datasets"]["people"]["cached"]
+            assert list(cache.records("people")) == [("Bob", "bob@example.com"), ("Eve", "eve@example.com")]
+
+    def test_parts_with_different_headers_are_rejected(self, tmp_path):
+        """
+        Checks that parts whose headers differ aren't merged
+        """
+        first, second = str(tmp_path / "people.db-part1.xlsx"), str(tmp_path / "people.db-part2.xlsx")
+        _write_workbook(first, [["Name", "Email"], ["Adam", "adam@example.com"]])
+        _write_workbook(second, [["Name", "Phone"], ["Eve", "555-123-4567"]])
+        with XlsxCache(str(tmp_path / "cache.sqlite3")) as cache:
+            with pytest.raises(SchemaMismatch):
+                cache.ingest([first, second], workers=1)
+            assert cache.columns("people") == []
+
+    def test_parts_are_read_into_files(self, tmp_path):
+        """
+        Checks that a part's records are written to a sqlite file of its own rather than returned, and that those
+        files are gone once the dataset is merged, even when the merge fails
+        """
+        first, second = str(tmp_path / "people.db-part1.xlsx"), str(tmp_path / "people.db-part2.xlsx")
+        _write_workbook(first, [["Name", "Email"], ["Adam", "adam@example.com"], [None, None], ["Eve", None]])
+        _write_workbook(second, [["Name", "Phone"], ["Bob", "555-123-4567"]])
+        records_path = str(tmp_path / "people.sqlite3")
+        part = read_part((first, records_path))
+        assert (part["columns"], part["rows"], part["records"]) == (["Name", "Email"], 2, records_path)
+        connection = sqlite3.connect(records_path)
+        assert connection.execute("SELECT * FROM rows").fetchall() == [(2, "Adam", "adam@example.com"),
+                                                                        (3, "Eve", None)]
+        connection.close()
+
+        cache_dir = tmp_path / "cache"
+        cache_dir.mkdir()
+        with XlsxCache(str(cache_dir / "cache.sqlite3")) as cache:
+            assert cache.ingest([first], workers=2)["datasets"]["people"]["records"] == 2
+            with pytest.raises(SchemaMismatch):
+                cache.ingest([first, second], workers=1)
+        assert os.listdir(cache_dir) == ["cache.sqlite3"]